@@ -0,0 +1,65 @@
+"""Per-sample cost of RXMessage.process against BatchLineParser
+
+    python -m benchmarks.parser_benchmark [--lines N] [--batch N]
+
+Both sides turn the same text lines into timestamped samples: the slow path
+processes and offsets one RXMessage per line, the batch parser parses each
+read-sized batch of lines into arrays and offsets them at once.
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from src.line_parser import BatchLineParser
+from src.message_classes import RXMessage
+
+
+def make_lines(n_lines: int, n_channels: int, n_statuses: int = 1):
+    lines = []
+    for i in range(n_lines):
+        pairs = [f"ch{c}:{random.uniform(-100, 100):.4f}" for c in range(n_channels)]
+        pairs += [f"!s{s}:{random.random() < 0.01}" for s in range(n_statuses)]
+        lines.append("u" + str(i * 100) + "::" + ",".join(pairs))
+    return lines
+
+
+def bench_process(lines, start: datetime) -> float:
+    t = time.perf_counter()
+    for line in lines:
+        message = RXMessage(line)
+        message.process()
+        message.apply_offset(start)
+    return time.perf_counter() - t
+
+
+def bench_batch(lines, start: datetime, batch_size: int) -> float:
+    parser = BatchLineParser()
+    t = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        batches, failed = parser.parse(lines[i : i + batch_size])
+        for batch in batches:
+            batch.apply_offset(start)
+    return time.perf_counter() - t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=256, help="lines per read")
+    args = parser.parse_args(argv)
+
+    start = datetime.now()
+    print(f"{'channels':>8} {'process us':>11} {'batch us':>9} {'speedup':>8}")
+    for n_channels in (1, 4, 8, 16):
+        lines = make_lines(args.lines, n_channels)
+        # Best of a few runs, the first one also warms up the caches
+        slow = min(bench_process(lines, start) for i in range(3))
+        fast = min(bench_batch(lines, start, args.batch) for i in range(3))
+        slow *= 1e6 / len(lines)
+        fast *= 1e6 / len(lines)
+        print(f"{n_channels:>8} {slow:>11.3f} {fast:>9.3f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""End-to-end throughput and latency of the live plotting pipeline
+
+    python -m benchmarks.pipeline_benchmark [--channels 1 4 16]
+        [--rates 1000 10000 50000] [--seconds 5] [--wire-format text]
+        [--out results.json]
+        [--compare previous.json]
+
+Every run starts a VirtualDevice on a pseudo-terminal and the full GUI with
+QT_QPA_PLATFORM=offscreen, connects to the device and lets samples flow
+through SerialClass, the shared ring buffer, LivePlotter and the paint of the
+plot. Each channel count and rate runs in a fresh process, so the peak RSS is
+that run's. CPU and memory of the device and serial processes are read from
+/proc, so those numbers are Linux only.
+
+Per run it reports:
+    throughput      samples per second that reached the plotter
+    dropped         samples the device sent that never reached the plotter
+    latency         device timestamp to the plotter reading the sample, and
+                    device timestamp of the newest plotted sample to the paint
+    cpu             percent of one core per process, and per stage of the GUI
+    peak_rss_mb     peak resident memory of the GUI and serial processes
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+RESULT_PREFIX = "RESULT "
+
+
+def _proc_cpu_seconds(pid: int) -> float:
+    """User plus system CPU seconds of a process, None off Linux"""
+    try:
+        with open("/proc/" + str(pid) + "/stat") as file:
+            # The command name may hold spaces, the fields after it can't
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def _proc_peak_rss_mb(pid: int) -> float:
+    """Peak resident memory of a process in MB, None off Linux"""
+    try:
+        with open("/proc/" + str(pid) + "/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _percentiles(values, points=(50, 99)) -> dict:
+    import numpy as np
+
+    if len(values) == 0:
+        return {"p" + str(point): None for point in points}
+    values = np.concatenate(values) if isinstance(values, list) else values
+    return {
+        "p" + str(point): round(float(np.percentile(values, point)), 3)
+        for point in points
+    }
+
+
+class _StageTimer:
+    """CPU time of the GUI thread spent in each instrumented method"""
+
+    def __init__(self) -> None:
+        self.seconds = {}
+
+    def wrap(self, cls, name: str, stage: str):
+        method = getattr(cls, name)
+        self.seconds[stage] = 0
+
+        def timed(*args, **kwargs):
+            start = time.thread_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.thread_time() - start
+
+        setattr(cls, name, timed)
+
+    def snapshot(self) -> dict:
+        return dict(self.seconds)
+
+
+def run_one(
+    n_channels: int,
+    rate: float,
+    seconds: float,
+    wire_format: str = "text",
+    warmup: float = 1,
+) -> dict:
+    """Run the pipeline against one simulated device and measure it
+
+    Must run in a process of its own, it instruments the GUI classes.
+    """
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    import numpy as np
+    from PyQt5.QtCore import QEvent, QObject, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    from src.plotting_subclass import LivePlotter
+    from src.shared_buffers import SharedRingBuffer
+    from src.smart_serial_plottter import SmartSerialPloter
+    from src.virtual_device import VirtualDevice
+
+    device = VirtualDevice(rate, n_channels, wire_format=wire_format)
+    port = device.start()
+
+    stages = _StageTimer()
+    stages.wrap(LivePlotter, "process_ring", "ring_read")
+    stages.wrap(LivePlotter, "process_queue", "plot_queue")
+    stages.wrap(LivePlotter, "update_plot", "plot_update")
+    stages.wrap(SmartSerialPloter, "serial_callback", "rx_queue")
+
+    state = {"zero_ns": None, "rows": 0, "paints": 0, "measuring": False}
+    read_latencies = []
+    paint_latencies = []
+
+    def generated_ns(timestamps_ns):
+        """Host time each sample was taken on the device"""
+        return state["device_start_ns"] + (timestamps_ns - state["zero_ns"])
+
+    # Every ring read by the plotter, with when it happened
+    original_read = SharedRingBuffer.read
+
+    def read(ring, cursor):
+        result = original_read(ring, cursor)
+        timestamps = result[0]
+        if state["measuring"] and len(timestamps) > 0:
+            now = time.time_ns()
+            state["rows"] += len(timestamps)
+            read_latencies.append((now - generated_ns(timestamps)) / 1e6)
+        return result
+
+    SharedRingBuffer.read = read
+
+    class PaintFilter(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and state["measuring"]:
+                x = window.plotter.plot_curves[0].getData()[0]
+                if x is not None and len(x) > 0:
+                    newest_ns = int(round(x[-1] * 1e9))
+                    latency = time.time_ns() - generated_ns(newest_ns)
+                    paint_latencies.append(latency / 1e6)
+                    state["paints"] += 1
+            return False
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = SmartSerialPloter()
+    # Never rewritten, closeEvent isn't called
+    window.user_settings["ports"] = []
+    window.user_settings["wire_format"] = wire_format
+    window.user_settings["wire_schema"] = device.schema.as_dict()
+    window.log_to_file_checkbox.setChecked(False)
+    window.get_serial_ports()
+    ports = [str(p.port) for p in window.cur_ports]
+    window.serial_ports.setCurrentIndex(ports.index(port))
+
+    original_start_source = window.start_source
+
+    def start_source(first_batch, curve_keys=None):
+        # Device time zero on the host clock, as the plotter's x values have it
+        first = first_batch[0]
+        state["zero_ns"] = first.timestamp_ns - first.device_elapsed_ns()
+        state["device_start_ns"] = int(device.counters["start_time"] * 1e9)
+        original_start_source(first_batch, curve_keys)
+
+    window.start_source = start_source
+    window.c_dc_handler()
+    paint_filter = PaintFilter()
+    window.plotter.plot_widget.viewport().installEventFilter(paint_filter)
+
+    snapshots = {}
+
+    def snapshot():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return {
+            "time": time.perf_counter(),
+            "sent": device.counters["samples"],
+            "overrun_bytes": device.counters["overrun_bytes"],
+            "parsed": window.serial.get_n_total_messages_read(),
+            "corrupt": window.serial.get_n_corrupt_frames(),
+            "overwritten": window.plotter.n_overwritten,
+            "rows": state["rows"],
+            "paints": state["paints"],
+            "gui_cpu": usage.ru_utime + usage.ru_stime,
+            "device_cpu": _proc_cpu_seconds(device.process.pid),
+            "serial_cpu": _proc_cpu_seconds(window.serial.process.pid),
+            "stages": stages.snapshot(),
+        }
+
+    def start_measuring():
+        state["measuring"] = True
+        snapshots["start"] = snapshot()
+
+    def stop_measuring():
+        state["measuring"] = False
+        snapshots["end"] = snapshot()
+        snapshots["serial_rss"] = _proc_peak_rss_mb(window.serial.process.pid)
+        window.c_dc_handler()
+        window.plotter.ring = None
+        window.serial.close()
+        app.quit()
+
+    QTimer.singleShot(int(warmup * 1000), start_measuring)
+    QTimer.singleShot(int((warmup + seconds) * 1000), stop_measuring)
+    app.exec_()
+    device.stop()
+    SharedRingBuffer.read = original_read
+
+    start, end = snapshots["start"], snapshots["end"]
+    elapsed = end["time"] - start["time"]
+
+    def delta(key):
+        if start[key] == None or end[key] == None:
+            return None
+        return end[key] - start[key]
+
+    def percent(cpu_seconds):
+        return None if cpu_seconds == None else round(100 * cpu_seconds / elapsed, 1)
+
+    stage_cpu = {
+        stage: percent(end["stages"][stage] - start["stages"][stage])
+        for stage in end["stages"]
+    }
+    # Whatever the instrumented stages don't cover, mostly painting
+    stage_cpu["paint_and_other"] = percent(
+        delta("gui_cpu")
+        - sum(end["stages"][s] - start["stages"][s] for s in end["stages"])
+    )
+    sent = delta("sent")
+    plotted = delta("rows")
+    return {
+        "channels": n_channels,
+        "rate": rate,
+        "wire_format": wire_format,
+        "seconds": round(elapsed, 3),
+        "sent": int(sent),
+        "plotted": int(plotted),
+        "throughput": round(plotted / elapsed, 1),
+        # Samples in flight at either end of the window make this approximate
+        "dropped": max(0, int(sent - plotted)),
+        "drop_fraction": round(max(0, sent - plotted) / max(sent, 1), 5),
+        "overrun_bytes": int(delta("overrun_bytes")),
+        "corrupt": int(delta("corrupt")),
+        "ring_overwritten": int(delta("overwritten")),
+        "fps": round(delta("paints") / elapsed, 1),
+        "latency_ms": {
+            "read": _percentiles(read_latencies),
+            "paint": _percentiles(np.array(paint_latencies)),
+        },
+        "cpu_percent": {
+            "device": percent(delta("device_cpu")),
+            "serial_process": percent(delta("serial_cpu")),
+            "gui": percent(delta("gui_cpu")),
+            "gui_stages": stage_cpu,
+        },
+        "peak_rss_mb": {
+            # ru_maxrss is in kB on Linux
+            "gui": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "serial_process": snapshots["serial_rss"],
+        },
+    }
+
+
+def _metadata() -> dict:
+    import numpy as np
+    from PyQt5.QtCore import QT_VERSION_STR
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _run_isolated(
+    n_channels: int, rate: float, seconds: float, wire_format: str
+) -> dict:
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    command = [sys.executable, "-m", "benchmarks.pipeline_benchmark", "--run-one"]
+    command += [str(n_channels), str(rate), str(seconds), wire_format]
+    completed = subprocess.run(command, env=environment, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX) :])
+    raise RuntimeError(
+        "Run with "
+        + str(n_channels)
+        + " channels at "
+        + str(rate)
+        + "/s failed:\n"
+        + completed.stderr[-2000:]
+    )
+
+
+def _print_header():
+    print(
+        f"{'channels':>8} {'rate':>7} {'samples/s':>10} {'dropped':>8}"
+        f" {'read p50/p99 ms':>16} {'paint p50/p99 ms':>17} {'fps':>5}"
+        f" {'cpu ser/gui %':>14} {'rss MB':>7}"
+    )
+
+
+def _print_run(run: dict):
+    read = run["latency_ms"]["read"]
+    paint = run["latency_ms"]["paint"]
+    cpu = run["cpu_percent"]
+    print(
+        f"{run['channels']:>8} {run['rate']:>7g} {run['throughput']:>10.0f}"
+        f" {run['drop_fraction']:>8.2%}"
+        f" {str(read['p50']) + '/' + str(read['p99']):>16}"
+        f" {str(paint['p50']) + '/' + str(paint['p99']):>17}"
+        f" {run['fps']:>5.0f}"
+        f" {str(cpu['serial_process']) + '/' + str(cpu['gui']):>14}"
+        f" {run['peak_rss_mb']['gui']:>7.0f}"
+    )
+
+
+def _run_key(run: dict) -> tuple:
+    return run["channels"], run["rate"], run.get("wire_format", "text")
+
+
+def _compare(previous: dict, runs: list):
+    """Print how each run changed against a previous results file"""
+    before = {_run_key(run): run for run in previous["runs"]}
+    print("\nAgainst " + str(previous["meta"].get("commit")) + ":")
+    for run in runs:
+        old = before.get(_run_key(run))
+        if old == None:
+            continue
+        changes = []
+        for name, new_value, old_value in [
+            ("samples/s", run["throughput"], old["throughput"]),
+            (
+                "paint p99",
+                run["latency_ms"]["paint"]["p99"],
+                old["latency_ms"]["paint"]["p99"],
+            ),
+            ("gui cpu", run["cpu_percent"]["gui"], old["cpu_percent"]["gui"]),
+        ]:
+            if new_value == None or old_value in (None, 0):
+                continue
+            changes.append(f"{name} {100 * (new_value / old_value - 1):+.1f}%")
+        print(f"{run['channels']:>8} {run['rate']:>7g}  " + ", ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--rates", type=float, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--seconds", type=float, default=5, help="measured per run")
+    parser.add_argument("--wire-format", choices=["text", "binary"], default="text")
+    parser.add_argument("--out", default="pipeline_benchmark.json")
+    parser.add_argument("--compare", help="previous results file to compare with")
+    parser.add_argument("--run-one", nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one != None:
+        n_channels, rate, seconds, wire_format = args.run_one
+        result = run_one(int(n_channels), float(rate), float(seconds), wire_format)
+        print(RESULT_PREFIX + json.dumps(result), flush=True)
+        return 0
+
+    _print_header()
+    runs = []
+    for n_channels in args.channels:
+        for rate in args.rates:
+            runs.append(_run_isolated(n_channels, rate, args.seconds, args.wire_format))
+            _print_run(runs[-1])
+    results = {"meta": _metadata(), "runs": runs}
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=2)
+    print("\nSaved " + args.out)
+
+    if args.compare != None:
+        with open(args.compare) as file:
+            _compare(json.load(file), runs)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
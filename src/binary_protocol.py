@@ -0,0 +1,204 @@
+import binascii
+import struct
+
+import numpy as np
+
+from src.message_classes import RXBatch
+
+# SLIP (RFC 1055) framing: frames are delimited by END, and END or ESC bytes
+# inside a frame are replaced by two byte escape sequences
+SLIP_END = b"\xc0"
+SLIP_ESC = b"\xdb"
+SLIP_ESC_END = b"\xdb\xdc"
+SLIP_ESC_ESC = b"\xdb\xdd"
+
+# struct codes allowed for the timestamp, channels and statuses
+FIELD_TYPES = "bBhHiIqQefd?"
+
+CRC_INIT = 0xFFFF
+
+
+def slip_encode(payload: bytes) -> bytes:
+    """Escape a payload and wrap it in END bytes"""
+    escaped = payload.replace(SLIP_ESC, SLIP_ESC_ESC).replace(SLIP_END, SLIP_ESC_END)
+    return SLIP_END + escaped + SLIP_END
+
+
+def slip_decode(frame: bytes) -> bytes:
+    """Undo the escaping of one frame, without its END bytes"""
+    # Every ESC starts an escape pair, so neither replace can match across pairs
+    return frame.replace(SLIP_ESC_END, SLIP_END).replace(SLIP_ESC_ESC, SLIP_ESC)
+
+
+def crc16(data: bytes) -> int:
+    """CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) of data"""
+    return binascii.crc_hqx(data, CRC_INIT)
+
+
+class WireSchema:
+    """Layout of the binary sample frames sent by a device
+
+    Each frame carries one sample as a packed little-endian struct:
+
+        timestamp   device time in "unit" ticks ("m" ms or "u" µs)
+        channels    one field per curve, in order
+        statuses    one field per status, in order, names start with "!"
+        crc         uint16 CRC-16/CCITT-FALSE of every byte before it
+
+    and is SLIP framed on the wire. The schema is the same JSON-friendly dict a
+    device's firmware is written against, for example:
+
+        {"unit": "u", "timestamp": "I",
+         "channels": [["a", "f"], ["b", "f"]], "statuses": [["!fault", "?"]]}
+
+    where the types are struct codes from FIELD_TYPES.
+    """
+
+    def __init__(
+        self, channels: list, statuses: list = None, unit="u", timestamp_type="I"
+    ) -> None:
+        """
+        Args:
+            channels (list): (name, struct code) pairs, one per curve
+            statuses (list, optional): (name, struct code) pairs. Defaults to
+                none.
+            unit (str, optional): Timestamp unit, "m" or "u". Defaults to "u".
+            timestamp_type (str, optional): Timestamp struct code. Defaults to
+                "I", a uint32.
+        """
+        statuses = [] if statuses == None else statuses
+        if unit not in ("m", "u"):
+            raise ValueError("Unknown timestamp unit: " + str(unit))
+        for name, code in [("timestamp", timestamp_type)] + channels + statuses:
+            if len(code) != 1 or code not in FIELD_TYPES:
+                raise ValueError("Unknown type " + str(code) + " for " + str(name))
+        for name, code in statuses:
+            if "!" not in name:
+                raise ValueError("Status names must contain '!': " + str(name))
+
+        self.unit = unit
+        self.timestamp_type = timestamp_type
+        self.channels = [(str(name), code) for name, code in channels]
+        self.statuses = [(str(name), code) for name, code in statuses]
+        self.curve_keys = [name for name, code in self.channels]
+
+        codes = [timestamp_type] + [code for name, code in channels + statuses]
+        self.body = struct.Struct("<" + "".join(codes))
+        self.frame_size = self.body.size + 2
+        # Fields are named by position, channel names may be anything
+        self.dtype = np.dtype(
+            [("timestamp", "<" + timestamp_type)]
+            + [("c" + str(i), "<" + code) for i, (n, code) in enumerate(channels)]
+            + [("s" + str(i), "<" + code) for i, (n, code) in enumerate(statuses)]
+            + [("crc", "<u2")]
+        )
+
+    @classmethod
+    def from_dict(cls, schema: dict) -> "WireSchema":
+        return cls(
+            schema["channels"],
+            schema.get("statuses", []),
+            schema.get("unit", "u"),
+            schema.get("timestamp", "I"),
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "unit": self.unit,
+            "timestamp": self.timestamp_type,
+            "channels": [list(channel) for channel in self.channels],
+            "statuses": [list(status) for status in self.statuses],
+        }
+
+    # struct.Struct can't be pickled, a schema sent to a spawned process is
+    # rebuilt from its fields
+    def __getstate__(self) -> dict:
+        return self.as_dict()
+
+    def __setstate__(self, state: dict):
+        self.__init__(
+            state["channels"], state["statuses"], state["unit"], state["timestamp"]
+        )
+
+    def encode(self, timestamp: int, values: list, statuses: list = ()) -> bytes:
+        """SLIP framed bytes of one sample, as a device would send it"""
+        body = self.body.pack(timestamp, *values, *statuses)
+        return slip_encode(body + struct.pack("<H", crc16(body)))
+
+    def to_batch(self, records: np.ndarray) -> RXBatch:
+        """Turn decoded frames into one RXBatch, without offsets
+
+        Args:
+            records (np.ndarray): Frames as returned by FrameDecoder.feed
+        """
+        values = np.empty((len(records), len(self.channels)))
+        for i in range(len(self.channels)):
+            values[:, i] = records["c" + str(i)]
+        statuses = np.empty((len(records), len(self.statuses)), dtype=object)
+        for i, (name, code) in enumerate(self.statuses):
+            column = records["s" + str(i)]
+            if code == "?":
+                # Same spelling as the text format, which the GUI colours
+                statuses[:, i] = np.where(column, "true", "false")
+            else:
+                statuses[:, i] = column.astype(str)
+        return RXBatch(
+            self.unit,
+            records["timestamp"].astype(np.int64),
+            self.curve_keys,
+            values,
+            [name for name, code in self.statuses],
+            statuses.astype(str),
+        )
+
+
+class FrameDecoder:
+    """Incremental decoder of a SLIP framed stream of WireSchema samples
+
+    Bytes can be fed in chunks of any size, an unfinished frame is kept until
+    the rest arrives. Frames are unescaped with bytes.replace and checked with
+    binascii, then all good frames of a chunk are decoded by one np.frombuffer
+    call. Frames with the wrong length or CRC are dropped and counted.
+    """
+
+    def __init__(self, schema: WireSchema) -> None:
+        self.schema = schema
+        self.partial = b""
+        # Bytes before the first END may be the tail of a frame sent before we
+        # connected, so they are skipped rather than counted as corrupt
+        self.synced = False
+        # An escaped frame is at most twice its size
+        self.max_partial = 2 * schema.frame_size
+
+    def feed(self, data: bytes):
+        """Decode every frame completed by data
+
+        Returns:
+            tuple: (structured array of schema.dtype, number of corrupt frames)
+        """
+        frames = (self.partial + data).split(SLIP_END)
+        self.partial = frames.pop()
+        n_corrupt = 0
+        if len(self.partial) > self.max_partial:
+            # No END in sight, e.g. a device that sends text
+            self.partial = b""
+            n_corrupt += 1
+        if not self.synced and len(frames) > 0:
+            frames[0] = b""
+            self.synced = True
+
+        good = []
+        for frame in frames:
+            if len(frame) == 0:
+                # Back to back END bytes, which senders use to flush line noise
+                continue
+            frame = slip_decode(frame)
+            if len(frame) != self.schema.frame_size or crc16(
+                frame[:-2]
+            ) != int.from_bytes(frame[-2:], "little"):
+                n_corrupt += 1
+                continue
+            good.append(frame)
+
+        records = np.frombuffer(b"".join(good), dtype=self.schema.dtype)
+        return records, n_corrupt
@@ -0,0 +1,169 @@
+import logging
+import multiprocessing
+import queue
+
+from src.shared_buffers import SharedCounters
+
+QUEUE_POLICIES = ["block", "drop_oldest", "drop_newest", "decimate"]
+
+# Bound and policy of each inter-stage queue, overridden per queue by the
+# "queues" setting. The capture log is written before anything is queued, so
+# every policy only sheds what the display gets
+DEFAULT_QUEUE_SETTINGS = {
+    "rx_messages": {"maxsize": 1024, "policy": "drop_oldest"},
+    "tx_messages": {"maxsize": 4096, "policy": "block"},
+    "tx_sent": {"maxsize": 4096, "policy": "drop_oldest"},
+    # Filled and emptied on the GUI thread, where waiting for room can't help
+    "plot_queue": {"maxsize": 100000, "policy": "drop_oldest", "block_timeout": 0},
+}
+
+
+class BoundedQueue:
+    """Queue with a bound and an explicit policy for when it is full
+
+    Policies:
+        block        the producer waits for room, for at most block_timeout
+                     seconds, after which the item is dropped so a consumer that
+                     went away can't hang the producer
+        drop_oldest  the oldest queued item makes room for the new one
+        drop_newest  the new item is dropped
+        decimate     once the queue has been full, only every decimate_factor-th
+                     item is kept until the consumer empties it, making room
+                     like drop_oldest
+
+    Wraps a queue.Queue, or a multiprocessing.Queue when producer and consumer
+    are different processes. Items put and dropped are counted in shared
+    memory, so the consumer's process can show the producer's drops.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        policy: str = "drop_oldest",
+        multiprocess: bool = False,
+        block_timeout: float = 1,
+        decimate_factor: int = 4,
+    ) -> None:
+        if policy not in QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy: " + str(policy))
+        if maxsize < 1:
+            raise ValueError("Queue bound must be at least 1: " + str(maxsize))
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.decimate_factor = decimate_factor
+        if multiprocess:
+            self.queue = multiprocessing.Queue(maxsize)
+        else:
+            self.queue = queue.Queue(maxsize)
+        self.counters = SharedCounters(["put", "dropped"])
+        self.shedding = False
+        self.n_offered = 0
+
+    @classmethod
+    def from_settings(
+        cls, name: str, settings: dict = None, multiprocess: bool = False
+    ) -> "BoundedQueue":
+        """Queue called name, as configured by a "queues" setting
+
+        Args:
+            name (str): Key of DEFAULT_QUEUE_SETTINGS
+            settings (dict, optional): Queue name to a dict of BoundedQueue
+                arguments, e.g. {"plot_queue": {"policy": "decimate"}}.
+                Defaults to DEFAULT_QUEUE_SETTINGS alone.
+        """
+        options = dict(DEFAULT_QUEUE_SETTINGS[name])
+        if settings != None:
+            options.update(settings.get(name, {}))
+        return cls(multiprocess=multiprocess, **options)
+
+    def put(self, item) -> bool:
+        """Queue an item according to the policy
+
+        Returns:
+            bool: False if the item was dropped
+        """
+        if self.policy == "block":
+            try:
+                self.queue.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                if self.counters["dropped"] == 0:
+                    logging.warning("Queue consumer stalled, dropping items")
+                return self._drop()
+            return self._queued()
+
+        if self.policy == "decimate":
+            if self.shedding and self.queue.empty():
+                # The consumer caught up
+                self.shedding = False
+            if self.shedding:
+                self.n_offered += 1
+                if self.n_offered % self.decimate_factor != 0:
+                    return self._drop()
+
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            pass
+        else:
+            return self._queued()
+
+        if self.policy == "drop_newest":
+            return self._drop()
+        if self.policy == "decimate" and not self.shedding:
+            self.shedding = True
+            self.n_offered = 0
+        return self._replace_oldest(item)
+
+    # Callers written against queue.Queue
+    put_nowait = put
+
+    def would_block(self) -> bool:
+        """True if a put would have to wait, for producers that can hold back
+
+        A producer that shares a thread with the consumer can't block, it
+        checks this instead and leaves items upstream.
+        """
+        return self.policy == "block" and self.queue.full()
+
+    def _replace_oldest(self, item) -> bool:
+        try:
+            # Of a multiprocessing queue only the items its feeder thread has
+            # already sent can be taken back
+            self.queue.get(timeout=0.01)
+        except queue.Empty:
+            return self._drop()
+        self._drop()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Another producer took the room
+            return self._drop()
+        return self._queued()
+
+    def _queued(self) -> bool:
+        self.counters.add("put")
+        return True
+
+    def _drop(self) -> bool:
+        self.counters.add("dropped")
+        return False
+
+    def get(self, block: bool = True, timeout: float = None):
+        return self.queue.get(block, timeout)
+
+    def get_nowait(self):
+        return self.queue.get_nowait()
+
+    def empty(self) -> bool:
+        return self.queue.empty()
+
+    def full(self) -> bool:
+        return self.queue.full()
+
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    def n_dropped(self) -> int:
+        """Items dropped since the queue was created"""
+        return int(self.counters["dropped"])
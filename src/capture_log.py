@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+from typing import Iterable
+
+from src.message_classes import Message, RXBatch
+
+LOG_FORMATS = ["jsonl", "columnar"]
+
+
+class JSONLinesLogWriter:
+    """Append-only capture log with one JSON record per line
+
+    The first record is the header written at connect, every following record is
+    a message's json_friendly_object(), for example:
+
+        ["HEADER", {"port": "COM3", "baud": "115200", ...}]
+        ["RX", {"dut_offset": 1706000000.001, "message": "m1::a:1.0"}]
+        ["TX", {"local_t": "1706000000.5", "line_ending": "LF", "message": "go"}]
+
+    Writing a message only formats it and appends it to the file buffer, so the
+    cost per message doesn't depend on how big the file already is. Safe to call
+    from the RX and TX threads at the same time.
+    """
+
+    def __init__(self, path: str, buffer_size: int = 1 << 16) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8", buffering=buffer_size)
+
+    def write_header(self, header: dict):
+        """Write the capture header. Call once, before any message"""
+        self._write_lines([json.dumps(["HEADER", header])])
+
+    def write(self, message: Message):
+        self._write_lines([json.dumps(message.json_friendly_object())])
+
+    def write_many(self, messages: Iterable[Message]):
+        self._write_lines(
+            [json.dumps(message.json_friendly_object()) for message in messages]
+        )
+
+    def write_batch(self, batch: RXBatch):
+        """Write every row of a batch whose offset has been applied"""
+        dut_offsets = (batch.timestamps / 1e9).tolist()
+        self._write_lines(
+            [
+                json.dumps(["RX", {"dut_offset": dut_offset, "message": line}])
+                for dut_offset, line in zip(dut_offsets, batch.raw_lines())
+            ]
+        )
+
+    def _write_lines(self, lines):
+        with self.lock:
+            self.file.write("\n".join(lines) + "\n")
+
+    def flush(self, fsync=False):
+        """Push buffered records to the OS, and to disk if fsync is set"""
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            if fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush(fsync=True)
+        with self.lock:
+            self.file.close()
+
+
+def open_log_writer(
+    base_path: str,
+    log_format: str = "jsonl",
+    max_segment_bytes: int = None,
+    max_segment_seconds: float = None,
+    compression: str = None,
+    value_dtype: str = "f8",
+):
+    """Create the capture log writer for a log format
+
+    Args:
+        base_path (str): Path of the log file without its extension
+        log_format (str, optional): One of LOG_FORMATS. Defaults to "jsonl".
+        max_segment_bytes (int, optional): Split the capture into segments of
+            about this size. Defaults to a single file.
+        max_segment_seconds (float, optional): Split the capture into segments
+            covering this many seconds. Defaults to a single file.
+        compression (str, optional): Compress closed segments with one of
+            capture_segments.COMPRESSIONS. Defaults to no compression.
+        value_dtype (str, optional): Type the columnar format stores channel
+            values as, "f4" halves the file. Defaults to "f8".
+
+    Returns:
+        JSONLinesLogWriter, ColumnarCaptureWriter or RotatingLogWriter: Writer
+            for base_path plus the format's extension, or for a segment set
+            described by base_path.manifest.json
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError("Unknown log format: " + str(log_format))
+    if max_segment_bytes != None or max_segment_seconds != None or compression != None:
+        from src.capture_segments import RotatingLogWriter
+
+        return RotatingLogWriter(
+            base_path,
+            log_format,
+            max_segment_bytes,
+            max_segment_seconds,
+            compression,
+            value_dtype,
+        )
+
+    if log_format == "jsonl":
+        return JSONLinesLogWriter(base_path + ".jsonl")
+    # Imported here so the JSON Lines path doesn't need numpy
+    from src.columnar_capture import ColumnarCaptureWriter
+
+    return ColumnarCaptureWriter(base_path + ".spcap", value_dtype)
+
+
+class JSONLinesLogReader:
+    """Incremental reader for files written by JSONLinesLogWriter
+
+    Records are read one line at a time from a byte offset, so a capture of any
+    size can be streamed or seeked into without loading it.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        self.header = {}
+        self.data_start = 0
+
+        first_record = self._parse(self.file.readline())
+        if first_record != None and first_record[0] == "HEADER":
+            self.header = first_record[1]
+            self.data_start = self.file.tell()
+
+    def _parse(self, line: bytes):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            # Typically the last line of a capture that is still being written
+            return None
+
+    def records(self, offset: int = None):
+        """Yield every record from a byte offset on
+
+        Args:
+            offset (int, optional): Line start to read from, as returned by
+                offset_for_time. Defaults to the first record after the header.
+        """
+        self.file.seek(self.data_start if offset == None else offset)
+        for line in self.file:
+            record = self._parse(line)
+            if record != None:
+                yield record
+
+    def _rx_time(self, line: bytes):
+        record = self._parse(line)
+        if record == None or record[0] != "RX":
+            return None
+        return record[1]["dut_offset"]
+
+    def offset_for_time(self, timestamp: float) -> int:
+        """Byte offset of the first RX record at or after a timestamp
+
+        Bisects on byte offsets, so only a few lines are parsed per seek.
+
+        Args:
+            timestamp (float): Device time in seconds since the epoch
+
+        Returns:
+            int: Offset of the matching line, or the end of the file
+        """
+        low = self.data_start
+        high = os.path.getsize(self.path)
+        # Every RX record that starts before low is earlier than timestamp
+        while high - low > 1 << 16:
+            middle = (low + high) // 2
+            self.file.seek(middle)
+            self.file.readline()
+            found_time = None
+            while self.file.tell() < high:
+                line = self.file.readline()
+                if len(line) == 0:
+                    break
+                found_time = self._rx_time(line)
+                if found_time != None:
+                    break
+
+            if found_time == None or found_time >= timestamp:
+                high = middle
+            else:
+                low = self.file.tell()
+
+        self.file.seek(low)
+        while True:
+            offset = self.file.tell()
+            line = self.file.readline()
+            if len(line) == 0:
+                return offset
+            found_time = self._rx_time(line)
+            if found_time != None and found_time >= timestamp:
+                return offset
+
+    def close(self):
+        self.file.close()
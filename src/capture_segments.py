@@ -0,0 +1,269 @@
+import bz2
+import concurrent.futures
+import gzip
+import json
+import logging
+import lzma
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Iterable
+
+from src.message_classes import Message, RXBatch, RXMessage
+
+# Compression applied to closed segments: (opener, file extension)
+COMPRESSIONS = {
+    "gzip": (gzip.open, ".gz"),
+    "lzma": (lzma.open, ".xz"),
+    "bz2": (bz2.open, ".bz2"),
+}
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class RotatingLogWriter:
+    """Capture log split into size- or time-bounded segments
+
+    Wraps the writer from capture_log.open_log_writer. Every segment is a full
+    capture of its own, header included, named <base>.<index>.<extension>.
+    Closed segments are compressed on a background thread, and
+    <base>.manifest.json lists every segment with its time span so readers can
+    treat the set as one capture. Has the same interface as JSONLinesLogWriter.
+
+    Segments are only rotated when flushed, so a segment overshoots max_bytes
+    by at most one flush interval of data.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        log_format: str = "jsonl",
+        max_bytes: int = None,
+        max_seconds: float = None,
+        compression: str = None,
+        value_dtype: str = "f8",
+    ) -> None:
+        """
+        Args:
+            base_path (str): Path of the capture without extension
+            log_format (str, optional): Format of each segment. Defaults to
+                "jsonl".
+            max_bytes (int, optional): Rotate once a segment is this big
+            max_seconds (float, optional): Rotate once a segment is this old
+            compression (str, optional): One of COMPRESSIONS, None to keep
+                closed segments uncompressed
+            value_dtype (str, optional): Value type of columnar segments.
+                Defaults to "f8".
+        """
+        if compression != None and compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression: " + str(compression))
+
+        self.base_path = base_path
+        self.log_format = log_format
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compression = compression
+        self.value_dtype = value_dtype
+        self.manifest_path = base_path + MANIFEST_SUFFIX
+
+        self.lock = threading.RLock()
+        self.compressor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.header = {}
+        self.segments = []
+        self.writer = None
+        self._open_segment()
+
+    def _open_segment(self):
+        # Imported here because capture_log creates this class lazily as well
+        from src.capture_log import open_log_writer
+
+        index = len(self.segments)
+        self.writer = open_log_writer(
+            self.base_path + "." + str(index).zfill(4),
+            self.log_format,
+            value_dtype=self.value_dtype,
+        )
+        self.segment_opened = time.monotonic()
+        self.segments.append(
+            {
+                "file": os.path.basename(self.writer.path),
+                "compression": None,
+                "closed": False,
+                "t_first": None,
+                "t_last": None,
+                "n_samples": 0,
+                "bytes": 0,
+            }
+        )
+        if self.header != {}:
+            self.writer.write_header(dict(self.header, segment=index))
+        self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            "format": self.log_format,
+            "header": self.header,
+            "segments": self.segments,
+        }
+        # Replace atomically so a reader never sees a half-written manifest
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(manifest, file, indent=4)
+        os.replace(temp_path, self.manifest_path)
+
+    def _track(self, timestamp: float, n_samples: int = 1):
+        segment = self.segments[-1]
+        if segment["t_first"] == None:
+            segment["t_first"] = timestamp
+        segment["t_last"] = timestamp
+        segment["n_samples"] += n_samples
+
+    def write_header(self, header: dict):
+        with self.lock:
+            self.header = dict(header)
+            self.writer.write_header(dict(header, segment=len(self.segments) - 1))
+            self._write_manifest()
+
+    def write(self, message: Message):
+        self.write_many([message])
+
+    def write_many(self, messages: Iterable[Message]):
+        with self.lock:
+            messages = list(messages)
+            self.writer.write_many(messages)
+            for message in messages:
+                if isinstance(message, RXMessage):
+                    self._track(message.timestamp_ns / 1e9)
+
+    def write_batch(self, batch: RXBatch):
+        with self.lock:
+            self.writer.write_batch(batch)
+            self._track(int(batch.timestamps[0]) / 1e9, 0)
+            self._track(int(batch.timestamps[-1]) / 1e9, len(batch))
+
+    def write_samples(self, channels, timestamps, values):
+        with self.lock:
+            self.writer.write_samples(channels, timestamps, values)
+            if len(timestamps) > 0:
+                self._track(int(timestamps[0]) / 1e9, 0)
+                self._track(int(timestamps[-1]) / 1e9, len(timestamps))
+
+    def flush(self, fsync=False):
+        """Flush the open segment, rotating to a new one if it is full"""
+        with self.lock:
+            self.writer.flush(fsync)
+            if self.writer.file.closed:
+                return
+            segment_bytes = os.fstat(self.writer.file.fileno()).st_size
+            self.segments[-1]["bytes"] = segment_bytes
+            age = time.monotonic() - self.segment_opened
+            if (self.max_bytes != None and segment_bytes >= self.max_bytes) or (
+                self.max_seconds != None and age >= self.max_seconds
+            ):
+                self._rotate()
+
+    def _rotate(self):
+        self._close_segment()
+        self._open_segment()
+
+    def _close_segment(self):
+        self.writer.close()
+        index = len(self.segments) - 1
+        self.segments[index]["bytes"] = os.path.getsize(self.writer.path)
+        self.segments[index]["closed"] = True
+        self._write_manifest()
+        if self.compression != None:
+            self.compressor.submit(self._compress, index, self.writer.path)
+
+    def _compress(self, index: int, path: str):
+        opener, extension = COMPRESSIONS[self.compression]
+        try:
+            # Compress next to the original and swap the manifest entry over only
+            # once the compressed file is complete
+            with open(path, "rb") as source, opener(path + ".tmp", "wb") as target:
+                shutil.copyfileobj(source, target, 1 << 20)
+            os.replace(path + ".tmp", path + extension)
+            with self.lock:
+                segment = self.segments[index]
+                segment["file"] = os.path.basename(path + extension)
+                segment["compression"] = self.compression
+                segment["bytes"] = os.path.getsize(path + extension)
+                self._write_manifest()
+            os.remove(path)
+        except OSError as e:
+            logging.error(f"Error compressing log segment {path}: {e}")
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+        # Wait for the last segments to be compressed
+        self.compressor.shutdown(wait=True)
+
+
+class SegmentedCaptureReader:
+    """Reads a segment set listed in a manifest as one continuous capture
+
+    Segments are opened one at a time with log_replay.open_capture.
+    Compressed segments are decompressed to a temporary file first, which
+    costs at most one segment of disk space at a time.
+    """
+
+    def __init__(self, manifest_path: str) -> None:
+        self.path = manifest_path
+        self.directory = os.path.dirname(manifest_path)
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        self.log_format = manifest["format"]
+        self.header = manifest["header"]
+        self.segments = manifest["segments"]
+        self.temp_dir = None
+
+    def n_samples(self) -> int:
+        return sum(segment["n_samples"] for segment in self.segments)
+
+    def open_segment(self, segment: dict):
+        """Open one segment of the set
+
+        Returns:
+            ColumnarCaptureReader or JSONLinesLogReader: Reader for the segment
+        """
+        # Imported here since log_replay opens manifests through this class
+        from src.log_replay import open_capture
+
+        path = os.path.join(self.directory, segment["file"])
+        if segment["compression"] == None:
+            return open_capture(path)
+
+        if self.temp_dir == None:
+            self.temp_dir = tempfile.mkdtemp(prefix="serial_plotter_segment_")
+        opener, extension = COMPRESSIONS[segment["compression"]]
+        temp_path = os.path.join(self.temp_dir, segment["file"][: -len(extension)])
+        with opener(path, "rb") as source, open(temp_path, "wb") as target:
+            shutil.copyfileobj(source, target, 1 << 20)
+        return open_capture(temp_path)
+
+    def iter_segments(self, t_start: float = None):
+        """Yield a reader for each segment in order, closing the previous one
+
+        Args:
+            t_start (float, optional): Skip segments that end before this time,
+                in seconds since the epoch
+        """
+        for segment in self.segments:
+            if t_start != None and segment["t_last"] != None:
+                if segment["t_last"] < t_start:
+                    continue
+            reader = self.open_segment(segment)
+            try:
+                yield reader
+            finally:
+                reader.close()
+                if segment["compression"] != None:
+                    os.remove(reader.path)
+
+    def close(self):
+        if self.temp_dir != None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
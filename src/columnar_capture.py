@@ -0,0 +1,371 @@
+import json
+import os
+import struct
+import threading
+from typing import Iterable, List
+
+import numpy as np
+
+from src.message_classes import Message, RXBatch, RXMessage
+
+MAGIC = b"SPCAP01\n"
+
+# Every record starts with its kind and the byte length of its payload
+RECORD_HEADER = struct.Struct("<4s4xQ")
+# n_rows, n_channels, first timestamp, last timestamp
+BLOCK_HEADER = struct.Struct("<IIqq")
+
+KIND_HEADER = b"HEAD"
+KIND_CHANNELS = b"CHAN"
+KIND_EVENT = b"EVNT"
+KIND_BLOCK = b"BLCK"
+
+
+def _padding(n_bytes: int) -> int:
+    """Bytes needed to keep the next record 8-byte aligned"""
+    return -n_bytes % 8
+
+
+class ColumnarBlock:
+    """Index entry for one block of samples in a columnar capture
+
+    Attributes:
+        offset (int): File offset of the block's timestamp column
+        n_rows (int): Number of samples in the block
+        channels (list(str)): Channel names, in column order
+        t_first (int): First timestamp in the block, in nanoseconds
+        t_last (int): Last timestamp in the block, in nanoseconds
+        mins (np.ndarray): Minimum of each channel over the block
+        maxs (np.ndarray): Maximum of each channel over the block
+    """
+
+    def __init__(self, offset, n_rows, channels, t_first, t_last, mins, maxs):
+        self.offset = offset
+        self.n_rows = n_rows
+        self.channels = channels
+        self.t_first = t_first
+        self.t_last = t_last
+        self.mins = mins
+        self.maxs = maxs
+
+
+class ColumnarCaptureWriter:
+    """Binary capture log storing samples as fixed-size blocks of columns
+
+    The file is a magic string followed by records. Each record is a
+    RECORD_HEADER followed by its payload, padded to 8 bytes:
+
+        HEAD  JSON capture header (port, desc, hwid, baud, local_t_connect, ...)
+        CHAN  JSON list of channel names used by the blocks that follow
+        EVNT  JSON json_friendly_object() of a TX message or a status change
+        BLCK  BLOCK_HEADER, per-channel min and max (float64), then the block's
+              int64 nanosecond timestamps and one value column per channel
+
+    Because every block carries its time span and per-channel min/max, a reader
+    can memory-map the file and slice it by time without parsing any values.
+    Has the same interface as JSONLinesLogWriter.
+    """
+
+    def __init__(
+        self, path: str, value_dtype: str = "f8", block_rows: int = 4096
+    ) -> None:
+        self.path = path
+        self.value_dtype = np.dtype(value_dtype).newbyteorder("<")
+        self.block_rows = block_rows
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+
+        self.channels = None
+        self.last_statuses = None
+        # Samples not written yet, as array chunks joined when a block is written
+        self.pending_timestamps = []
+        self.pending_values = []
+        self.n_pending = 0
+
+    def _write_record(self, kind: bytes, payload: bytes):
+        self.file.write(RECORD_HEADER.pack(kind, len(payload)))
+        self.file.write(payload)
+        self.file.write(b"\0" * _padding(len(payload)))
+
+    def _write_json(self, kind: bytes, obj):
+        self._write_record(kind, json.dumps(obj).encode("utf-8"))
+
+    def write_header(self, header: dict):
+        """Write the capture header. Call once, before any message"""
+        header = dict(header)
+        header.update(
+            {"value_dtype": self.value_dtype.str, "block_rows": self.block_rows}
+        )
+        with self.lock:
+            self._write_json(KIND_HEADER, header)
+
+    def write(self, message: Message):
+        self.write_many([message])
+
+    def write_many(self, messages: Iterable[Message]):
+        with self.lock:
+            for message in messages:
+                if not isinstance(message, RXMessage):
+                    self._write_json(KIND_EVENT, message.json_friendly_object())
+                    continue
+
+                statuses = message.get_statuses()
+                if statuses != self.last_statuses:
+                    self.last_statuses = statuses
+                    self._write_status_event(message.timestamp_ns / 1e9, statuses)
+
+                self._append_sample(
+                    message.as_curve_keys(),
+                    message.dut_offset_ns(),
+                    message.as_values(),
+                )
+
+    def write_batch(self, batch: RXBatch):
+        """Write every row of a batch whose offset has been applied"""
+        with self.lock:
+            rows = range(len(batch)) if len(batch.status_keys) > 0 else [0]
+            for row in rows:
+                statuses = batch.row_statuses(row)
+                if statuses != self.last_statuses:
+                    self.last_statuses = statuses
+                    self._write_status_event(batch.timestamps[row] / 1e9, statuses)
+            self._append_samples(batch.curve_keys, batch.timestamps, batch.values)
+
+    def _write_status_event(self, dut_offset: float, statuses: list):
+        self._write_json(
+            KIND_EVENT,
+            ["STATUS", {"dut_offset": dut_offset, "statuses": dict(statuses)}],
+        )
+
+    def write_samples(self, channels: List[str], timestamps, values):
+        """Append many samples that share one channel layout
+
+        Args:
+            channels (list(str)): Channel names, in column order
+            timestamps (np.ndarray): int64 nanosecond timestamps, shape (n,)
+            values (np.ndarray): Channel values, shape (n, len(channels))
+        """
+        with self.lock:
+            self._append_samples(channels, timestamps, values)
+
+    def _append_sample(self, channels, timestamp, values):
+        self._append_samples(channels, [timestamp], [values])
+
+    def _append_samples(self, channels, timestamps, values):
+        if channels != self.channels:
+            self._write_block(self.n_pending)
+            self.channels = list(channels)
+            self._write_json(KIND_CHANNELS, self.channels)
+
+        # Copies, the caller may reuse its arrays
+        self.pending_timestamps.append(np.array(timestamps, dtype="<i8"))
+        self.pending_values.append(np.array(values, dtype=self.value_dtype))
+        self.n_pending += len(self.pending_timestamps[-1])
+        while self.n_pending >= self.block_rows:
+            self._write_block(self.block_rows)
+
+    def _join_pending(self):
+        """Pending samples as one timestamp and one value array"""
+        if len(self.pending_timestamps) > 1:
+            self.pending_timestamps = [np.concatenate(self.pending_timestamps)]
+            self.pending_values = [np.concatenate(self.pending_values)]
+        return self.pending_timestamps[0], self.pending_values[0]
+
+    def _write_block(self, n_rows: int):
+        """Write the oldest n_rows pending samples as one block"""
+        if n_rows == 0:
+            return
+
+        pending_timestamps, pending_values = self._join_pending()
+        timestamps = pending_timestamps[:n_rows]
+        # Columns are stored one after the other
+        values = np.ascontiguousarray(pending_values[:n_rows].T)
+        n_channels = values.shape[0]
+        # fmin/fmax skip NaN without warning about all-NaN columns
+        mins = np.fmin.reduce(values, axis=1)
+        maxs = np.fmax.reduce(values, axis=1)
+
+        payload = b"".join(
+            [
+                BLOCK_HEADER.pack(
+                    n_rows, n_channels, int(timestamps[0]), int(timestamps[-1])
+                ),
+                mins.astype("<f8").tobytes(),
+                maxs.astype("<f8").tobytes(),
+                timestamps.tobytes(),
+                values.tobytes(),
+            ]
+        )
+        self._write_record(KIND_BLOCK, payload)
+        # The rest stays a view of the joined chunk, later blocks slice it again
+        self.pending_timestamps = [pending_timestamps[n_rows:]]
+        self.pending_values = [pending_values[n_rows:]]
+        self.n_pending -= n_rows
+
+    def flush(self, fsync=False):
+        """Write out the partial block, then push it to the OS (and disk if fsync)"""
+        with self.lock:
+            if self.file.closed:
+                return
+            self._write_block(self.n_pending)
+            self.file.flush()
+            if fsync:
+                os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush(fsync=True)
+        with self.lock:
+            self.file.close()
+
+
+class ColumnarCaptureReader:
+    """Memory-mapped reader for files written by ColumnarCaptureWriter
+
+    Opening a capture only walks the record headers to build the block index,
+    sample data is paged in from the mapping when it is sliced. A record cut
+    short by a crash ends the index instead of raising.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.header = {}
+        self.events = []
+        self.blocks: List[ColumnarBlock] = []
+
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(path + " is not a columnar capture")
+            self._scan(file, os.fstat(file.fileno()).st_size)
+
+        self.value_dtype = np.dtype(self.header.get("value_dtype", "<f8"))
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+
+    def _scan(self, file, file_size):
+        channels = []
+        while True:
+            raw_header = file.read(RECORD_HEADER.size)
+            if len(raw_header) < RECORD_HEADER.size:
+                return
+            kind, length = RECORD_HEADER.unpack(raw_header)
+            start = file.tell()
+            if start + length > file_size:
+                return
+
+            if kind == KIND_BLOCK:
+                n_rows, n_channels, t_first, t_last = BLOCK_HEADER.unpack(
+                    file.read(BLOCK_HEADER.size)
+                )
+                stats = np.frombuffer(file.read(16 * n_channels), dtype="<f8")
+                self.blocks.append(
+                    ColumnarBlock(
+                        start + BLOCK_HEADER.size + 16 * n_channels,
+                        n_rows,
+                        channels,
+                        t_first,
+                        t_last,
+                        stats[:n_channels],
+                        stats[n_channels:],
+                    )
+                )
+            else:
+                obj = json.loads(file.read(length).decode("utf-8"))
+                if kind == KIND_HEADER:
+                    self.header = obj
+                elif kind == KIND_CHANNELS:
+                    channels = obj
+                elif kind == KIND_EVENT:
+                    self.events.append(obj)
+
+            file.seek(start + length + _padding(length))
+
+    def n_samples(self) -> int:
+        return sum(block.n_rows for block in self.blocks)
+
+    def channels(self) -> List[str]:
+        """Channel names of the first block, in column order"""
+        if len(self.blocks) == 0:
+            return []
+        return list(self.blocks[0].channels)
+
+    def time_span(self):
+        """First and last sample timestamps in nanoseconds, or None if empty"""
+        if len(self.blocks) == 0:
+            return None
+        return self.blocks[0].t_first, self.blocks[-1].t_last
+
+    def block_arrays(self, block: ColumnarBlock):
+        """Zero-copy views of one block
+
+        Returns:
+            tuple: (timestamps shape (n_rows,), values shape (n_channels, n_rows))
+        """
+        timestamps = self.data[block.offset : block.offset + 8 * block.n_rows]
+        values_offset = block.offset + 8 * block.n_rows
+        values_size = self.value_dtype.itemsize * block.n_rows * len(block.channels)
+        values = self.data[values_offset : values_offset + values_size]
+        return (
+            timestamps.view("<i8"),
+            values.view(self.value_dtype).reshape(len(block.channels), block.n_rows),
+        )
+
+    def blocks_in_range(self, t_start=None, t_end=None) -> List[ColumnarBlock]:
+        """Blocks whose time span overlaps [t_start, t_end], using only the index"""
+        return [
+            block
+            for block in self.blocks
+            if (t_start == None or block.t_last >= t_start)
+            and (t_end == None or block.t_first <= t_end)
+        ]
+
+    def slice(self, t_start=None, t_end=None, channels=None):
+        """Copy out the samples with t_start <= timestamp <= t_end
+
+        Args:
+            t_start (int, optional): First timestamp in nanoseconds. Defaults to
+                the start of the capture.
+            t_end (int, optional): Last timestamp in nanoseconds. Defaults to the
+                end of the capture.
+            channels (list(str), optional): Columns to return. Defaults to the
+                channels of the first block in range. Channels a block doesn't
+                have are filled with NaN.
+
+        Returns:
+            tuple: (int64 timestamps shape (n,), float64 values shape
+                (n, len(channels)), channel names)
+        """
+        blocks = self.blocks_in_range(t_start, t_end)
+        if channels == None:
+            channels = list(blocks[0].channels) if len(blocks) > 0 else []
+
+        timestamp_parts = []
+        value_parts = []
+        for block in blocks:
+            timestamps, values = self.block_arrays(block)
+            first = 0
+            last = block.n_rows
+            if t_start != None and block.t_first < t_start:
+                first = int(np.searchsorted(timestamps, t_start, side="left"))
+            if t_end != None and block.t_last > t_end:
+                last = int(np.searchsorted(timestamps, t_end, side="right"))
+            if last <= first:
+                continue
+
+            part = np.full((last - first, len(channels)), np.nan)
+            for column, name in enumerate(channels):
+                if name in block.channels:
+                    row = block.channels.index(name)
+                    part[:, column] = values[row, first:last]
+            timestamp_parts.append(np.array(timestamps[first:last]))
+            value_parts.append(part)
+
+        if len(timestamp_parts) == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, len(channels))), channels
+        return np.concatenate(timestamp_parts), np.concatenate(value_parts), channels
+
+    def close(self):
+        # The mapping itself closes once no sliced view references it
+        self.data = None
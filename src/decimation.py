@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def visible_slice(x: np.ndarray, x_min: float, x_max: float) -> slice:
+    """Indices of the sorted x inside [x_min, x_max], plus one on either side
+
+    The extra point on each side keeps the line running to the edges of the
+    view instead of stopping at the first sample inside it.
+    """
+    start = max(np.searchsorted(x, x_min, side="left") - 1, 0)
+    stop = min(np.searchsorted(x, x_max, side="right") + 1, len(x))
+    return slice(start, stop)
+
+
+def minmax_decimate(
+    x: np.ndarray, y: np.ndarray, x_min: float, x_max: float, n_pixels: int
+):
+    """Reduce a curve to what a view n_pixels wide can show
+
+    The samples inside the view are split into one bucket per pixel column,
+    and each bucket becomes a vertical stroke from its minimum to its
+    maximum, drawn at the bucket's first sample. A single sample spike still
+    reaches its full height, and the result is at most two points per
+    column however many samples the view holds.
+
+    Args:
+        x (np.ndarray): Sorted sample times
+        y (np.ndarray): Sample values
+        x_min (float): Left edge of the view
+        x_max (float): Right edge of the view
+        n_pixels (int): Width of the view in pixels
+
+    Returns:
+        tuple: (x, y) arrays, views of the input if it needs no decimation
+    """
+    return minmax_columns(x, y, y, x_min, x_max, n_pixels)
+
+
+def minmax_columns(
+    x: np.ndarray,
+    y_min: np.ndarray,
+    y_max: np.ndarray,
+    x_min: float,
+    x_max: float,
+    n_pixels: int,
+):
+    """minmax_decimate of buckets that already have a minimum and a maximum
+
+    Args:
+        x (np.ndarray): Sorted bucket start times
+        y_min (np.ndarray): Minimum of each bucket
+        y_max (np.ndarray): Maximum of each bucket, y_min itself for samples
+        x_min (float): Left edge of the view
+        x_max (float): Right edge of the view
+        n_pixels (int): Width of the view in pixels
+
+    Returns:
+        tuple: (x, y) arrays
+    """
+    samples = y_min is y_max
+    visible = visible_slice(x, x_min, x_max)
+    x = x[visible]
+    y_min = y_min[visible]
+    y_max = y_max[visible]
+    n_pixels = max(int(n_pixels), 1)
+    if len(x) <= 2 * n_pixels or x_max <= x_min:
+        if samples:
+            return x, y_min
+        # Too few buckets to merge, each one is a stroke of its own
+        starts = np.arange(len(x))
+    else:
+        columns = np.floor((x - x_min) * (n_pixels / (x_max - x_min)))
+        # Start of every run of buckets in the same column, buckets outside
+        # the view included as columns of their own
+        starts = np.flatnonzero(np.diff(columns, prepend=np.nan) != 0)
+        y_min = np.minimum.reduceat(y_min, starts)
+        y_max = np.maximum.reduceat(y_max, starts)
+
+    x_out = np.repeat(x[starts], 2)
+    y_out = np.empty(2 * len(starts), dtype=np.result_type(y_min, y_max))
+    y_out[0::2] = y_min
+    y_out[1::2] = y_max
+    return x_out, y_out
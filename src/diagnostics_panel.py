@@ -0,0 +1,108 @@
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QColor, QFont
+from PyQt5.QtWidgets import (
+    QFileDialog,
+    QHBoxLayout,
+    QLabel,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from src.metrics import MetricsRegistry
+
+# A stage busier than this fraction of a core is marked as the bottleneck
+BUSY_FRACTION = 0.5
+
+
+class DiagnosticsPanel(QWidget):
+    """Window listing every metric of a MetricsRegistry with its rate
+
+    Counters show their value and how fast they grow. For the _seconds_total
+    counters that rate is the share of a core the stage keeps busy, and the
+    busiest stage is highlighted, which is the one to look at when a capture
+    falls behind.
+    """
+
+    def __init__(self, registry: MetricsRegistry, interval_ms: int = 500) -> None:
+        super().__init__()
+        self.registry = registry
+        self.previous = {}
+        self.previous_time = None
+
+        self.setWindowTitle("Diagnostics")
+        self.resize(520, 560)
+        layout = QVBoxLayout(self)
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(["Metric", "Value", "Per second"])
+        self.table.verticalHeader().setVisible(False)
+        self.table.setFont(QFont("Courier New", 10))
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+
+        buttons_layout = QHBoxLayout()
+        self.bottleneck_label = QLabel("")
+        export_button = QPushButton("Export...")
+        export_button.clicked.connect(self.export)
+        buttons_layout.addWidget(self.bottleneck_label)
+        buttons_layout.addStretch()
+        buttons_layout.addWidget(export_button)
+        layout.addLayout(buttons_layout)
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(interval_ms)
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        values = self.registry.collect()
+        now = time.perf_counter()
+        rates = {}
+        if self.previous_time != None:
+            dt = now - self.previous_time
+            for name, value in values.items():
+                if self.registry.metrics[name].kind == "counter":
+                    # A counter that went down belongs to a restarted stage
+                    change = value - self.previous.get(name, value)
+                    rates[name] = max(change, 0) / dt
+        self.previous = values
+        self.previous_time = now
+
+        busiest = None
+        for name, rate in rates.items():
+            if name.endswith("_seconds_total") and rate >= BUSY_FRACTION:
+                if busiest == None or rate > rates[busiest]:
+                    busiest = name
+        self.bottleneck_label.setText(
+            "" if busiest == None else "Bottleneck: " + busiest[: -len("_total")]
+        )
+
+        self.table.setRowCount(len(values))
+        for row, (name, value) in enumerate(values.items()):
+            rate = ""
+            if name in rates:
+                if name.endswith("_seconds_total"):
+                    rate = f"{100 * rates[name]:.1f}% busy"
+                else:
+                    rate = f"{rates[name]:.1f}"
+            cells = [name, f"{value:.6g}", rate]
+            for column, text in enumerate(cells):
+                item = QTableWidgetItem(text)
+                item.setToolTip(self.registry.metrics[name].help)
+                if name == busiest:
+                    item.setBackground(QColor("orange"))
+                self.table.setItem(row, column, item)
+        self.table.resizeColumnToContents(0)
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export metrics", "metrics.prom", "Prometheus text (*.prom)"
+        )
+        if path != "":
+            self.registry.write_prometheus_file(path)
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+# Rows a column file first has room for, it doubles whenever it is full
+INITIAL_DISK_ROWS = 1 << 16
+
+
+class DiskBuffer:
+    """Every row of a growing series, in memory-mapped files
+
+    Each column is a file of its own, so a column is one contiguous array
+    that searchsorted can bisect and a slice of which only pages in the rows
+    it covers. The operating system decides how much of it stays in memory,
+    which lets the history outgrow RAM. No file stays open, only the maps,
+    so a history of many curves and levels doesn't run out of descriptors.
+
+    Arrays returned by column() stay valid after later appends, a file that
+    grows is mapped anew and the old map lives on as long as it is used.
+    """
+
+    def __init__(self, path: str, n_columns: int = 2, dtype=np.float64) -> None:
+        """
+        Args:
+            path (str): Prefix of the column files, "<path>.<column>" each
+            n_columns (int, optional): Defaults to 2.
+            dtype (optional): Defaults to np.float64.
+        """
+        self.dtype = np.dtype(dtype)
+        self.paths = [path + "." + str(i) for i in range(n_columns)]
+        for column_path in self.paths:
+            open(column_path, "wb").close()
+        self.maps = []
+        self.size = 0
+        self._grow(INITIAL_DISK_ROWS)
+
+    def _grow(self, n_rows: int):
+        for column_path in self.paths:
+            os.truncate(column_path, n_rows * self.dtype.itemsize)
+        self.maps = [
+            np.memmap(column_path, dtype=self.dtype, mode="r+", shape=(n_rows,))
+            for column_path in self.paths
+        ]
+
+    def __len__(self):
+        return self.size
+
+    def append(self, rows: np.ndarray):
+        """Append rows of shape (n, n_columns)"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, len(self.paths))
+        end = self.size + len(rows)
+        if end > len(self.maps[0]):
+            self._grow(max(end, 2 * len(self.maps[0])))
+        for i, column in enumerate(self.maps):
+            column[self.size : end] = rows[:, i]
+        self.size = end
+
+    def column(self, index: int) -> np.ndarray:
+        return self.maps[index][: self.size]
+
+    def view(self, n: int = None) -> np.ndarray:
+        """The newest n rows, all of them by default, read into memory"""
+        n = self.size if n == None else min(n, self.size)
+        return np.column_stack(
+            [column[self.size - n : self.size] for column in self.maps]
+        )
+
+    def clear(self):
+        self.size = 0
+
+    def close(self):
+        """Close and delete the files"""
+        self.maps = []
+        for column_path in self.paths:
+            try:
+                os.remove(column_path)
+            except OSError:
+                pass
@@ -0,0 +1,333 @@
+import argparse
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+from typing import List
+
+import numpy as np
+
+from src.capture_segments import SegmentedCaptureReader
+from src.columnar_capture import ColumnarCaptureReader
+from src.log_replay import open_capture
+from src.message_classes import RXMessage, MessageProcessException
+
+EXPORT_FORMATS = {"csv": ".csv", "npy": ".npy", "npz": ".npz"}
+
+
+def iter_live_chunks(table: np.ndarray, chunk_rows: int = 65536):
+    """Yield the plotter's history as float64 arrays, chunk_rows samples at a time
+
+    Args:
+        table (np.ndarray): shape (n, 1 + n_curves), timestamp first, like
+            LivePlotter.total_data.view(). A curve without a sample at a row's
+            timestamp has NaN there, which only happens between ports of a
+            multi-port capture.
+        chunk_rows (int, optional): Samples per chunk. Defaults to 65536.
+
+    Yields:
+        np.ndarray: shape (n, 1 + n_curves), timestamp first
+    """
+    for start in range(0, len(table), chunk_rows):
+        # The plotter stores columns contiguously, the writers want rows
+        yield np.ascontiguousarray(table[start : start + chunk_rows], dtype=np.float64)
+
+
+def capture_columns(reader) -> List[str]:
+    """Channel names of a capture, taken from its first sample"""
+    if isinstance(reader, SegmentedCaptureReader):
+        for segment_reader in reader.iter_segments():
+            columns = capture_columns(segment_reader)
+            if len(columns) > 0:
+                return columns
+        return []
+    if isinstance(reader, ColumnarCaptureReader):
+        return reader.channels()
+    for record in reader.records():
+        if record[0] == "RX":
+            try:
+                return RXMessage.from_record(record[1]).as_curve_keys()
+            except MessageProcessException:
+                continue
+    return []
+
+
+def iter_capture_chunks(reader, columns: List[str], chunk_rows: int = 65536):
+    """Yield the samples of a capture as float64 arrays, read incrementally
+
+    Args:
+        reader (ColumnarCaptureReader, JSONLinesLogReader or
+            SegmentedCaptureReader): Open capture
+        columns (list(str)): Channels to export, missing ones become NaN
+        chunk_rows (int, optional): Most samples per chunk. Defaults to 65536.
+
+    Yields:
+        np.ndarray: shape (n, 1 + len(columns)), timestamp in seconds first
+    """
+    if isinstance(reader, SegmentedCaptureReader):
+        for segment_reader in reader.iter_segments():
+            yield from iter_capture_chunks(segment_reader, columns, chunk_rows)
+        return
+
+    if isinstance(reader, ColumnarCaptureReader):
+        for block in reader.blocks:
+            timestamps, values = reader.block_arrays(block)
+            chunk = np.full((block.n_rows, 1 + len(columns)), np.nan)
+            chunk[:, 0] = timestamps / 1e9
+            for i, name in enumerate(columns):
+                if name in block.channels:
+                    chunk[:, 1 + i] = values[block.channels.index(name)]
+            yield chunk
+        return
+
+    column_index = {name: i for i, name in enumerate(columns)}
+    chunk = np.full((chunk_rows, 1 + len(columns)), np.nan)
+    n_rows = 0
+    for record in reader.records():
+        if record[0] != "RX":
+            continue
+        try:
+            message = RXMessage.from_record(record[1])
+        except MessageProcessException:
+            continue
+        chunk[n_rows, 0] = message.timestamp_ns / 1e9
+        for name, value in message.datas:
+            if name in column_index:
+                chunk[n_rows, 1 + column_index[name]] = value
+        n_rows += 1
+        if n_rows == chunk_rows:
+            yield chunk
+            chunk = np.full((chunk_rows, 1 + len(columns)), np.nan)
+            n_rows = 0
+    if n_rows > 0:
+        yield chunk[:n_rows]
+
+
+def _npy_header(dtype: np.dtype, n_rows: int, size: int = None) -> bytes:
+    """A version 1.0 .npy header for a 1-D array
+
+    Args:
+        dtype (np.dtype): Array dtype
+        n_rows (int): Array length
+        size (int, optional): Exact header size in bytes, padded with spaces.
+            Defaults to the smallest multiple of 64 that fits.
+    """
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (n_rows,),
+        }
+    ).encode("latin1")
+    magic = b"\x93NUMPY\x01\x00"
+    if size == None:
+        size = -(-(len(magic) + 2 + len(header) + 1) // 64) * 64
+    padding = size - len(magic) - 2 - len(header) - 1
+    return (
+        magic
+        + struct.pack("<H", size - len(magic) - 2)
+        + header
+        + b" " * padding
+        + b"\n"
+    )
+
+
+class _NpyStreamWriter:
+    """Writes a 1-D .npy file chunk by chunk, fixing up its length on close"""
+
+    def __init__(self, path: str, dtype: np.dtype) -> None:
+        self.dtype = dtype
+        self.n_rows = 0
+        # Reserve room for the longest length the header could ever need
+        self.header_size = len(_npy_header(dtype, 2**63 - 1))
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * self.header_size)
+
+    def write(self, array: np.ndarray):
+        self.file.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+        self.n_rows += len(array)
+
+    def close(self):
+        self.file.seek(0)
+        self.file.write(_npy_header(self.dtype, self.n_rows, self.header_size))
+        self.file.close()
+
+
+class ExportJob:
+    """Background job streaming chunks of samples to a CSV, .npy or .npz file
+
+    Only one chunk is held in memory at a time, so exports of any length use
+    constant memory. Progress, completion and errors are polled from the
+    attributes, which makes the job safe to drive from a Qt timer.
+
+    Output layouts, all with one column per curve key plus a leading timestamp
+    in seconds since the epoch:
+        csv  header row of column names, one sample per line
+        npy  one structured array with a named float64 field per column
+        npz  one float64 array per column, named after the column
+    """
+
+    def __init__(self, path: str, columns: List[str], chunks, n_rows=None) -> None:
+        """
+        Args:
+            path (str): Output file, the format is taken from its extension
+            columns (list(str)): Curve keys, in chunk column order
+            chunks (iterable): Yields arrays of shape (n, 1 + len(columns))
+            n_rows (int, optional): Total samples, only used for progress
+        """
+        self.path = path
+        self.columns = ["timestamp"] + list(columns)
+        self.chunks = chunks
+        self.n_rows = n_rows
+        self.rows_written = 0
+        self.done = False
+        self.error = None
+        self.cancel_event = threading.Event()
+
+        extension = os.path.splitext(path)[1].lower()
+        formats = {value: key for key, value in EXPORT_FORMATS.items()}
+        if extension not in formats:
+            raise ValueError("Unknown export format: " + extension)
+        self.format = formats[extension]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.handler, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def progress(self):
+        """Fraction of rows written, or None when the total isn't known"""
+        if self.n_rows == None or self.n_rows == 0:
+            return None
+        return min(1, self.rows_written / self.n_rows)
+
+    def handler(self):
+        try:
+            if self.format == "csv":
+                self._write_csv()
+            elif self.format == "npy":
+                self._write_npy()
+            else:
+                self._write_npz()
+            logging.info("Exported %d rows to %s", self.rows_written, self.path)
+        except Exception as e:
+            logging.error(f"Error exporting to {self.path}: {e}")
+            self.error = e
+        finally:
+            # Chunks read from a file hold it open until closed
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+        self.done = True
+
+    def _chunks(self):
+        for chunk in self.chunks:
+            if self.cancel_event.is_set():
+                raise InterruptedError("Export cancelled")
+            yield chunk
+            self.rows_written += len(chunk)
+
+    def _write_csv(self):
+        fmt = ["%.6f"] + ["%.10g"] * (len(self.columns) - 1)
+        with open(self.path, "w", newline="") as file:
+            file.write(",".join(self.columns) + "\n")
+            for chunk in self._chunks():
+                np.savetxt(file, chunk, fmt=fmt, delimiter=",")
+
+    def _write_npy(self):
+        dtype = np.dtype([(name, "<f8") for name in self.columns])
+        writer = _NpyStreamWriter(self.path, dtype)
+        try:
+            for chunk in self._chunks():
+                records = np.empty(len(chunk), dtype=dtype)
+                for i, name in enumerate(self.columns):
+                    records[name] = chunk[:, i]
+                writer.write(records)
+        finally:
+            writer.close()
+
+    def _write_npz(self):
+        # Zip members are written one at a time, so each column is spilled to its
+        # own temporary .npy first and then copied into the archive
+        directory = tempfile.mkdtemp(prefix="serial_plotter_export_")
+        try:
+            dtype = np.dtype("<f8")
+            writers = [
+                _NpyStreamWriter(os.path.join(directory, str(i) + ".npy"), dtype)
+                for i in range(len(self.columns))
+            ]
+            try:
+                for chunk in self._chunks():
+                    for i, writer in enumerate(writers):
+                        writer.write(chunk[:, i])
+            finally:
+                for writer in writers:
+                    writer.close()
+
+            with zipfile.ZipFile(self.path, "w", allowZip64=True) as archive:
+                for i, name in enumerate(self.columns):
+                    archive.write(
+                        os.path.join(directory, str(i) + ".npy"), name + ".npy"
+                    )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class _CaptureChunks:
+    """iter_capture_chunks of an open capture, whose reader close() closes"""
+
+    def __init__(self, reader, columns: List[str]) -> None:
+        self.reader = reader
+        self.columns = columns
+
+    def __iter__(self):
+        return iter_capture_chunks(self.reader, self.columns)
+
+    def close(self):
+        self.reader.close()
+
+
+def export_capture(capture_path: str, out_path: str) -> ExportJob:
+    """Start exporting a whole capture file in the background
+
+    The job closes the capture once it is done, failed or cancelled.
+
+    Returns:
+        ExportJob: The running job
+    """
+    reader = open_capture(capture_path)
+    try:
+        columns = capture_columns(reader)
+        n_rows = None
+        if isinstance(reader, (ColumnarCaptureReader, SegmentedCaptureReader)):
+            n_rows = reader.n_samples()
+        job = ExportJob(out_path, columns, _CaptureChunks(reader, columns), n_rows)
+    except BaseException:
+        reader.close()
+        raise
+    job.start()
+    return job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export a capture file to CSV, .npy or .npz"
+    )
+    parser.add_argument(
+        "capture", help="capture file (.jsonl, .spcap or .manifest.json)"
+    )
+    parser.add_argument("out", help="output file, format from the extension")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="Export: %(message)s", level=logging.INFO)
+    job = export_capture(args.capture, args.out)
+    job.thread.join()
+    return 1 if job.error != None else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
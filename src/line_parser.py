@@ -0,0 +1,280 @@
+import logging
+import re
+from typing import List
+
+import numpy as np
+
+from src.message_classes import RXBatch, RXMessage, MessageProcessException
+
+COMMA, SPACE = b", "
+# bytes.translate table mapping separators to 1 and everything else to 0
+SEPARATOR_TABLE = bytes(int(byte in b":,\n") for byte in range(256))
+# Longest device timestamp the fast path parses, more may not fit an int64
+MAX_TICK_DIGITS = 18
+# Device timestamps either path accepts
+TICK_PATTERN = re.compile(r"-?[0-9]+")
+
+
+class LineLayout:
+    """Unit and pair names of a text line, e.g. m<ts>::a:<v>,b:<v>,!fault:<s>
+
+    A line with this layout has a fixed sequence of separators: "::", a ":"
+    after every name, "," between pairs and the newline, at fixed distances
+    around the names. The name bytes are kept as one template with the pair
+    and offset of every character, so the names of a whole batch are checked
+    with a single gather. The regular expression matches a single line with
+    exactly this layout.
+    """
+
+    def __init__(self, unit_str: str, names: List[str]) -> None:
+        self.unit_str = unit_str
+        self.names = names
+        self.curve_keys = [name for name in names if "!" not in name]
+        self.status_keys = [name for name in names if "!" in name]
+        self.curve_columns = [i for i, name in enumerate(names) if "!" not in name]
+        self.status_columns = [i for i, name in enumerate(names) if "!" in name]
+
+        self.unit_byte = ord(unit_str) if len(unit_str) == 1 else None
+        # "::", then ":" after each name and "," between pairs, then the newline
+        self.separators = np.frombuffer(
+            b"::" + b",".join([b":"] * len(names)) + b"\n", dtype=np.uint8
+        )
+        encoded = [name.encode("ascii", "replace") for name in names]
+        self.name_lengths = np.array([len(name) for name in encoded])
+        # Distance from each separator to the next: 1 inside "::", the name
+        # length plus one before each ":" and the value length plus one before
+        # each "," and the newline. The first two are fixed, curve values can't
+        # be empty
+        self.fixed_gap_columns = [0] + [2 * i + 1 for i in range(len(names))]
+        self.fixed_gaps = np.array([1] + [len(name) + 1 for name in encoded])
+        self.curve_gap_columns = [2 * i + 2 for i in self.curve_columns]
+        self.name_bytes = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        self.name_pairs = np.repeat(np.arange(len(names)), self.name_lengths)
+        self.name_offsets = np.concatenate(
+            [np.arange(len(name)) for name in encoded] + [np.empty(0, dtype=int)]
+        )
+
+        pairs = ",".join(re.escape(name) + r":[^,:\n]*" for name in names)
+        self.pattern = re.compile(
+            re.escape(unit_str) + TICK_PATTERN.pattern + "::" + pairs
+        )
+
+    @classmethod
+    def of_message(cls, message: RXMessage) -> "LineLayout":
+        # process() keeps channels and statuses apart, the template needs the
+        # order they were sent in
+        pairs = message.raw_string[message.raw_string.find("::") + 2 :].split(",")
+        names = [pair.split(":")[0] for pair in pairs]
+        return cls(message.unit_str, names)
+
+
+class BatchLineParser:
+    """Parses batches of text lines into RXBatches, caching the line layout
+
+    The layout (unit, channel and status names) is learned from the first line
+    RXMessage.process accepts. After that a whole batch is joined into one byte
+    array and checked against the layout with array operations on the
+    positions of its separators. The names are then blanked out, leaving one
+    number between each pair of commas, and a single np.array call converts
+    every timestamp and value of the batch, with the same rules as float().
+    Lines that don't fit the cached layout go through RXMessage.process one at
+    a time and teach the parser their layout.
+    """
+
+    def __init__(self) -> None:
+        self.layout: LineLayout = None
+
+    def parse(self, lines: List[str]):
+        """Parse lines, in order, into batches
+
+        Args:
+            lines (list(str)): Lines without their line endings
+
+        Returns:
+            tuple: (list(RXBatch) in line order, list(str) of unparseable lines)
+        """
+        batches = []
+        failed = []
+        start = 0
+        while start < len(lines):
+            if self.layout != None:
+                start += self._parse_run(lines, start, batches)
+                if start >= len(lines):
+                    break
+            # The line at start doesn't fit the cached layout
+            batch = self._parse_slow(lines[start])
+            if batch == None:
+                failed.append(lines[start])
+            else:
+                batches.append(batch)
+            start += 1
+        return batches, failed
+
+    def _parse_run(self, lines: List[str], start: int, batches: list) -> int:
+        """Parse the lines from start on that fit the layout
+
+        Returns:
+            int: Number of lines parsed
+        """
+        run = lines[start:] if start > 0 else lines
+        batch = self._parse_fast(run)
+        if batch == None:
+            # Find the first line that doesn't fit and retry up to it
+            n_fit = 0
+            for line in run:
+                if self.layout.pattern.fullmatch(line) == None:
+                    break
+                n_fit += 1
+            run = run[:n_fit]
+            if n_fit == 0:
+                return 0
+            batch = self._parse_fast(run)
+
+        if batch == None:
+            # Values NumPy can't read, let the slow path decide about each line
+            for i, line in enumerate(run):
+                batch = self._parse_slow(line)
+                if batch == None:
+                    return i
+                batches.append(batch)
+            return len(run)
+
+        batches.append(batch)
+        return len(run)
+
+    def _parse_fast(self, run: List[str]):
+        """Parse lines that all have the cached layout in one pass
+
+        Returns:
+            RXBatch: The parsed lines, or None if any of them doesn't fit
+        """
+        layout = self.layout
+        n_lines = len(run)
+        if layout.unit_byte == None:
+            return None
+        try:
+            raw = ("\n".join(run) + "\n").encode("ascii")
+        except UnicodeEncodeError:
+            return None
+        data = np.frombuffer(raw, dtype=np.uint8)
+
+        # Each line must have exactly the separators of the layout, in order,
+        # so row i of the separator positions is line i
+        is_separator = np.frombuffer(raw.translate(SEPARATOR_TABLE), dtype=bool)
+        separators = is_separator.nonzero()[0]
+        if len(separators) != n_lines * len(layout.separators):
+            return None
+        separators = separators.reshape(n_lines, -1)
+        if not (data[separators] == layout.separators).all():
+            return None
+        gaps = np.diff(separators, axis=1)
+        if not (gaps[:, layout.fixed_gap_columns] == layout.fixed_gaps).all():
+            return None
+        if not (gaps[:, layout.curve_gap_columns] > 1).all():
+            return None
+        line_ends = separators[:, -1]
+        line_starts = np.concatenate([[0], line_ends[:-1] + 1])
+        if not (separators[:, 0] - line_starts > 1).all():
+            return None
+        if not (data[line_starts] == layout.unit_byte).all():
+            return None
+
+        # Pair j is <name>:<value>, between the separator before it and the one
+        # after it
+        name_starts = separators[:, 1:-1:2] + 1
+        value_starts = separators[:, 2::2] + 1
+        value_ends = separators[:, 3::2]
+        name_indices = name_starts[:, layout.name_pairs] + layout.name_offsets
+        if not (data[name_indices] == layout.name_bytes).all():
+            return None
+
+        statuses = np.full((n_lines, len(layout.status_keys)), "")
+        status_indices = np.empty(0, dtype=int)
+        if len(layout.status_keys) > 0:
+            # Status values are cut out as fixed width strings, padded with the
+            # zeros NumPy strips again. Widening the ASCII bytes to UCS-4 is
+            # much cheaper than decoding them
+            starts = value_starts[:, layout.status_columns]
+            widths = value_ends[:, layout.status_columns] - starts
+            width = widths.max()
+            if width > 0:
+                status_indices = starts[:, :, None] + np.arange(width)
+                padding = np.arange(width) >= widths[:, :, None]
+                status_indices[padding] = 0
+                status_bytes = data[status_indices]
+                status_bytes[padding] = 0
+                statuses = status_bytes.astype(np.uint32).view("U" + str(width))
+                statuses = statuses[:, :, 0]
+
+        # Ticks are cut out like the statuses, and must be an optional minus and
+        # digits only, as the slow path takes them. Up to 18 digits always fit
+        # an int64
+        tick_starts = line_starts + 1
+        tick_widths = separators[:, 0] - tick_starts
+        width = tick_widths.max()
+        if width > MAX_TICK_DIGITS:
+            return None
+        tick_indices = tick_starts[:, None] + np.arange(width)
+        padding = np.arange(width) >= tick_widths[:, None]
+        tick_indices[padding] = 0
+        tick_bytes = data[tick_indices]
+        tick_bytes[padding] = ord("0")
+        is_digit = (tick_bytes >= ord("0")) & (tick_bytes <= ord("9"))
+        is_digit[:, 0] |= (tick_bytes[:, 0] == ord("-")) & (tick_widths > 1)
+        if not is_digit.all():
+            return None
+        tick_bytes[padding] = 0
+        ticks = tick_bytes.view("S" + str(width))[:, 0].astype(np.int64)
+
+        values = np.empty((n_lines, 0))
+        if len(layout.curve_keys) > 0:
+            # Blank everything but the curve values, end every number with a
+            # comma, then parse them all at once
+            number_ends = value_ends[:, layout.curve_columns]
+            numbers = data.copy()
+            numbers[separators] = SPACE
+            numbers[line_starts] = SPACE
+            numbers[tick_indices] = SPACE
+            numbers[name_indices] = SPACE
+            numbers[status_indices] = SPACE
+            numbers[number_ends] = COMMA
+            # Leaving out the last comma, which has no number after it
+            tokens = numbers[: number_ends[-1, -1]].tobytes().split(b",")
+            try:
+                values = np.array(tokens, dtype=np.float64)
+            except ValueError:
+                return None
+            if len(values) != n_lines * len(layout.curve_keys):
+                return None
+            values = values.reshape(n_lines, -1)
+
+        return RXBatch(
+            layout.unit_str,
+            ticks,
+            layout.curve_keys,
+            values,
+            layout.status_keys,
+            statuses,
+            run,
+        )
+
+    def _parse_slow(self, line: str):
+        """Parse one line with RXMessage.process and learn its layout
+
+        Returns:
+            RXBatch: One row batch, or None if the line isn't a valid message
+        """
+        message = RXMessage(line)
+        try:
+            message.process()
+            message.device_elapsed()
+        except MessageProcessException:
+            return None
+        # int() would also take e.g. "+5" or " 5", the fast path doesn't
+        if TICK_PATTERN.fullmatch(message.device_timestamp) == None:
+            return None
+        layout = LineLayout.of_message(message)
+        if self.layout == None or layout.names != self.layout.names:
+            logging.debug("Learned line layout: " + ",".join(layout.names))
+        self.layout = layout
+        return RXBatch.from_message(message)
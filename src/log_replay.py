@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.bounded_queue import BoundedQueue
+from src.capture_log import JSONLinesLogReader
+from src.capture_segments import MANIFEST_SUFFIX, SegmentedCaptureReader
+from src.columnar_capture import MAGIC, ColumnarCaptureReader
+from src.message_classes import RXMessage, MessageProcessException
+
+# Replay speed multipliers shown in the GUI, None replays as fast as possible
+REPLAY_SPEEDS = {"1x": 1, "10x": 10, "100x": 100, "Max": None}
+
+
+def open_capture(path: str):
+    """Open a capture file with the reader matching its format
+
+    Returns:
+        ColumnarCaptureReader, JSONLinesLogReader or SegmentedCaptureReader:
+            Reader for the capture
+    """
+    if path.endswith(MANIFEST_SUFFIX):
+        return SegmentedCaptureReader(path)
+    with open(path, "rb") as file:
+        magic = file.read(len(MAGIC))
+    if magic == MAGIC:
+        return ColumnarCaptureReader(path)
+    return JSONLinesLogReader(path)
+
+
+def iter_capture_messages(reader, t_start: float = None):
+    """Yield the RX samples of a capture, in file order, as processed RXMessages
+
+    Args:
+        reader (ColumnarCaptureReader, JSONLinesLogReader or
+            SegmentedCaptureReader): Open capture
+        t_start (float, optional): Skip samples before this device time, in
+            seconds since the epoch. Defaults to the start of the capture.
+    """
+    if isinstance(reader, SegmentedCaptureReader):
+        for segment_reader in reader.iter_segments(t_start):
+            yield from iter_capture_messages(segment_reader, t_start)
+    elif isinstance(reader, ColumnarCaptureReader):
+        yield from _iter_columnar_messages(reader, t_start)
+    else:
+        yield from _iter_jsonl_messages(reader, t_start)
+
+
+def _iter_jsonl_messages(reader: JSONLinesLogReader, t_start):
+    offset = None if t_start == None else reader.offset_for_time(t_start)
+    for record in reader.records(offset):
+        if record[0] != "RX":
+            continue
+        try:
+            yield RXMessage.from_record(record[1])
+        except MessageProcessException:
+            logging.debug("Skipping unparseable record: " + str(record))
+
+
+def _iter_columnar_messages(reader: ColumnarCaptureReader, t_start):
+    t_start_ns = None if t_start == None else round(t_start * 1e6) * 1000
+    # Status changes are stored as events, each applies until the next one
+    status_events = [
+        (round(event[1]["dut_offset"] * 1e6) * 1000, list(event[1]["statuses"].items()))
+        for event in reader.events
+        if event[0] == "STATUS"
+    ]
+    next_status = 0
+    statuses = []
+
+    for block in reader.blocks_in_range(t_start_ns):
+        timestamps, values = reader.block_arrays(block)
+        first = 0
+        if t_start_ns != None:
+            first = int(np.searchsorted(timestamps, t_start_ns, side="left"))
+
+        rows = values[:, first:].T.tolist()
+        for timestamp, row in zip(timestamps[first:].tolist(), rows):
+            while (
+                next_status < len(status_events)
+                and status_events[next_status][0] <= timestamp
+            ):
+                statuses = status_events[next_status][1]
+                next_status += 1
+            yield RXMessage.from_values(block.channels, row, statuses, timestamp)
+
+
+class LogReplay:
+    """Replays a capture file through the same pipeline as a live SerialClass
+
+    A background thread reads the capture incrementally and puts lists of
+    RXMessages on rx_messages, paced so that samples arrive speed times faster
+    than they were recorded. Unlike SerialClass there is no ring buffer, every
+    message goes through rx_messages, and a full queue pauses the reader
+    instead of dropping anything.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        speed: float = 1,
+        batch_interval: float = 0.005,
+        max_batch: int = 1000,
+        max_queued_batches: int = 64,
+    ) -> None:
+        """
+        Args:
+            path (str): Capture file, JSON Lines or columnar
+            speed (float, optional): Replay speed multiplier, None for as fast as
+                possible. Defaults to 1.
+            batch_interval (float, optional): Messages due within this many
+                seconds are sent together. Defaults to 0.005.
+            max_batch (int, optional): Most messages sent in one list. Defaults
+                to 1000.
+            max_queued_batches (int, optional): Bound of rx_messages. Defaults
+                to 64.
+        """
+        self.path = path
+        self.speed = speed
+        self.batch_interval = batch_interval
+        self.max_batch = max_batch
+        self.reader = open_capture(path)
+        self.ring = None
+        self.tx_sent = None
+        self.rx_messages = BoundedQueue(max_queued_batches, "block")
+        # Nothing is sent during a replay, kept for the queue metrics
+        self.tx_messages = BoundedQueue.from_settings("tx_messages")
+        self.stop_event = threading.Event()
+        # Set once the whole capture has been read
+        self.finished = False
+
+        self.seek_lock = threading.Lock()
+        self.seek_to = None
+        self.reset_clock = False
+
+        self.n_messages = 0
+        self.hz = 0
+        self.last_rate_time = 0
+        self.last_rate_n = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.handler, daemon=True)
+        self.thread.start()
+
+    def end(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.reader.close()
+
+    def set_speed(self, speed: float):
+        """Change the speed multiplier, None for as fast as possible"""
+        with self.seek_lock:
+            self.speed = speed
+            self.reset_clock = True
+
+    def seek(self, timestamp: float):
+        """Continue the replay from a device time, in seconds since the epoch"""
+        with self.seek_lock:
+            self.seek_to = timestamp
+
+    def get_n_total_messages_read(self):
+        return self.n_messages
+
+    def get_hz_rx_messages(self):
+        return self.hz
+
+    def get_counters(self) -> dict:
+        """Same names as SerialClass.get_counters, for what a replay has"""
+        return {"rx_messages": self.n_messages, "rx_hz": self.hz}
+
+    def _put(self, batch):
+        """Queue a batch, waiting while the consumer is behind"""
+        # The only producer, so once there is room the put can't block
+        while self.rx_messages.full():
+            if self.stop_event.wait(0.01):
+                return
+        self.rx_messages.put(batch)
+        self.n_messages += len(batch)
+        self._update_rate()
+
+    def _update_rate(self):
+        now = time.perf_counter()
+        if now - self.last_rate_time < 0.5:
+            return
+        self.hz = (self.n_messages - self.last_rate_n) / (now - self.last_rate_time)
+        self.last_rate_time = now
+        self.last_rate_n = self.n_messages
+
+    def handler(self):
+        logging.info("Replaying " + self.path)
+        messages = iter_capture_messages(self.reader)
+        # (wall clock, capture time) pair that the pacing is measured from
+        clock = None
+        batch = []
+        self.last_rate_time = time.perf_counter()
+
+        while not self.stop_event.is_set():
+            with self.seek_lock:
+                seek_to = self.seek_to
+                self.seek_to = None
+                if self.reset_clock:
+                    clock = None
+                    self.reset_clock = False
+            if seek_to != None:
+                logging.debug("Seeking replay to " + str(seek_to))
+                messages = iter_capture_messages(self.reader, seek_to)
+                clock = None
+                batch = []
+
+            message = next(messages, None)
+            if message == None:
+                self.finished = True
+                break
+
+            timestamp = message.timestamp_ns / 1e9
+            if clock == None:
+                clock = (time.perf_counter(), timestamp)
+
+            if self.speed != None:
+                due = clock[0] + (timestamp - clock[1]) / self.speed
+                delay = due - time.perf_counter()
+                if delay > self.batch_interval:
+                    if len(batch) > 0:
+                        self._put(batch)
+                        batch = []
+                    self.stop_event.wait(delay)
+
+            batch.append(message)
+            if len(batch) >= self.max_batch:
+                self._put(batch)
+                batch = []
+
+        if len(batch) > 0:
+            self._put(batch)
+        logging.info("Replay stopped")
@@ -2,8 +2,33 @@ import time
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
 
+import numpy as np
+
+
+# Nanoseconds per device timestamp tick, for each timestamp unit
+UNIT_NS = {"m": 1_000_000, "u": 1_000}
+
+# What TXMessage appends for each line ending, anything else appends nothing
+LINE_ENDINGS = {"LF": "\n", "CR": "\r", "CRLF": "\r\n"}
+
+
+def datetime_to_ns(value: datetime) -> int:
+    """Nanoseconds since the epoch of a datetime, exact to the microsecond"""
+    # A float timestamp only approximates today's dates to the microsecond, so
+    # only the whole seconds go through it
+    seconds = int(value.replace(microsecond=0).timestamp())
+    return seconds * 1_000_000_000 + value.microsecond * 1000
+
+
+def ns_to_datetime(timestamp_ns: int) -> datetime:
+    """Local datetime of nanoseconds since the epoch, truncated to microseconds"""
+    seconds, ns = divmod(timestamp_ns, 1_000_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=ns // 1000)
+
 
 class Message(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def json_friendly_object(self) -> list:
         pass
@@ -20,16 +45,86 @@ class MessageProcessException(Exception):
 
 
 class RXMessage(Message):
+    """One received line
+
+    Slotted, and its time is a single int: timestamp_ns, the dut_offset in
+    nanoseconds since the epoch. Samples normally travel as RXBatch rows, so
+    RXMessages are only made for the few that need one.
+    """
+
+    __slots__ = (
+        "raw_string",
+        "unit_str",
+        "device_timestamp",
+        "statuses",
+        "datas",
+        "offset",
+        "timestamp_ns",
+        "local_t",
+    )
+
     def __init__(self, raw_string: str) -> None:
         self.raw_string = raw_string
+        self.unit_str = None
         self.device_timestamp = None
         self.statuses = None
         self.datas = None
-        self.unit = None
         self.offset = False
-        current_time_ns = time.time_ns()
+        self.timestamp_ns = None
+        # Host receive time, nanoseconds since the epoch
+        self.local_t = time.time_ns()
+
+    @property
+    def dut_offset(self) -> datetime:
+        return ns_to_datetime(self.timestamp_ns)
 
-        self.local_t = str(time.time())
+    @dut_offset.setter
+    def dut_offset(self, value: datetime):
+        self.timestamp_ns = datetime_to_ns(value)
+
+    @classmethod
+    def from_record(cls, record: dict) -> "RXMessage":
+        """Rebuild a processed message from the dict of its json_friendly_object()"""
+        message = cls(record["message"])
+        message.process()
+        message.offset = True
+        # Logged as float seconds, which are only exact to the microsecond
+        message.timestamp_ns = round(record["dut_offset"] * 1e6) * 1000
+        return message
+
+    @classmethod
+    def from_values(
+        cls, curve_keys: list, values: list, statuses: list, timestamp_ns: int
+    ) -> "RXMessage":
+        """Build a processed message from already parsed channel values
+
+        The raw string holds the data pairs only, the device timestamp is lost.
+        """
+        datas = list(zip(curve_keys, values))
+        pairs = [name + ":" + str(data) for name, data in datas + list(statuses)]
+        message = cls(",".join(pairs))
+        message.datas = datas
+        message.statuses = list(statuses)
+        message.offset = True
+        message.timestamp_ns = timestamp_ns
+        return message
+
+    @classmethod
+    def from_fields(
+        cls, unit_str: str, device_timestamp: int, datas: list, statuses: list
+    ) -> "RXMessage":
+        """Build a processed message from decoded fields, like a binary frame
+
+        The raw string is the equivalent text line, so logs of binary and text
+        devices read back the same way. The offset still has to be applied.
+        """
+        pairs = [name + ":" + str(value) for name, value in datas + statuses]
+        message = cls(unit_str + str(device_timestamp) + "::" + ",".join(pairs))
+        message.unit_str = unit_str
+        message.device_timestamp = str(device_timestamp)
+        message.datas = datas
+        message.statuses = statuses
+        return message
 
     def process(self):
         try:
@@ -48,8 +143,6 @@ class RXMessage(Message):
                     self.statuses.append((name, str(data)))
                 else:
                     self.datas.append((name, float(data)))
-
-            self.local_t = datetime.now()
         except:
             raise MessageProcessException()
 
@@ -63,39 +156,48 @@ class RXMessage(Message):
         # TODO:
         return returnable
 
+    def as_values(self):
+        """
+        Returns the numeric channel values in curve key order
+            values = [y1, y2]
+        """
+        return [data[1] for data in self.datas]
+
+    def dut_offset_ns(self) -> int:
+        """Device time of the message as integer nanoseconds since the epoch"""
+        return self.timestamp_ns
+
     def as_plottable_list(self):
         """
         Returns one list
             datas = [(x1,y1), (x2,y2)]
         """
-        returnable = []
-        for data in self.datas:
-            returnable.append((self.dut_offset.timestamp(), data[1]))
-        return returnable
+        x = self.timestamp_ns / 1e9
+        return [(x, data[1]) for data in self.datas]
 
-    def apply_offset(self, dut_starttime: datetime):
+    def device_elapsed_ns(self) -> int:
+        """Device timestamp of the message in nanoseconds since the device's epoch"""
+        if self.unit_str not in UNIT_NS:
+            raise MessageProcessException(
+                "Unknown timestamp unit: " + str(self.unit_str)
+            )
         try:
-            self.offset = True
-            if self.unit_str == "m":
-                dut_offset = dut_starttime + timedelta(
-                    milliseconds=int(self.device_timestamp)
-                )
-            if self.unit_str == "u":
-                dut_offset = dut_starttime + timedelta(
-                    microseconds=int(self.device_timestamp)
-                )
-            self.dut_offset = dut_offset
+            return int(self.device_timestamp) * UNIT_NS[self.unit_str]
         except:
             raise MessageProcessException()
-        # self.data.update({"timestamp": dut_offset})
 
-    def get_timestamp(self):
-        return self.timestamp
+    def device_elapsed(self) -> timedelta:
+        """Device timestamp of the message as time since the device's epoch"""
+        return timedelta(microseconds=self.device_elapsed_ns() // 1000)
+
+    def apply_offset(self, dut_starttime: datetime):
+        self.offset = True
+        self.timestamp_ns = datetime_to_ns(dut_starttime) + self.device_elapsed_ns()
 
     def json_friendly_object(self) -> list:
         return [
             "RX",
-            {"dut_offset": self.dut_offset.timestamp(), "message": self.raw_string},
+            {"dut_offset": self.timestamp_ns / 1e9, "message": self.raw_string},
         ]
 
     def __str__(self):
@@ -105,31 +207,126 @@ class RXMessage(Message):
         return self.__str__()
 
 
+class RXBatch:
+    """Consecutive processed RX messages that share one layout, as arrays
+
+    Parsers produce batches instead of one RXMessage per line, so the samples
+    go to the ring buffer and logs without a Python object per message.
+    RXMessages are only built for the rows that need one.
+
+    Attributes:
+        unit_str (str): Device timestamp unit, "m" or "u"
+        ticks (np.ndarray): int64 device timestamps in unit_str, shape (n,)
+        curve_keys (list(str)): Channel names, in column order
+        values (np.ndarray): float64 channel values, shape (n, len(curve_keys))
+        status_keys (list(str)): Status names, in column order
+        statuses (np.ndarray): Status strings, shape (n, len(status_keys))
+        timestamps (np.ndarray): int64 dut_offset nanoseconds, once applied
+    """
+
+    UNIT_NS = UNIT_NS
+
+    def __init__(
+        self, unit_str, ticks, curve_keys, values, status_keys, statuses, lines=None
+    ) -> None:
+        self.unit_str = unit_str
+        self.ticks = ticks
+        self.curve_keys = curve_keys
+        self.values = values
+        self.status_keys = status_keys
+        self.statuses = statuses
+        # Raw text of every row, built from the fields when not given
+        self.lines = lines
+        self.timestamps = None
+
+    @classmethod
+    def from_message(cls, message: RXMessage) -> "RXBatch":
+        """One row batch of a message processed by RXMessage.process"""
+        statuses = message.get_statuses()
+        return cls(
+            message.unit_str,
+            np.array([int(message.device_timestamp)], dtype=np.int64),
+            message.as_curve_keys(),
+            np.array([message.as_values()], dtype=np.float64).reshape(1, -1),
+            [name for name, value in statuses],
+            np.array([[value for name, value in statuses]], dtype=str).reshape(1, -1),
+            [message.raw_string],
+        )
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def device_elapsed(self, row: int = 0) -> timedelta:
+        """Device timestamp of a row as time since the device's epoch"""
+        if self.unit_str not in self.UNIT_NS:
+            raise MessageProcessException("Unknown timestamp unit: " + self.unit_str)
+        return timedelta(
+            microseconds=int(self.ticks[row]) * self.UNIT_NS[self.unit_str] // 1000
+        )
+
+    def apply_offset(self, dut_starttime: datetime):
+        """Set timestamps to dut_starttime plus each row's device time"""
+        start_ns = datetime_to_ns(dut_starttime)
+        self.timestamps = start_ns + self.ticks * self.UNIT_NS[self.unit_str]
+
+    def row_statuses(self, row: int) -> list:
+        return list(zip(self.status_keys, self.statuses[row].tolist()))
+
+    def raw_lines(self) -> list:
+        """Text line of every row, in the "m<ts>::name:val,..." format"""
+        if self.lines == None:
+            names = self.curve_keys + self.status_keys
+            columns = [column.tolist() for column in self.values.T]
+            columns += [column.tolist() for column in self.statuses.T]
+            self.lines = []
+            for row, tick in enumerate(self.ticks.tolist()):
+                pairs = [name + ":" + str(c[row]) for name, c in zip(names, columns)]
+                self.lines.append(self.unit_str + str(tick) + "::" + ",".join(pairs))
+        return self.lines
+
+    def message(self, row: int) -> RXMessage:
+        """RXMessage of one row, with its offset applied if the batch has one"""
+        message = RXMessage.from_fields(
+            self.unit_str,
+            int(self.ticks[row]),
+            list(zip(self.curve_keys, self.values[row].tolist())),
+            self.row_statuses(row),
+        )
+        message.raw_string = self.raw_lines()[row]
+        if self.timestamps is not None:
+            message.offset = True
+            message.timestamp_ns = int(self.timestamps[row])
+        return message
+
+    def messages(self) -> list:
+        return [self.message(row) for row in range(len(self))]
+
+
 class TXMessage(Message):
-    def __init__(self, message: str, line_ending: str) -> None:
+    def __init__(
+        self, message: str, line_ending: str, scheduled_ns: int = None
+    ) -> None:
         self.message = message
         self.line_ending = line_ending
+        # Host times in nanoseconds since the epoch: when a script wanted the
+        # message sent, and when its write was issued
+        self.scheduled_ns = scheduled_ns
+        self.sent_ns = None
 
-    def sendable(self):
-        # Append the line ending if specified
-        if self.line_ending == "LF":
-            self.message += "\n"
-        elif self.line_ending == "CR":
-            self.message += "\r"
-        elif self.line_ending == "CRLF":
-            self.message += "\r\n"
-
-        return self.message.encode("utf-8")
+    def sendable(self) -> bytes:
+        """The message with its line ending, as bytes. Can be called repeatedly"""
+        return (self.message + LINE_ENDINGS.get(self.line_ending, "")).encode("utf-8")
 
     def json_friendly_object(self) -> list:
-        return [
-            "TX",
-            {
-                "local_t": str(time.time()),
-                "line_ending": self.line_ending,
-                "message": self.message,
-            },
-        ]
+        sent_ns = time.time_ns() if self.sent_ns == None else self.sent_ns
+        record = {
+            "local_t": str(sent_ns / 1e9),
+            "line_ending": self.line_ending,
+            "message": self.message,
+        }
+        if self.scheduled_ns != None:
+            record["scheduled_t"] = str(self.scheduled_ns / 1e9)
+        return ["TX", record]
 
     def __str__(self):
         return self.message
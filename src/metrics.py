@@ -0,0 +1,156 @@
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StageTimes:
+    """Seconds spent in, and calls of, each named stage of one process"""
+
+    def __init__(self) -> None:
+        self.seconds = {}
+        self.calls = {}
+
+    def add(self, stage: str, seconds: float):
+        self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+
+
+def timed_stage(stage: str):
+    """Method decorator adding the time of every call to self.stage_times"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.stage_times.add(stage, time.perf_counter() - start)
+
+        return timed
+
+    return decorator
+
+
+def prometheus_value(value: float) -> str:
+    """A sample value as Prometheus writes it, NaN and +Inf/-Inf included"""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Metric:
+    def __init__(self, name: str, kind: str, help: str, read: Callable) -> None:
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.read = read
+
+
+class MetricsRegistry:
+    """Counters and gauges of every stage of the pipeline, read on demand
+
+    Stages don't push values, each metric is registered with a function that
+    reads it from wherever the stage keeps it (SharedCounters, StageTimes,
+    queue sizes), so an idle registry costs nothing. Names follow the
+    Prometheus conventions: counters end in _total, times are in seconds.
+    """
+
+    def __init__(self, namespace: str = "serial_plotter") -> None:
+        self.namespace = namespace
+        self.metrics = {}
+        self.server = None
+        # Metrics whose last read failed, each failure is logged once
+        self.failing = set()
+
+    def counter(self, name: str, help: str, read: Callable):
+        """Register a value that only goes up, until its stage restarts"""
+        self.metrics[name] = Metric(name, "counter", help, read)
+
+    def gauge(self, name: str, help: str, read: Callable):
+        """Register a value that goes up and down"""
+        self.metrics[name] = Metric(name, "gauge", help, read)
+
+    def collect(self) -> dict:
+        """Current value of every metric
+
+        Returns:
+            dict: Metric name to float, without the metrics whose stage has
+                nothing to report
+        """
+        values = {}
+        for name, metric in self.metrics.items():
+            try:
+                value = metric.read()
+            except Exception as e:
+                # Mostly a stage that isn't running, e.g. the plotter between
+                # captures, which would flood the log on every scrape
+                if name not in self.failing:
+                    self.failing.add(name)
+                    logging.warning("Can't read metric " + name + ": " + repr(e))
+                continue
+            self.failing.discard(name)
+            if value != None:
+                values[name] = float(value)
+        return values
+
+    def prometheus_text(self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        values = self.collect()
+        lines = []
+        for name, value in values.items():
+            metric = self.metrics[name]
+            full_name = self.namespace + "_" + name
+            lines.append("# HELP " + full_name + " " + metric.help)
+            lines.append("# TYPE " + full_name + " " + metric.kind)
+            lines.append(full_name + " " + prometheus_value(value))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self, path: str):
+        """Write the metrics for node_exporter's textfile collector
+
+        The file is replaced in one step, so a scrape never sees half of it.
+        """
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as file:
+            file.write(self.prometheus_text())
+        os.replace(temporary_path, path)
+
+    def serve(self, port: int = 9464, host: str = "127.0.0.1"):
+        """Serve the metrics at http://host:port/metrics from a daemon thread"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the log
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop_serving(self):
+        if self.server != None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
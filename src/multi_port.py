@@ -0,0 +1,351 @@
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List
+
+import numpy as np
+
+from src.bounded_queue import BoundedQueue
+from src.message_classes import RXMessage, TXMessage
+from src.serial_class import SerialClass, SerialPort, list_ports
+
+# Seconds between looks at the ports that haven't sent their first message
+FIRST_MESSAGE_POLL = 0.01
+# Seconds without a write after which a port no longer holds back the merged
+# ring's rows from the other ports
+QUIET_SECONDS = 0.5
+
+
+def port_label(port: SerialPort) -> str:
+    """Short name of a port used to namespace its channels, e.g. COM3 or ttyUSB0"""
+    label = os.path.basename(str(port.port))
+    # Labels end up in "key:value" pairs, so keep the separators out of them
+    return label.replace(":", "_").replace(",", "_")
+
+
+def namespace_key(label: str, key: str) -> str:
+    return label + "." + key
+
+
+def namespace_message(label: str, message: RXMessage) -> RXMessage:
+    """Copy of a processed message with its curve keys and statuses namespaced"""
+    return RXMessage.from_values(
+        [namespace_key(label, key) for key in message.as_curve_keys()],
+        message.as_values(),
+        [(namespace_key(label, name), value) for name, value in message.statuses],
+        message.timestamp_ns,
+    )
+
+
+class MergedRing:
+    """Read-only view of several SharedRingBuffers as one time-ordered ring
+
+    Each port's channels get a fixed block of columns, in port order. A read
+    copies out what every port wrote since the cursor and merges the rows by
+    timestamp, rows only hold values for the port that wrote them and NaN
+    elsewhere. Has the same read() as SharedRingBuffer, with a tuple of
+    per-port row counts as the cursor.
+
+    Timestamps never go back across reads. Rows newer than the last row of the
+    port furthest behind are held until every port has passed them, a port that
+    wrote nothing for quiet_seconds stops holding the others back. Rows it
+    writes later that are older than what was already read are dropped, and
+    counted as overwritten.
+    """
+
+    def __init__(
+        self, rings: list, n_channels: List[int], quiet_seconds=QUIET_SECONDS
+    ) -> None:
+        """
+        Args:
+            rings (list(SharedRingBuffer)): One ring per port
+            n_channels (list(int)): Columns given to each port, extra channels a
+                port writes later are dropped
+            quiet_seconds (float, optional): Seconds without a write after which
+                a port no longer holds back the others' rows. Defaults to
+                QUIET_SECONDS.
+        """
+        self.rings = rings
+        self.n_channels = list(n_channels)
+        self.offsets = np.cumsum([0] + self.n_channels)[:-1].tolist()
+        self.width = sum(self.n_channels)
+        # Widest row every port's ring takes, wider ones come through the queue
+        self.max_channels = min(ring.max_channels for ring in rings)
+        self.quiet_seconds = quiet_seconds
+        self._reset()
+
+    def _reset(self):
+        self.held_timestamps = np.empty(0, dtype=np.int64)
+        self.held_values = np.empty((0, self.width))
+        # Newest timestamp of each port and when it was last written to
+        self.latest = [None] * len(self.rings)
+        self.last_write = [time.monotonic()] * len(self.rings)
+        self.read_until = None
+
+    def _watermark(self, now: float) -> float:
+        """Newest timestamp every port still writing has reached"""
+        watermark = np.inf
+        for i in range(len(self.rings)):
+            if (
+                self.n_channels[i] == 0
+                or now - self.last_write[i] >= self.quiet_seconds
+            ):
+                continue
+            if self.latest[i] == None:
+                return -np.inf
+            watermark = min(watermark, self.latest[i])
+        return watermark
+
+    def read(self, cursor):
+        """Copy out the rows written to any port since cursor that every port
+        has passed
+
+        Args:
+            cursor (tuple(int) or int): Cursor returned by the previous read, 0 to
+                start
+
+        Returns:
+            tuple: (timestamps, values, new cursor, number of rows overwritten
+                before they could be read)
+        """
+        if cursor == 0:
+            cursor = (0,) * len(self.rings)
+            self._reset()
+
+        now = time.monotonic()
+        new_cursor = []
+        timestamp_parts = [self.held_timestamps]
+        value_parts = [self.held_values]
+        n_overwritten = 0
+        for i, ring in enumerate(self.rings):
+            timestamps, values, port_cursor, port_overwritten = ring.read(cursor[i])
+            new_cursor.append(port_cursor)
+            n_overwritten += port_overwritten
+            if len(timestamps) == 0 or self.n_channels[i] == 0:
+                continue
+            self.latest[i] = timestamps[-1]
+            self.last_write[i] = now
+
+            part = np.full((len(timestamps), self.width), np.nan)
+            n = min(self.n_channels[i], values.shape[1])
+            part[:, self.offsets[i] : self.offsets[i] + n] = values[:, :n]
+            timestamp_parts.append(timestamps)
+            value_parts.append(part)
+
+        timestamps = np.concatenate(timestamp_parts)
+        values = np.concatenate(value_parts)
+        # Each part is already in order, a stable sort keeps ties in port order
+        order = np.argsort(timestamps, kind="stable")
+        timestamps = timestamps[order]
+        values = values[order]
+
+        if self.read_until != None:
+            # From a port that went quiet and came back late
+            n_late = int(np.searchsorted(timestamps, self.read_until))
+            n_overwritten += n_late
+            timestamps = timestamps[n_late:]
+            values = values[n_late:]
+
+        n_ready = int(np.searchsorted(timestamps, self._watermark(now), side="right"))
+        self.held_timestamps = timestamps[n_ready:]
+        self.held_values = values[n_ready:]
+        if n_ready > 0:
+            self.read_until = timestamps[n_ready - 1]
+        return timestamps[:n_ready], values[:n_ready], tuple(new_cursor), n_overwritten
+
+
+class _BroadcastQueue:
+    """Puts every TX message or script on each port's queue"""
+
+    def __init__(self, queues) -> None:
+        self.queues = queues
+
+    def put(self, message):
+        for tx_queue in self.queues:
+            # Each port's process gets a copy of its own
+            tx_queue.put(message)
+
+    def qsize(self) -> int:
+        """Depth of the fullest port's queue, the one holding sends back"""
+        return max((tx_queue.qsize() for tx_queue in self.queues), default=0)
+
+    def n_dropped(self) -> int:
+        return sum(tx_queue.n_dropped() for tx_queue in self.queues)
+
+
+class MultiPortCapture:
+    """Captures several serial ports at once as one merged data source
+
+    Every port gets its own SerialClass and so its own process and ring buffer,
+    which keeps a busy port from slowing the others down. Each port latches its
+    device clock onto the host clock (config "align_clock"), so their
+    dut_offsets share one timeline. Channels and statuses are namespaced as
+    <label>.<key>, and every port logs to its own file, <log_name>_<label>.
+
+    Has the same interface as SerialClass for the GUI: ring, rx_messages,
+    tx_messages, the message counters, start, end and close.
+    """
+
+    def __init__(self, cachesize, verbose=False) -> None:
+        self.cachesize = cachesize
+        self.verbose = verbose
+        # Same keys as SerialClass.config, with "ports" (list(SerialPort)) in
+        # place of "port" and optionally "labels" (list(str))
+        self.config = {}
+        self.captures: List[SerialClass] = []
+        self.labels = []
+        self.curve_keys = []
+        self.ring = None
+        self.rx_messages = BoundedQueue.from_settings("rx_messages")
+        self.tx_messages = None
+        self.tx_sent = BoundedQueue.from_settings("tx_sent")
+        self.stop_event = threading.Event()
+        self.forwarders = []
+
+    def start(self, first_message_timeout=5):
+        """Start one capture process per port and fix the merged column layout
+
+        Blocks until every port has sent its first message, or until
+        first_message_timeout seconds after the ports were started, however
+        many there are. A port that stays quiet gets no curves.
+        """
+        ports = self.config["ports"]
+        self.rx_messages = BoundedQueue.from_settings(
+            "rx_messages", self.config.get("queues")
+        )
+        self.tx_sent = BoundedQueue.from_settings("tx_sent", self.config.get("queues"))
+        self.labels = self.config.get("labels") or [port_label(p) for p in ports]
+        self.captures = []
+        for port, label in zip(ports, self.labels):
+            capture = SerialClass(self.cachesize, verbose=self.verbose)
+            capture.config = dict(self.config)
+            del capture.config["ports"]
+            capture.config.pop("labels", None)
+            capture.config.update(
+                {
+                    "port": port,
+                    "label": label,
+                    "log_name": self.config["log_name"] + "_" + label,
+                    "align_clock": self.config.get("align_clock", True),
+                }
+            )
+            capture.start()
+            self.captures.append(capture)
+
+        # The ports start up side by side, so wait for all of them at once
+        deadline = time.monotonic() + first_message_timeout
+        batches = [None] * len(self.captures)
+        while None in batches and time.monotonic() < deadline:
+            for i, capture in enumerate(self.captures):
+                if batches[i] != None:
+                    continue
+                try:
+                    batches[i] = capture.rx_messages.get_nowait()
+                except queue.Empty:
+                    pass
+            if None in batches:
+                time.sleep(FIRST_MESSAGE_POLL)
+
+        first_batch = []
+        n_channels = []
+        self.curve_keys = []
+        for batch, label in zip(batches, self.labels):
+            if batch == None:
+                logging.warning("No messages from " + label + ", it won't be plotted")
+                n_channels.append(0)
+                continue
+            batch = [namespace_message(label, m) for m in batch]
+            # Like a single port, the first message decides the port's curves
+            n_channels.append(len(batch[0].datas))
+            self.curve_keys.extend(batch[0].as_curve_keys())
+            first_batch.extend(batch)
+
+        self.ring = MergedRing([c.ring for c in self.captures], n_channels)
+        self.tx_messages = _BroadcastQueue([c.tx_messages for c in self.captures])
+        if len(first_batch) > 0:
+            self.rx_messages.put(first_batch)
+
+        self.stop_event.clear()
+        self.forwarders = []
+        for capture, label in zip(self.captures, self.labels):
+            thread = threading.Thread(
+                target=self._forward, args=(capture, label), daemon=True
+            )
+            thread.start()
+            self.forwarders.append(thread)
+
+    def _forward(self, capture: SerialClass, label: str):
+        """Move a port's status and curve key changes, and its sent messages,
+        onto the merged queues"""
+        while not self.stop_event.is_set():
+            while not capture.tx_sent.empty():
+                try:
+                    self.tx_sent.put(capture.tx_sent.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                batch = capture.rx_messages.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            self.rx_messages.put([namespace_message(label, m) for m in batch])
+
+    def get_n_total_messages_read(self):
+        return sum(c.get_n_total_messages_read() for c in self.captures)
+
+    def get_hz_rx_messages(self):
+        return sum(c.get_hz_rx_messages() for c in self.captures)
+
+    def get_counters(self) -> dict:
+        """Counters of every port added up, or the worst port's for the extremes"""
+        port_counters = [capture.get_counters() for capture in self.captures]
+        counters = {}
+        for port in port_counters:
+            for name, value in port.items():
+                counters[name] = counters.get(name, 0) + value
+        if len(port_counters) > 0:
+            # The port whose log is furthest behind
+            counters["log_flush_time"] = min(c["log_flush_time"] for c in port_counters)
+            # The latest send of any port, not a sum of them
+            counters["tx_late_max_seconds"] = max(
+                c["tx_late_max_seconds"] for c in port_counters
+            )
+        return counters
+
+    def end(self, timeout=10):
+        self.stop_event.set()
+        for thread in self.forwarders:
+            thread.join()
+        for capture in self.captures:
+            capture.end(timeout)
+
+    def close(self):
+        """Free every port's ring buffer. Start creates new ones"""
+        for capture in self.captures:
+            capture.close()
+
+
+if __name__ == "__main__":
+    from pick import pick
+
+    capture = MultiPortCapture(65536, verbose=True)
+    ports = list_ports()
+    selected = pick(
+        ports,
+        "Ports to capture (space to select)",
+        multiselect=True,
+        min_selection_count=1,
+    )
+    capture.config["log_name"] = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    capture.config["log_enabled"] = True
+    capture.config["ports"] = [ports[index] for option, index in selected]
+    capture.config["baud"] = 115200
+    capture.config["latch_timeout"] = 50
+
+    capture.start()
+    print("Capturing " + ", ".join(capture.curve_keys) + ", press enter to stop")
+    input()
+    capture.end()
+    capture.close()
@@ -0,0 +1,200 @@
+import numpy as np
+
+from src.disk_buffer import DiskBuffer
+from src.decimation import minmax_columns, minmax_decimate, visible_slice
+from src.rolling_buffer import RollingBuffer
+
+# The coarsest pyramid level still has this many buckets
+MIN_LEVEL_ROWS = 16
+# Rows collected before they are merged into the pyramid, merging costs
+# about the same for a few rows as for this many
+PYRAMID_BLOCK = 1024
+
+
+def _drop_missing(x: np.ndarray, *columns: np.ndarray) -> tuple:
+    """The rows in which the first of columns has a value"""
+    present = ~np.isnan(columns[0])
+    if present.all():
+        return (x,) + columns
+    return (x[present],) + tuple(column[present] for column in columns)
+
+
+class PlotHistory:
+    """History of all curves of a plot for the static view and export
+
+    Rows hold a timestamp and one value per curve, NaN for a curve without a
+    sample at that time, which is how the ports of a multi-port capture
+    share the table. Each curve is a column of it.
+
+    Besides the newest capacity rows it keeps a level-of-detail pyramid:
+    level k holds the first time, and per curve the minimum, maximum and
+    mean, of every 2**k rows. The levels grow as rows arrive, a level only
+    updating the one above it once a bucket is complete. Rows are merged a
+    block at a time, and before every render, so small appends stay cheap.
+    Drawing a view takes the coarsest level that still has a bucket for every
+    pixel, which keeps a redraw of a whole day as quick as one of a few
+    milliseconds.
+
+    Given a path, every row and the whole pyramid also go to DiskBuffers
+    there, and the static view draws from those. The history is then only
+    bounded by the disk, and a redraw only pages in the rows of one level
+    that fall in the view. Export still takes the newest capacity rows.
+    """
+
+    def __init__(self, n_curves: int, capacity: int, path: str = None) -> None:
+        """
+        Args:
+            n_curves (int): Values per row
+            capacity (int): Newest rows kept in memory
+            path (str, optional): Prefix of the files holding the whole
+                history. Defaults to keeping the newest capacity rows only.
+        """
+        self.n_curves = n_curves
+        self.raw = RollingBuffer(capacity, 1 + n_curves)
+        self.path = path
+        self.disk = None if path == None else DiskBuffer(path + ".raw", 1 + n_curves)
+        # Rows of time, then the minimum, maximum and mean of every curve.
+        # levels[0] is level 1. On disk they are added as the history grows
+        self.levels = []
+        rows = capacity // 2
+        while path == None and rows >= MIN_LEVEL_ROWS:
+            self.levels.append(RollingBuffer(rows, 1 + 3 * n_curves))
+            rows //= 2
+        # Buckets of each level that wait for a second one to merge with
+        self.pending = [np.empty((0, 1 + 3 * n_curves)) for _ in self.levels]
+        # Newest rows not merged into the pyramid yet
+        self.n_unmerged = 0
+
+    def __len__(self):
+        if self.disk == None:
+            return len(self.raw)
+        return len(self.disk) + self.n_unmerged
+
+    def append(self, rows: np.ndarray):
+        """Append rows of shape (n, 1 + n_curves), timestamp first"""
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, 1 + self.n_curves)
+        if self.n_unmerged + len(rows) > self.raw.capacity:
+            # The buffer is about to drop rows that were never merged
+            self.merge()
+            self._merge_rows(rows)
+            self.raw.append(rows)
+            return
+        self.raw.append(rows)
+        self.n_unmerged += len(rows)
+        if self.n_unmerged >= PYRAMID_BLOCK:
+            self.merge()
+
+    def merge(self):
+        """Merge the rows appended since the last merge into the pyramid"""
+        if self.n_unmerged == 0:
+            return
+        rows = self.raw.view(self.n_unmerged)
+        self.n_unmerged = 0
+        self._merge_rows(rows)
+
+    def _merge_rows(self, samples: np.ndarray):
+        if self.disk != None:
+            self.disk.append(samples)
+        n = self.n_curves
+        values = samples[:, 1:]
+        rows = np.hstack((samples[:, :1], values, values, values))
+        i = 0
+        while True:
+            if i == len(self.levels):
+                if self.disk == None:
+                    break
+                self.levels.append(
+                    DiskBuffer(self.path + ".level" + str(i + 1), 1 + 3 * n)
+                )
+                self.pending.append(np.empty((0, 1 + 3 * n)))
+            level = self.levels[i]
+            if len(self.pending[i]) > 0:
+                rows = np.concatenate((self.pending[i], rows))
+            n_paired = len(rows) - len(rows) % 2
+            self.pending[i] = rows[n_paired:]
+            if n_paired == 0:
+                break
+            first = rows[0:n_paired:2]
+            second = rows[1:n_paired:2]
+            # A curve missing from one bucket takes the other's values
+            first_mean = first[:, 1 + 2 * n :]
+            second_mean = second[:, 1 + 2 * n :]
+            mean = np.where(
+                np.isnan(first_mean),
+                second_mean,
+                np.where(
+                    np.isnan(second_mean), first_mean, (first_mean + second_mean) / 2
+                ),
+            )
+            rows = np.hstack(
+                (
+                    first[:, :1],
+                    np.fmin(first[:, 1 : 1 + n], second[:, 1 : 1 + n]),
+                    np.fmax(first[:, 1 + n : 1 + 2 * n], second[:, 1 + n : 1 + 2 * n]),
+                    mean,
+                )
+            )
+            level.append(rows)
+            i += 1
+
+    def samples(self):
+        """Where the static view draws the rows from"""
+        return self.raw if self.disk == None else self.disk
+
+    def view(self) -> np.ndarray:
+        """The newest capacity rows, see RollingBuffer.view"""
+        return self.raw.view()
+
+    def column(self, index: int) -> np.ndarray:
+        """One column of every row in the history, 0 for the timestamps"""
+        self.merge()
+        return self.samples().column(index)
+
+    def level(self, k: int) -> np.ndarray:
+        """Rows of level k, each covering 2**k rows, see levels"""
+        self.merge()
+        return self.levels[k - 1].view()
+
+    def clear(self):
+        self.raw.clear()
+        for level in self.levels:
+            level.clear()
+        if self.disk != None:
+            self.disk.clear()
+        self.pending = [np.empty((0, 1 + 3 * self.n_curves)) for _ in self.levels]
+        self.n_unmerged = 0
+
+    def close(self):
+        """Delete the files of a history kept on disk"""
+        if self.disk == None:
+            return
+        self.disk.close()
+        for level in self.levels:
+            level.close()
+
+    def render(self, curve_id: int, x_min: float, x_max: float, n_pixels: int):
+        """(x, y) arrays drawing one curve from x_min to x_max, n_pixels wide
+
+        The newest rows that have not filled a bucket of the chosen level are
+        left out, they cover less than a pixel.
+        """
+        self.merge()
+        samples = self.samples()
+        x = samples.column(0)
+        visible = visible_slice(x, x_min, x_max)
+        n_visible = visible.stop - visible.start
+        k = 0
+        while k < len(self.levels) and n_visible >> (k + 1) >= n_pixels:
+            k += 1
+        if k == 0:
+            x, y = _drop_missing(x[visible], samples.column(1 + curve_id)[visible])
+            return minmax_decimate(x, y, x_min, x_max, n_pixels)
+        level = self.levels[k - 1]
+        times = level.column(0)
+        visible = visible_slice(times, x_min, x_max)
+        times, y_min, y_max = _drop_missing(
+            times[visible],
+            level.column(1 + curve_id)[visible],
+            level.column(1 + self.n_curves + curve_id)[visible],
+        )
+        return minmax_columns(times, y_min, y_max, x_min, x_max, n_pixels)
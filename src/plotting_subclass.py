@@ -1,4 +1,8 @@
 import sys
+import os
+import shutil
+import tempfile
+import logging
 import numpy as np
 import pyqtgraph as pg
 from PyQt5.QtWidgets import (
@@ -12,6 +16,7 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QHBoxLayout,
     QColorDialog,
+    QFileDialog,
 )
 from PyQt5.QtCore import QThread, pyqtSignal, QTimer, Qt, QSize
 import time
@@ -19,6 +24,21 @@ import random
 from datetime import datetime
 from multiprocessing import Process, Queue
 from src.message_classes import RXMessage
+from src.export import ExportJob, iter_live_chunks
+from src.metrics import StageTimes, timed_stage
+from src.rolling_buffer import RollingBuffer
+from src.plot_history import PlotHistory
+
+# Sent message markers kept on the plot, the oldest go first
+MAX_TX_MARKERS = 200
+# Newest points of each source on the live plot
+LIVE_POINTS = 1000
+# Points per curve kept in memory for the static view and export, unless the
+# "history_points" setting says otherwise
+HISTORY_POINTS = 100000
+# Frames per second drawn at most, unless the "frame_rate" setting says
+# otherwise. Data is taken in once per frame
+FRAME_RATE = 60
 
 
 class DataGenerator(Process):
@@ -54,10 +74,40 @@ class CustomPlotWidget(pg.PlotWidget):
 
 
 class LivePlotter(QWidget):
-    def __init__(self, points_queue, curve_keys=None, parent=None):
+    def __init__(
+        self,
+        points_queue,
+        curve_keys=None,
+        parent=None,
+        ring=None,
+        stage_times=None,
+        max_points=HISTORY_POINTS,
+        history_dir=None,
+        frame_rate=FRAME_RATE,
+        live_points=LIVE_POINTS,
+    ):
+        """
+        Args:
+            live_points (int, optional): Newest rows on the live plot. Rows
+                hold one port's values each, so a multi-port capture needs
+                this many per port. Defaults to LIVE_POINTS.
+            frame_rate (float, optional): Frames per second drawn at most.
+                Defaults to FRAME_RATE.
+            history_dir (str, optional): Directory to keep the whole history
+                in, for the static view. Defaults to keeping the newest
+                max_points per curve only.
+        """
         super().__init__(parent)
         self.parent = parent
         self.data_queue = points_queue
+        # Time spent in each timer callback, shared with the window's metrics
+        self.stage_times = StageTimes() if stage_times == None else stage_times
+        # Optional SharedRingBuffer read by index alongside the message queue
+        self.ring = ring
+        self.ring_cursor = 0
+        self.n_overwritten = 0
+        # Curve keys of the queued messages to their columns, see queue_columns
+        self.columns_of_keys = {}
         if curve_keys == None:
             self.curve_keys = ["a", "b", "c", "d", "e", "f", "g", "h", "i"]
         else:
@@ -69,12 +119,14 @@ class LivePlotter(QWidget):
         self.main_layout.addWidget(self.plot_widget)
         self.legend = self.plot_widget.addLegend()
 
-        self.max_points = 10000
+        self.max_points = max_points
+        self.live_points = live_points
+        self.history_dir = None
+        if history_dir != None:
+            os.makedirs(history_dir, exist_ok=True)
+            self.history_dir = tempfile.mkdtemp(prefix="history_", dir=history_dir)
         self.has_downsampled = False
         self.plot_curves = []
-        self.displayed_data = []
-        self.total_data = []
-        self.cached_total_data = []
         # self.points_queue = points_queue
         # self.data_generator = DataGenerator(self.data_queue)
         # self.data_generator.start()
@@ -106,9 +158,6 @@ class LivePlotter(QWidget):
         self.checkbox_layout.setHorizontalSpacing(1)
 
         self.plot_curves = []
-        self.displayed_data = []
-        self.total_data = []
-        self.cached_total_data = []
         self.color_buttons = []
         self.checkboxes = []
         self.num_curves = len(self.curve_keys)
@@ -127,7 +176,8 @@ class LivePlotter(QWidget):
             checkbox.setFixedHeight(10)
 
             color_button = QPushButton()
-            color_button.setStyleSheet(f"background-color: {self.colors[i]}")
+            color = self.colors[i % len(self.colors)]
+            color_button.setStyleSheet(f"background-color: {color}")
             color_button.setFixedWidth(15)  # Fixed width for color buttons
             color_button.clicked.connect(lambda _, idx=i: self.open_color_picker(idx))
             self.color_buttons.append(color_button)
@@ -143,32 +193,45 @@ class LivePlotter(QWidget):
                 curve_container, i // 3, i % 3
             )  # Arranging curve containers
 
-            curve = self.plot_widget.plot(pen=self.colors[i])
+            curve = self.plot_widget.plot(pen=color)
             self.legend.addItem(curve, self.curve_keys[i])
             self.plot_curves.append(curve)
-            self.displayed_data.append([])
-            self.total_data.append([])
-            self.cached_total_data.append([])
+
+        # Rows of a timestamp and a value per curve, NaN for a curve without a
+        # sample at that time. Each curve is a column
+        self.displayed_data = RollingBuffer(self.live_points, 1 + self.num_curves)
+        self.total_data = PlotHistory(
+            self.num_curves, self.max_points, self._history_path()
+        )
+        # Curve index to the time of its oldest point not drawn yet
+        self.dirty = {}
+        # (min, max) of each curve's live window, kept for the curves drawn
+        self.y_bounds = [None] * self.num_curves
+        self.live_range = None
+        self.n_frames = 0
+        self.frames_since = time.perf_counter()
+        self.last_fps = 0
 
         self.timer = QTimer()
         self.timer2 = QTimer()
 
-        self.timer.timeout.connect(self.update_plot)
+        # A frame takes in everything that arrived since the last one, then
+        # draws it
+        self.timer.setTimerType(Qt.PreciseTimer)
         self.timer.timeout.connect(self.process_queue)
+        self.timer.timeout.connect(self.process_ring)
+        self.timer.timeout.connect(self.update_plot)
 
-        self.timer.start(1)
+        self.timer.start(max(round(1000 / frame_rate), 1))
         self.timer2.start(250)
         self.timer2.timeout.connect(self.update_title)
 
-        self.last_update = time.time()
-        self.fps = 0
-        self.fps_avg_n = 0
-
         # Crosshair Cursor
         self.vLine = pg.InfiniteLine(angle=90, movable=False)
         self.hLine = pg.InfiniteLine(angle=0, movable=False)
         self.plot_widget.addItem(self.vLine, ignoreBounds=True)
         self.plot_widget.addItem(self.hLine, ignoreBounds=True)
+        self.tx_markers = []
         self.mouse_label = QLabel()
         self.mouse_label.setFixedHeight(11)
         self.main_layout.addWidget(self.mouse_label)
@@ -176,6 +239,7 @@ class LivePlotter(QWidget):
         self.plot_widget.sigMouseWheelScrolled.connect(
             self.mouse_scrolled
         )  # Connect the custom signal
+        self.plot_widget.getViewBox().sigXRangeChanged.connect(self.view_range_changed)
 
         # Buttons layout
         buttons_layout = QHBoxLayout()
@@ -196,6 +260,14 @@ class LivePlotter(QWidget):
         self.view_all_button.clicked.connect(self.toggle_view_all)
         buttons_layout.addWidget(self.view_all_button)
 
+        # Export Button
+        self.export_button = QPushButton("Export")
+        self.export_button.clicked.connect(self.export_data)
+        buttons_layout.addWidget(self.export_button)
+        self.export_job = None
+        self.export_timer = QTimer()
+        self.export_timer.timeout.connect(self.update_export_progress)
+
         self.hide_menu = True
         self.checkbox_container.hide()
         self.hide_all = True
@@ -218,7 +290,9 @@ class LivePlotter(QWidget):
             self.checkbox_container.show()
 
     def calculate_displayed_points(self):
-        total_displayed_points = sum(len(data) for data in self.displayed_data)
+        total_displayed_points = int(
+            np.count_nonzero(~np.isnan(self.displayed_data.view()[:, 1:]))
+        )
         return total_displayed_points
 
     def toggle_view_all(self):
@@ -241,32 +315,86 @@ class LivePlotter(QWidget):
     def open_color_picker(self, idx):
         color = QColorDialog.getColor()
         if color.isValid():
-            self.colors[idx] = color.name()
+            self.colors[idx % len(self.colors)] = color.name()
             self.plot_curves[idx].setPen(pg.mkPen(color.name()))
             self.color_buttons[idx].setStyleSheet(f"background-color: {color.name()}")
 
     def toggle_curve(self, idx, checked):
         self.plot_curves[idx].setVisible(checked)
+        if self.is_live:
+            self.update_live_range()
 
+    @timed_stage("process_queue")
     def process_queue(self):
+        # Collected first, a buffer append costs the same for one row as for
+        # many
+        rows = []
         while not self.data_queue.empty():
             messsage: RXMessage
             messsage = self.data_queue.get()
-            plottable_list = messsage.as_plottable_list()
-            for i in range(0, len(plottable_list)):
-                self.receive_data(i, plottable_list[i])
-        pass
+            # Curves the message has no value for stay empty
+            row = [np.nan] * (1 + self.num_curves)
+            row[0] = messsage.dut_offset_ns() / 1e9
+            columns = self.queue_columns(messsage.as_curve_keys())
+            for column, value in zip(columns, messsage.as_values()):
+                if column != None:
+                    row[column] = value
+            rows.append(row)
+        if len(rows) > 0:
+            self.receive_rows(np.array(rows, dtype=np.float64))
+
+    def queue_columns(self, keys) -> list:
+        """Column of each of a message's curve keys, None for keys not plotted
+
+        Messages of a multi-port capture only hold their own port's curves,
+        so values are placed by key rather than by position.
+        """
+        keys = tuple(keys)
+        columns = self.columns_of_keys.get(keys)
+        if columns == None:
+            index = {key: 1 + i for i, key in enumerate(self.curve_keys)}
+            columns = [index.get(key) for key in keys]
+            self.columns_of_keys[keys] = columns
+        return columns
+
+    @timed_stage("process_ring")
+    def process_ring(self):
+        if self.ring == None:
+            return
+        timestamps, values, self.ring_cursor, n_overwritten = self.ring.read(
+            self.ring_cursor
+        )
+        self.n_overwritten += n_overwritten
+        if len(timestamps) == 0:
+            return
 
-    def receive_data(self, curve_id, data_point):
-        x, y = data_point
+        # The ring's rows are already a timestamp and a value per channel, with
+        # NaN where a merged multi-port ring leaves other ports' columns
+        rows = np.full((len(timestamps), 1 + self.num_curves), np.nan)
+        rows[:, 0] = timestamps / 1e9
+        n_columns = min(self.num_curves, values.shape[1])
+        rows[:, 1 : 1 + n_columns] = values[:, :n_columns]
+        self.receive_rows(rows)
+
+    def receive_rows(self, rows):
+        """Append rows of a timestamp and a value per curve, NaN if missing"""
+        if len(rows) == 0:
+            return
         if self.is_live:
-            self.displayed_data[curve_id].append((x, y))
-            if len(self.displayed_data[curve_id]) > 1000:
-                self.displayed_data[curve_id].pop(0)
+            self.displayed_data.append(rows)
+        self.total_data.append(rows)
+        first_x = rows[0, 0]
+        # Only the curves with values in these rows are redrawn. A curve that
+        # got none keeps its points until it does, they scroll out of the live
+        # view like the window would have dropped them
+        changed = ~np.isnan(rows[:, 1:]).all(axis=0)
+        for i in np.flatnonzero(changed):
+            self.dirty[i] = min(self.dirty.get(i, first_x), first_x)
 
-        self.total_data[curve_id].append((x, y))
-        if len(self.total_data[curve_id]) > self.max_points:
-            self.total_data[curve_id].pop(0)
+    def receive_data(self, curve_id, data_point):
+        row = np.full((1, 1 + self.num_curves), np.nan)
+        row[0, 0], row[0, 1 + curve_id] = data_point
+        self.receive_rows(row)
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Left:
@@ -274,52 +402,93 @@ class LivePlotter(QWidget):
         elif event.key() == Qt.Key_Right:
             self.pan_plot("right")
 
+    @timed_stage("update_plot")
     def update_plot(self):
+        """Draw the curves that got new points since the last frame"""
+        if len(self.dirty) == 0:
+            return
         if self.is_live:
-            for i, curve in enumerate(self.plot_curves):
-                x_vals, y_vals = (
-                    zip(*self.displayed_data[i]) if self.displayed_data[i] else ([], [])
-                )
-                # print(x_vals, y_vals)
-                curve.setData(x_vals, y_vals)  # Update plot data
-            self.plot_widget.autoRange()
-
-        now = time.time()
-        dt = now - self.last_update
-        if dt > 0:
-            self.fps += 1.0 / dt
-            self.fps_avg_n += 1
-            self.last_update = now
+            x_vals = self.displayed_data.column(0)
+            for i in self.dirty:
+                # Views of the buffer, never written again, so not copied
+                x, y = x_vals, self.displayed_data.column(1 + i)
+                present = ~np.isnan(y)
+                if not present.all():
+                    # Rows of other ports, or messages too short for the curve
+                    x, y = x[present], y[present]
+                self.plot_curves[i].setData(x, y)
+                self.y_bounds[i] = (y.min(), y.max()) if len(y) > 0 else None
+            self.update_live_range()
+        else:
+            # The static view only changes if the new points are in it
+            x_min, x_max = self.plot_widget.viewRange()[0]
+            if min(self.dirty.values()) > x_max:
+                self.dirty.clear()
+                return
+            self.update_static_view(x_min, x_max)
+        self.dirty.clear()
+        self.n_frames += 1
+
+    def update_live_range(self):
+        """Fit the view to the live windows of the visible curves
+
+        Takes the bounds kept by update_plot instead of autoRange, which would
+        go through every point of every curve.
+        """
+        y_mins, y_maxs = [], []
+        for i, curve in enumerate(self.plot_curves):
+            if not curve.isVisible() or self.y_bounds[i] == None:
+                continue
+            y_mins.append(self.y_bounds[i][0])
+            y_maxs.append(self.y_bounds[i][1])
+        if len(y_mins) == 0:
+            return
+        # The curves share the timestamps
+        x_vals = self.displayed_data.column(0)
+        live_range = (x_vals[0], x_vals[-1], min(y_mins), max(y_maxs))
+        if live_range != self.live_range:
+            self.live_range = live_range
+            self.plot_widget.setRange(xRange=live_range[0:2], yRange=live_range[2:4])
+
+    def add_tx_markers(self, messages):
+        """Mark the send time of each TX message on the time axis"""
+        pen = pg.mkPen("w", style=Qt.DashLine)
+        for message in messages:
+            marker = pg.InfiniteLine(pos=message.sent_ns / 1e9, angle=90, pen=pen)
+            marker.setToolTip(message.message)
+            self.plot_widget.addItem(marker, ignoreBounds=True)
+            self.tx_markers.append(marker)
+        while len(self.tx_markers) > MAX_TX_MARKERS:
+            self.plot_widget.removeItem(self.tx_markers.pop(0))
 
     def get_total_points(self):
         if self.is_live:
-            total = 0
-            for list in self.displayed_data:
-                total += len(list)
-            return total
+            return self.calculate_displayed_points()
         else:
             return self.total_data_num_snapshot
 
     def update_title(self):
-        if self.fps_avg_n == 0:
-            return
+        # Frames that drew something, a frame without new points is skipped
+        now = time.perf_counter()
+        self.last_fps = self.n_frames / (now - self.frames_since)
+        self.n_frames = 0
+        self.frames_since = now
         self.setWindowTitle(
-            f"Live Plotter - FPS: {(self.fps/self.fps_avg_n):.2f}, n: {self.get_total_points()}"
+            f"Live Plotter - FPS: {self.last_fps:.2f}, n: {self.get_total_points()}"
         )
-        self.fps_avg_n = 0
-        self.fps = 0
 
     def calculate_total_points_shown(self):
         view_range = self.plot_widget.viewRange()
         x_min, x_max = view_range[0]  # x-axis range
 
+        # Count the values of every curve within the view range
+        x_vals = self.total_data.column(0)
+        in_range = (x_min <= x_vals) & (x_vals <= x_max)
         total_displayed_points = 0
-        for curve_data in self.total_data:
-            # Count the number of points within the view range for each curve
-            points_in_range = [
-                point for point in curve_data if x_min <= point[0] <= x_max
-            ]
-            total_displayed_points += len(points_in_range)
+        for i in range(self.num_curves):
+            y_vals = self.total_data.column(1 + i)
+            total_displayed_points += np.count_nonzero(in_range & ~np.isnan(y_vals))
+        return total_displayed_points
 
     def mouse_scrolled(self, event):
         # if not self.is_live:
@@ -337,6 +506,73 @@ class LivePlotter(QWidget):
         #     print(f"Total displayed points in view range: {total_displayed_points}")
         pass
 
+    def view_range_changed(self, view_box, x_range):
+        if not self.is_live:
+            self.update_static_view(*x_range)
+
+    def update_static_view(self, x_min, x_max):
+        """Draw the history between x_min and x_max, decimated to the view's width"""
+        n_pixels = self.plot_widget.getViewBox().width()
+        for i, curve in enumerate(self.plot_curves):
+            curve.setData(*self.total_data.render(i, x_min, x_max, n_pixels))
+
+    def _history_path(self):
+        if self.history_dir == None:
+            return None
+        return os.path.join(self.history_dir, "plot")
+
+    def close_history(self):
+        """Stop plotting and delete the history kept on disk"""
+        # Nothing may append to the closed files
+        self.timer.stop()
+        self.total_data.close()
+        if self.history_dir != None:
+            shutil.rmtree(self.history_dir, ignore_errors=True)
+            self.history_dir = None
+
+    def export_data(self):
+        if self.export_job != None:  # Exporting
+            self.export_job.cancel()
+            return
+
+        path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export data",
+            "logging",
+            "CSV (*.csv);;NumPy array (*.npy);;NumPy archive (*.npz)",
+        )
+        if path == "":
+            return
+
+        # A view of the history stays as it is while more rows arrive, it is
+        # written out on the job's thread one chunk at a time
+        snapshot = self.total_data.view()
+        try:
+            self.export_job = ExportJob(
+                path,
+                self.curve_keys,
+                iter_live_chunks(snapshot),
+                n_rows=len(snapshot),
+            )
+        except ValueError as e:
+            logging.error(str(e))
+            return
+        self.export_job.start()
+        self.export_timer.start(100)
+
+    def update_export_progress(self):
+        if self.export_job.done:
+            self.export_timer.stop()
+            self.export_job = None
+            self.export_button.setText("Export")
+            return
+
+        progress = self.export_job.progress()
+        if progress == None:
+            self.export_button.setText("Cancel Export")
+        else:
+            self.export_button.setText(f"Cancel Export ({progress * 100:.0f}%)")
+
     def closeEvent(self, event):
         # self.data_generator.terminate()  # Terminate the data generator process
         event.accept()
@@ -376,25 +612,29 @@ class LivePlotter(QWidget):
         if self.is_live:
             self.start_stop_button.setText("Stop")
             # Resume live plotting
+            self.plot_widget.setMouseEnabled(x=False, y=False)  # Disable scrolling
+            # update_plot sets the range itself
+            self.plot_widget.disableAutoRange()
+            self.displayed_data.clear()
             for i in range(self.num_curves):
-                self.plot_widget.setMouseEnabled(x=False, y=False)  # Disable scrolling
-                self.displayed_data[i].clear()
+                self.y_bounds[i] = None
+                # Empties the curve on the next frame
+                self.dirty[i] = -np.inf
+            self.live_range = None
         else:
             self.start_stop_button.setText("Start")
             # Freeze plot and display all data
-            for i in range(self.num_curves):
-                # self.cached_total_data[i] = self.total_data[i].copy()
-                self.plot_widget.setMouseEnabled(x=True, y=False)  # Enable scrolling
-                x_vals, y_vals = (
-                    zip(*self.total_data[i]) if self.total_data[i] else ([], [])
-                )
-                self.plot_curves[i].setData(x_vals, y_vals)  # Set formatted (x, y) data
+            self.plot_widget.setMouseEnabled(x=True, y=False)  # Enable scrolling
+            # Every range change redraws the curves, which must not move the
+            # range again
+            self.plot_widget.enableAutoRange(x=False, y=True)
+            if len(self.total_data) > 0:
+                x_vals = self.total_data.column(0)
+                self.update_static_view(x_vals[0], x_vals[-1])
             self.plot_widget.autoRange()
 
-            total = 0
-            for list in self.total_data:
-                total += len(list)
-            self.total_data_num_snapshot = total
+            # Rows the static view can show, the oldest may have been dropped
+            self.total_data_num_snapshot = len(self.total_data)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+import numpy as np
+
+
+class RollingBuffer:
+    """The newest capacity rows of a growing series, in a preallocated array
+
+    Rows are written after the last one into an array with room for twice the
+    capacity. Once it is full the newest capacity rows move to a fresh array,
+    so appending is O(1) amortized and the newest rows are always one
+    contiguous slice. Columns are stored column-major, which makes every
+    column of that slice contiguous as well.
+
+    Rows are never written twice, so the views returned by view() stay valid
+    after later appends and can be handed to PlotDataItem.setData without a
+    copy, even if the plot is only painted after more data came in.
+    """
+
+    def __init__(self, capacity: int, n_columns: int = 2, dtype=np.float64) -> None:
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1: " + str(capacity))
+        self.capacity = capacity
+        self.n_columns = n_columns
+        self.dtype = dtype
+        self.data = np.empty((2 * capacity, n_columns), dtype=dtype, order="F")
+        self.end = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, rows: np.ndarray):
+        """Append rows of shape (n, n_columns), or a single row of n_columns"""
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.n_columns)
+        if len(rows) >= self.capacity:
+            rows = rows[-self.capacity :]
+        n_rows = len(rows)
+        if self.end + n_rows > len(self.data):
+            # A fresh array instead of moving the rows down in place, views of
+            # the old one may still be waiting to be painted
+            n_kept = min(self.size, self.capacity - n_rows)
+            data = np.empty_like(self.data, order="F")
+            data[:n_kept] = self.data[self.end - n_kept : self.end]
+            self.data = data
+            self.end = n_kept
+            self.size = n_kept
+        self.data[self.end : self.end + n_rows] = rows
+        self.end += n_rows
+        self.size = min(self.size + n_rows, self.capacity)
+
+    def view(self, n: int = None) -> np.ndarray:
+        """The newest n rows, all of them by default, oldest first"""
+        n = self.size if n == None else min(n, self.size)
+        return self.data[self.end - n : self.end]
+
+    def column(self, index: int) -> np.ndarray:
+        """Contiguous view of one column of the newest rows"""
+        return self.view()[:, index]
+
+    def clear(self):
+        self.end = 0
+        self.size = 0
@@ -11,7 +11,8 @@ import random
 import queue
 from typing import List
 import multiprocessing
-from pick import pick
+import argparse
+import signal
 from datetime import datetime, timedelta
 from pprint import pprint
 import logging
@@ -23,7 +24,20 @@ from rich.live import Live
 from rich.table import Table
 import time
 
-from src.message_classes import TXMessage, RXMessage, Message, MessageProcessException
+from src.message_classes import (
+    TXMessage,
+    RXMessage,
+    RXBatch,
+    Message,
+    MessageProcessException,
+)
+from src.line_parser import BatchLineParser
+from src.shared_buffers import SharedRingBuffer, SharedCounters
+from src.bounded_queue import BoundedQueue
+from src.capture_log import LOG_FORMATS, open_log_writer
+from src.binary_protocol import FrameDecoder, WireSchema
+from src.virtual_device import VIRTUAL_DESC, VIRTUAL_HWID, list_virtual_ports
+from src.tx_scheduler import SCRIPT_SWITCH_INTERVAL, TXScript, play_script
 
 console = Console()
 
@@ -44,6 +58,22 @@ class SerialPort:
         return str(self.port) + " (" + str(self.desc) + ")"
 
 
+def list_ports() -> List[SerialPort]:
+    """Serial ports of the system, then the running virtual devices
+
+    Returns:
+        list(SerialPort): Ports in a stable order
+    """
+    ports = serial.tools.list_ports.comports()
+    ports_list = []
+    for port, desc, hwid in sorted(ports):
+        ports_list.append(SerialPort(port, desc, hwid))
+    for entry in list_virtual_ports():
+        ports_list.append(SerialPort(entry["port"], VIRTUAL_DESC, VIRTUAL_HWID))
+
+    return ports_list
+
+
 class SerialClass:
     def __init__(self, cachesize, enable_logging=True, verbose=False) -> None:
         self.cachesize = cachesize
@@ -53,11 +83,39 @@ class SerialClass:
         self.last_rx_time = 0
         self.last_rx_n = 0
 
-        manager = multiprocessing.Manager()
-        self.rx_messages = multiprocessing.Queue()
-        self.tx_messages = multiprocessing.Queue()
-        self.config = manager.dict()
-        self.all_messages = manager.list()
+        # Numeric samples go through shared memory, rx_messages only carries the
+        # messages that change the curve keys or statuses
+        self.ring = SharedRingBuffer(capacity=cachesize)
+        # Bounded, with the policies of the "queues" config, see BoundedQueue
+        self.rx_messages = BoundedQueue.from_settings("rx_messages", multiprocess=True)
+        self.tx_messages = BoundedQueue.from_settings("tx_messages", multiprocess=True)
+        # Every message once it was written, with its send time, for the plot
+        self.tx_sent = BoundedQueue.from_settings("tx_sent", multiprocess=True)
+        # Written by the serial process, read by the GUI without an IPC round trip
+        # Seconds counters are the time spent in that stage, see MetricsRegistry
+        self.counters = SharedCounters(
+            [
+                "rx_messages",
+                "rx_bytes",
+                "rx_hz",
+                "tx_messages",
+                "rx_corrupt_frames",
+                "rx_lines",
+                "rx_latch_failures",
+                "rx_parse_seconds",
+                "rx_publish_seconds",
+                "log_write_seconds",
+                "log_rows",
+                "log_flushed_rows",
+                "log_flush_time",
+                "tx_late_seconds",
+                "tx_late_max_seconds",
+            ]
+        )
+        self.stop_event = multiprocessing.Event()
+        # Filled in before start(), the serial process gets its own copy
+        self.config = {}
+        self.log_writer = None
 
         if verbose:
             logging.basicConfig(
@@ -71,218 +129,621 @@ class SerialClass:
         Returns:
             list(SerialPort): List of SerialPort objects
         """
-        ports = serial.tools.list_ports.comports()
-        ports_list = []
-        for port, desc, hwid in sorted(ports):
-            ports_list.append(SerialPort(port, desc, hwid))
+        return list_ports()
 
-        return ports_list
+    def _log_helper(self):
+        logging.basicConfig(
+            format="Log Thread: %(message)s",
+            level=logging.DEBUG,
+        )
+        logging.info("Log thread started")
+        while self.logging_thread_enabled:
+            time.sleep(self.log_flush_interval)
+            # Rows handed to the writer before the flush are on disk after it
+            n_rows = self.counters["log_rows"]
+            self.log_writer.flush(fsync=True)
+            self.counters["log_flushed_rows"] = n_rows
+            self.counters["log_flush_time"] = time.time()
 
-    def _log(self, header: dict = None, data: dict = None, verbose=False):
-        """Log either a header or data to the current logfile associated with this file
+    def _handle_tx(self):
+        """Send queued TX messages, blocking on the queue while there is nothing to send
 
-        Args:
-            header (dict, optional): header dict data. Defaults to None.
-            data (dict, optional): data to log. Defaults to None.
+        Runs on its own thread inside the serial process so a pending TX message
+        wakes it immediately instead of waiting for the RX loop to come around.
         """
-        if header == None and data == None:
-            return
+        while True:
+            message_to_send = self.tx_messages.get()
+            if isinstance(message_to_send, TXScript):
+                self._start_script(message_to_send)
+                continue
+            logging.debug(
+                "Sending following message: " + str(message_to_send.sendable())
+            )
+            self._send(message_to_send)
 
-        if not self.log_enabled:
-            return
+    def _send(self, message: TXMessage):
+        """Write one message, then log it and report it to the GUI with its send time
 
-        # Check if the file exists
-        if os.path.exists("logging/" + self.log_instance_name + ".json"):
-            # Read existing data
-            try:
-                with open("logging/" + self.log_instance_name + ".json", "r") as file:
-                    # Read existing data, expecting it to be a dictionary
-                    existing_data = json.load(file)
-                    # Ensure the existing data is a dictionary
-                    if not isinstance(existing_data, dict):
-                        existing_data = {"header": {}, "data": []}
-            except json.JSONDecodeError:
-                # In case of a decoding error, start with an empty dictionary
-                existing_data = {"header": {}, "data": []}
-        else:
-            existing_data = {"header": {}, "data": []}
+        Called from the TX and script threads, which take turns on the port.
+        """
+        try:
+            with self.tx_lock:
+                message.sent_ns = time.time_ns()
+                self.ser.write(message.sendable())
+                self.counters.add("tx_messages")
+                if message.scheduled_ns != None:
+                    late = max(message.sent_ns - message.scheduled_ns, 0) / 1e9
+                    self.counters.add("tx_late_seconds", late)
+                    if late > self.counters["tx_late_max_seconds"]:
+                        self.counters["tx_late_max_seconds"] = late
+            if self.log_writer != None:
+                self.log_writer.write(message)
+            self.tx_sent.put(message)
+        except Exception as e:
+            logging.error(f"Error sending message: {e}")
+
+    def _start_script(self, script: TXScript):
+        """Play a script on its own thread, replacing the one playing"""
+        self.script_stop.set()
+        if self.script_thread != None:
+            self.script_thread.join()
+        self.script_stop = threading.Event()
+        if len(script) == 0:
+            logging.info("TX script stopped")
+            return
+        self.script_thread = threading.Thread(
+            target=self._play_script, args=(script, self.script_stop), daemon=True
+        )
+        self.script_thread.start()
 
-        if header != None:
-            existing_data["header"].update(header)
+    def _play_script(self, script: TXScript, stop_event: threading.Event):
+        logging.info(
+            "Playing TX script of %d commands over %.3f s",
+            len(script),
+            script.duration(),
+        )
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(SCRIPT_SWITCH_INTERVAL)
+        try:
+            n_sent = play_script(script, self._send, stop_event)
+        finally:
+            sys.setswitchinterval(switch_interval)
+        logging.info(
+            "TX script sent %d commands, at most %.3f ms late",
+            n_sent,
+            1000 * self.counters["tx_late_max_seconds"],
+        )
 
-        if data != None:
-            existing_data_list = existing_data["data"]
-            new_data_list = existing_data_list.copy()
-            for item in data:
-                new_data_list.append(str(item.json_friendly_object()))
-            existing_data["data"] = new_data_list
+    def _read_chunk(self) -> bytes:
+        """Read everything waiting on the port
 
-        # Write data back to file
-        with open("logging/" + self.log_instance_name + ".json", "w") as file:
-            json.dump(existing_data, file, indent=4)
+        Blocks until at least one byte arrives or the port read timeout expires.
+        """
+        # Asking for at least one byte makes read() block (up to the port timeout)
+        # while the device is quiet instead of spinning on in_waiting
+        n_waiting = max(self.ser.in_waiting, 1)
+        if self.rx_chunk_size > 0:
+            n_waiting = min(n_waiting, self.rx_chunk_size)
+        data = self.ser.read(n_waiting)
+        # Host time the chunk arrived, what the first message is latched to
+        self.rx_time = datetime.now()
+        self.counters.add("rx_bytes", len(data))
+        return data
+
+    def _read_lines(self) -> List[str]:
+        """Read a chunk from the port and split it into complete lines
+
+        Bytes after the last newline are kept in self.rx_partial and prepended to
+        the next read, so a line split across two reads is never lost.
 
-        if verbose:
-            logging.debug("Logged to " + str(self.log_instance_name))
+        Returns:
+            list(str): Decoded lines with their line endings stripped
+        """
+        data = self.rx_partial + self._read_chunk()
+        lines = data.split(b"\n")
+        self.rx_partial = lines.pop()
+        return [line.decode("utf-8", errors="replace").rstrip() for line in lines]
 
-    def _log_helper(self):
-        logging.basicConfig(
-            format="Log Thread: %(message)s",
-            level=logging.DEBUG,
-        )
-        logging.info("Log thread started")
-        while self.logging_thread_enabled:
-            time.sleep(5)
-            logging.info("Logging heartbeat recieved")
-            self._log(data=self.all_messages)
-            self.all_messages = self.all_messages[:]
+    def _read_frames(self) -> List[RXBatch]:
+        """Read a chunk from the port and decode the binary frames it completes
 
-    def _handle_tx(self):
-        while not self.tx_messages.empty():
-            message_to_send: TXMessage
-            message_to_send = self.tx_messages.get_nowait()
-            try:
-                logging.debug(
-                    "Sending following message: " + str(message_to_send.sendable())
-                )
-                self.ser.write(message_to_send.sendable())
-                self.all_messages.append(message_to_send)
-            except Exception as e:
-                logging.error(f"Error sending message: {e}")
+        Returns:
+            list(RXBatch): The good frames, as at most one batch
+        """
+        data = self._read_chunk()
+        start = time.perf_counter()
+        records, n_corrupt = self.frame_decoder.feed(data)
+        if n_corrupt > 0:
+            self.counters.add("rx_corrupt_frames", n_corrupt)
+            logging.debug("Dropped %d corrupt frames", n_corrupt)
+        batches = []
+        if len(records) > 0:
+            batches.append(self.frame_decoder.schema.to_batch(records))
+        self.counters.add("rx_parse_seconds", time.perf_counter() - start)
+        return batches
+
+    def _parse_lines(self, latch_timeout: int) -> List[RXBatch]:
+        """Read a chunk from the port and parse the text lines it completes"""
+        lines = self._read_lines()
+        start = time.perf_counter()
+        batches, failed = self.line_parser.parse(lines)
+        self.counters.add("rx_parse_seconds", time.perf_counter() - start)
+        self.counters.add("rx_lines", len(lines))
+        if self.first_message != None or len(batches) > 0:
+            # Once latched a bad line is noise on the link, not a wrong port
+            if len(failed) > 0:
+                self.counters.add("rx_corrupt_frames", len(failed))
+                logging.debug("Dropped %d unparseable lines", len(failed))
+            return batches
+        self.counters.add("rx_latch_failures", len(failed))
+        for line in failed:
+            self.latch_attempts += 1
+            logging.info("Error in proccessing message: " + line)
+            if self.latch_attempts > latch_timeout:
+                raise Exception("Failed too many latch attempts")
+        return batches
 
     def _handle_rx(self, latch_timeout: int):
-        data = self.ser.readline().decode("utf-8").rstrip()
-        try:
-            message = RXMessage(str(data))
-            message.process()
+        if self.frame_decoder != None:
+            batches = self._read_frames()
+        else:
+            batches = self._parse_lines(latch_timeout)
+
+        for batch in batches:
             if self.first_message == None:
                 self.last_rx_time = time.perf_counter_ns()
-                self.time_of_first_message = datetime.now()
-                self.first_message = message
+                self.time_of_first_message = self.rx_time + timedelta(
+                    seconds=self.clock_offset
+                )
+                if self.align_clock:
+                    # Put the device's time zero on the host clock, so ports
+                    # latched at different moments share one timeline
+                    self.time_of_first_message -= batch.device_elapsed(0)
+                self.first_message = batch.message(0)
                 logging.debug("Latched first successful message")
                 logging.debug("First message time: " + str(self.time_of_first_message))
 
-            message.apply_offset(self.time_of_first_message)
-            self.all_messages.append(message)
-            self.rx_messages.put_nowait(message)
+            batch.apply_offset(self.time_of_first_message)
+            start = time.perf_counter()
+            if self.log_writer != None:
+                self.log_writer.write_batch(batch)
+                self.counters.add("log_rows", len(batch))
+            logged = time.perf_counter()
+            self.counters.add("log_write_seconds", logged - start)
+            self.counters.add("rx_messages", len(batch))
+            self._publish(batch)
+            self.counters.add("rx_publish_seconds", time.perf_counter() - logged)
 
-        except MessageProcessException:
-            self.latch_attempts += 1
-            logging.info("Error in proccessing message: " + str(message))
-            if self.latch_attempts > latch_timeout:
-                raise Exception("Failed too many latch attempts")
+    def _publish(self, batch: RXBatch):
+        """Write a batch of samples to the ring buffer and forward status changes
+
+        Rows with more channels than the ring has columns go through
+        rx_messages whole instead, as they would without a ring.
+
+        Args:
+            batch (RXBatch): Processed samples with offsets applied
+        """
+        if len(batch.curve_keys) > self.ring.max_channels:
+            self.last_curve_keys = batch.curve_keys
+            self.last_statuses = batch.row_statuses(len(batch) - 1)
+            self.rx_messages.put_nowait(
+                [batch.message(row) for row in range(len(batch))]
+            )
+            return
+
+        self.ring.write(batch.timestamps, batch.values)
+
+        # Only messages that change what the GUI shows besides the trends need
+        # to be pickled through the queue
+        changed = np.zeros(len(batch), dtype=bool)
+        if len(batch.status_keys) > 0:
+            changed[1:] = np.any(batch.statuses[1:] != batch.statuses[:-1], axis=1)
+        changed[0] = (
+            batch.curve_keys != self.last_curve_keys
+            or batch.row_statuses(0) != self.last_statuses
+        )
+        rows = np.flatnonzero(changed).tolist()
+        if len(rows) > 0:
+            self.last_curve_keys = batch.curve_keys
+            self.last_statuses = batch.row_statuses(rows[-1])
+            self.rx_messages.put_nowait([batch.message(row) for row in rows])
+
+    def _update_rx_rate(self):
+        """Refresh the published RX rate at most twice a second"""
+        now = time.perf_counter_ns()
+        if now - self.last_rx_time < 500_000_000:
+            return
+        n_rx = self.counters["rx_messages"]
+        self.counters["rx_hz"] = (n_rx - self.last_rx_n) / (
+            (now - self.last_rx_time) / 1e9
+        )
+        self.last_rx_time = now
+        self.last_rx_n = n_rx
 
     def get_n_total_messages_read(self):
-        return len(self.all_messages)
+        return int(self.counters["rx_messages"])
 
     def get_hz_rx_messages(self):
-        try:
-            messsage_1: RXMessage
-            messsage_1 = self.all_messages[-2]
-            messsage_2: RXMessage
-            messsage_2 = self.all_messages[-1]
-            delta = messsage_2.dut_offset - messsage_1.dut_offset
-            return 1 / delta.total_seconds()
-        except IndexError:
-            return 0
+        return self.counters["rx_hz"]
+
+    def get_n_corrupt_frames(self):
+        """Binary frames, or text lines after the first message, that were dropped"""
+        return int(self.counters["rx_corrupt_frames"])
+
+    def get_counters(self) -> dict:
+        """Every counter of the serial process, by name"""
+        return self.counters.as_dict()
 
     def start(self):
+        self.parent_pid = os.getpid()
         self.log_enabled = self.config["log_enabled"]
         self.log_instance_name = self.config["log_name"]
 
+        queue_settings = self.config.get("queues")
+        self.rx_messages = BoundedQueue.from_settings(
+            "rx_messages", queue_settings, multiprocess=True
+        )
+        self.tx_messages = BoundedQueue.from_settings(
+            "tx_messages", queue_settings, multiprocess=True
+        )
+        self.tx_sent = BoundedQueue.from_settings(
+            "tx_sent", queue_settings, multiprocess=True
+        )
+        self.ring.reset()
+        self.counters.reset()
+        self.stop_event.clear()
         self.process = multiprocessing.Process(target=self.handler)
         self.process.start()
 
-    def end(self):
-        self.process.terminate()
-        self.process.join()
-        self.logging_thread_enabled = False
-        self.first_message = None
-
-        try:
-            self.ser.close()
-        except:
-            pass
+    def end(self, timeout=10):
+        # Let the serial process log what it still holds and close the port itself,
+        # which includes compressing the last log segment if that is enabled
+        self.stop_event.set()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logging.error("Serial process did not stop in time, terminating it")
+            self.process.terminate()
+            self.process.join()
         logging.debug("Serial port safely closed")
-        if self.log_enabled:
-            self._log(data=self.all_messages)
-            logging.debug("Logged remaining data")
-        self.all_messages[:] = []
+
+    def close(self):
+        """Free the shared ring buffer. The instance can't be started again after"""
+        self.ring.unlink()
 
     def handler(self):
         logging.basicConfig(
             format="Serial Thread: %(message)s",
             level=logging.DEBUG,
         )
+        # Ctrl-C and a closed SSH session signal the whole process group, the
+        # parent then sets stop_event so the log is closed properly
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
         # Needed variables from self.config:
         self.port = self.config["port"]
         self.port: SerialPort
         self.baud = self.config["baud"]
         self.latch_timeout = self.config["latch_timeout"]
+        # Seconds between flushing (and fsyncing) the log file
+        self.log_flush_interval = self.config.get("log_flush_interval", 1)
+        # 0 reads everything in in_waiting at once, otherwise at most this many bytes
+        self.rx_chunk_size = self.config.get("rx_chunk_size", 0)
+        # Map device time zero onto the host clock instead of the first message
+        self.align_clock = self.config.get("align_clock", False)
+        # Seconds added to every dut_offset, e.g. a known adapter latency
+        self.clock_offset = self.config.get("clock_offset", 0)
+        self.rx_partial = b""
+        # "text" for "m<ts>::name:val,..." lines, "binary" for SLIP framed structs
+        # laid out as described by config["wire_schema"], see WireSchema
+        self.frame_decoder = None
+        self.line_parser = BatchLineParser()
+        if self.config.get("wire_format", "text") == "binary":
+            self.frame_decoder = FrameDecoder(
+                WireSchema.from_dict(self.config["wire_schema"])
+            )
+        self.last_curve_keys = None
+        self.last_statuses = None
 
         logging.info("Connecting to: " + str(self.port.port))
-        self.ser = serial.Serial(str(self.port.port), self.baud)
+        # Upper bound on how long a blocking read waits for the first byte
+        self.rx_timeout = self.config.get("rx_timeout", 0.1)
+        self.ser = serial.Serial(
+            str(self.port.port), self.baud, timeout=self.rx_timeout
+        )
         self.cur_start_time = str(time.time())
         logging.info("Connected successfully")
 
-        self._log(
-            header={
-                "port": str(self.port.port),
-                "desc": str(self.port.desc),
-                "hwid": str(self.port.hwid),
-                "baud": str(self.baud),
-                "local_t_connect": self.cur_start_time,
-            }
-        )
-
-        logging.debug("Finished initial log")
+        if self.log_enabled:
+            self.log_writer = open_log_writer(
+                # "log_path" is a path without extension, used as is
+                self.config.get("log_path") or "logging/" + self.log_instance_name,
+                self.config.get("log_format", "jsonl"),
+                self.config.get("log_segment_bytes"),
+                self.config.get("log_segment_seconds"),
+                self.config.get("log_compression"),
+                self.config.get("log_value_dtype", "f8"),
+            )
+            self.log_writer.write_header(
+                {
+                    "port": str(self.port.port),
+                    "desc": str(self.port.desc),
+                    "hwid": str(self.port.hwid),
+                    "baud": str(self.baud),
+                    "local_t_connect": self.cur_start_time,
+                    "label": self.config.get("label"),
+                    "align_clock": self.align_clock,
+                    "wire_format": self.config.get("wire_format", "text"),
+                }
+            )
+            logging.debug("Finished initial log")
 
         self.latch_attempts = 0
         self.first_message = None
         self.logging_thread_enabled = True
+        self.last_rx_time = time.perf_counter_ns()
+        self.last_rx_n = 0
 
         log_thread = threading.Thread(
             target=self._log_helper,
             args=(),
+            daemon=True,
         )
         if self.log_enabled:
             log_thread.start()
 
+        self.tx_lock = threading.Lock()
+        self.script_stop = threading.Event()
+        self.script_thread = None
+        tx_thread = threading.Thread(target=self._handle_tx, daemon=True)
+        tx_thread.start()
+
         logging.debug("Beginning main loop")
         self.ser.flush()
+        while not self.stop_event.is_set():
+            self._handle_rx(self.latch_timeout)
+            self._update_rx_rate()
+            if os.getppid() != self.parent_pid:
+                logging.error("Parent process is gone, stopping")
+                break
+
+        self.logging_thread_enabled = False
+        self.script_stop.set()
+        # A write in progress finishes before the port closes
+        with self.tx_lock:
+            self.ser.close()
+        if self.log_writer != None:
+            self.log_writer.close()
+            logging.debug("Logged remaining data")
+
+
+class CaptureMonitor:
+    """Per-channel rates, values and statuses of a running capture
+
+    Reads the capture's ring buffer and status messages from the parent
+    process, for a live view that doesn't need Qt.
+    """
+
+    def __init__(self, capture: SerialClass) -> None:
+        self.capture = capture
+        self.curve_keys = []
+        self.statuses = {}
+        self.cursor = 0
+        self.last_poll = time.perf_counter()
+        self.rates = np.zeros(0)
+        self.last_values = np.zeros(0)
+
+    def poll(self):
+        """Take in everything the capture produced since the last poll"""
         while True:
-            self._handle_tx()
-            if self.ser.in_waiting > 0:
-                self._handle_rx(self.latch_timeout)
+            try:
+                batch = self.capture.rx_messages.get_nowait()
+            except queue.Empty:
+                break
+            for message in batch:
+                if len(message.datas) > 0:
+                    self.curve_keys = message.as_curve_keys()
+                self.statuses.update(message.get_statuses())
+        # Sent messages are in the log already, the view has no use for them
+        while not self.capture.tx_sent.empty():
+            try:
+                self.capture.tx_sent.get_nowait()
+            except queue.Empty:
+                break
+
+        timestamps, values, self.cursor, n_overwritten = self.capture.ring.read(
+            self.cursor
+        )
+        now = time.perf_counter()
+        dt = now - self.last_poll
+        self.last_poll = now
+        n_channels = len(self.curve_keys)
+        if len(self.last_values) != n_channels:
+            self.last_values = np.full(n_channels, np.nan)
+        values = values[:, :n_channels]
+        written = ~np.isnan(values)
+        self.rates = np.zeros(n_channels)
+        self.rates[: values.shape[1]] = written.sum(axis=0) / dt
+        for i in np.flatnonzero(written.any(axis=0)):
+            self.last_values[i] = values[written[:, i], i][-1]
+
+    def table(self) -> Table:
+        counters = self.capture.get_counters()
+        table = Table(
+            title=str(self.capture.config["port"]),
+            caption=f"{int(counters['rx_messages'])} samples @ "
+            f"{counters['rx_hz']:.1f} Hz, {int(counters['rx_bytes'])} bytes, "
+            f"{int(counters['rx_corrupt_frames'])} corrupt, "
+            f"{int(counters['tx_messages'])} sent",
+        )
+        table.add_column("Channel")
+        table.add_column("Rate (Hz)", justify="right")
+        table.add_column("Last value", justify="right")
+        for key, rate, value in zip(self.curve_keys, self.rates, self.last_values):
+            table.add_row(key, f"{rate:.1f}", f"{value:.6g}")
+        for key, value in self.statuses.items():
+            colour = {"true": "green", "false": "red"}.get(value.lower(), "white")
+            table.add_row(key, "", f"[{colour}]{value}[/{colour}]")
+        return table
+
+
+def _choose_port(port_name: str) -> SerialPort:
+    """The listed port called port_name, or one that isn't listed, e.g. a pty"""
+    for port in list_ports():
+        if port.port == port_name:
+            return port
+    return SerialPort(port_name, "", "")
+
+
+def main(argv=None):
+    """Capture one port from the command line, without Qt
+
+    Stops on Ctrl-C, SIGTERM, SIGHUP or after --duration seconds, always
+    closing the capture log properly.
+    """
+    parser = argparse.ArgumentParser(description="Capture a serial port headless")
+    parser.add_argument("--port", help="e.g. /dev/ttyUSB0 or COM3, asks if not set")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument(
+        "--out",
+        help="capture log path, a .jsonl or .spcap extension picks the format. "
+        "Defaults to logging/<date>",
+    )
+    parser.add_argument("--format", choices=LOG_FORMATS, default="jsonl")
+    parser.add_argument("--no-log", action="store_true", help="only monitor")
+    parser.add_argument("--segment-bytes", type=int)
+    parser.add_argument("--segment-seconds", type=float)
+    parser.add_argument("--compression")
+    parser.add_argument(
+        "--value-dtype",
+        choices=["f4", "f8"],
+        default="f8",
+        help="value type of .spcap captures, f4 halves them",
+    )
+    parser.add_argument("--wire-format", choices=["text", "binary"], default="text")
+    parser.add_argument("--wire-schema", help="WireSchema JSON, or a file holding it")
+    parser.add_argument("--align-clock", action="store_true")
+    parser.add_argument(
+        "--duration", type=float, help="seconds, until stopped if unset"
+    )
+    parser.add_argument("--script", help="TX script to play once connected")
+    parser.add_argument(
+        "--line-ending", choices=["None", "LF", "CR", "CRLF"], default="LF"
+    )
+    parser.add_argument("--quiet", action="store_true", help="no live table")
+    parser.add_argument("--list", action="store_true", help="list ports and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for port in list_ports():
+            print(repr(port))
+        return 0
+
+    if args.port == None:
+        from pick import pick
+
+        ports = list_ports()
+        option, index = pick(ports, "Available Serial Ports")
+        port = ports[index]
+    else:
+        port = _choose_port(args.port)
+
+    log_format = args.format
+    log_path = args.out
+    if log_path != None:
+        for extension, extension_format in [
+            (".jsonl", "jsonl"),
+            (".spcap", "columnar"),
+        ]:
+            if log_path.endswith(extension):
+                log_path = log_path[: -len(extension)]
+                log_format = extension_format
+
+    script = None
+    if args.script != None:
+        # Parsed up front, a typo shouldn't cost a connection
+        script = TXScript.from_file(args.script, args.line_ending)
+
+    wire_schema = None
+    if args.wire_schema != None:
+        if os.path.exists(args.wire_schema):
+            with open(args.wire_schema) as file:
+                wire_schema = json.load(file)
+        else:
+            wire_schema = json.loads(args.wire_schema)
+
+    # Set before the serial process starts so it logs the same way, above
+    # the live table instead of through it
+    logging.basicConfig(
+        format="%(message)s",
+        level=logging.INFO,
+        handlers=[RichHandler(console=console, show_path=False)],
+    )
+    capture = SerialClass(65536, verbose=False)
+    capture.config.update(
+        {
+            "log_name": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+            "log_path": log_path,
+            "log_enabled": not args.no_log,
+            "log_format": log_format,
+            "log_segment_bytes": args.segment_bytes,
+            "log_segment_seconds": args.segment_seconds,
+            "log_compression": args.compression,
+            "log_value_dtype": args.value_dtype,
+            "wire_format": args.wire_format,
+            "wire_schema": wire_schema,
+            "align_clock": args.align_clock,
+            "port": port,
+            "baud": args.baud,
+            "latch_timeout": 50,
+        }
+    )
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, request_stop)
+
+    capture.start()
+    if script != None:
+        capture.tx_messages.put(script)
+    monitor = CaptureMonitor(capture)
+    deadline = None if args.duration == None else time.monotonic() + args.duration
+    show_table = not args.quiet and console.is_terminal
+    live = Live(monitor.table(), console=console, refresh_per_second=4)
+    if show_table:
+        live.start()
+    try:
+        while not stop.is_set() and capture.process.is_alive():
+            if deadline != None and time.monotonic() >= deadline:
+                break
+            stop.wait(0.25)
+            monitor.poll()
+            if show_table:
+                live.update(monitor.table())
+    finally:
+        if show_table:
+            live.stop()
+        failed = not capture.process.is_alive()
+        capture.end()
+        capture.close()
+
+    counters = capture.get_counters()
+    console.print(
+        f"Captured {int(counters['rx_messages'])} samples, "
+        f"{int(counters['rx_bytes'])} bytes, "
+        f"{int(counters['rx_corrupt_frames'])} corrupt"
+    )
+    if failed:
+        console.print("[red]Capture stopped on its own, see the log above[/red]")
+        return 1
+    return 0
 
 
 if __name__ == "__main__":
-    s = SerialClass(5000, verbose=True)
-    print("______________________________________")
-    option, index = pick(["Enable Log", "Disable Log"], "Logging?")
-    enable_logging = index == 0
-
-    ports = s.get_ports()
-    option, index = pick(ports, "Available Serial Ports")
-    chosen_port = ports[index]
-
-    manager = multiprocessing.Manager()
-    current_time = datetime.now()
-    current_time = datetime.now()
-    s.config["log_name"] = current_time.strftime("%Y-%m-%d_%H-%M-%S")
-    s.config["on"] = True
-    s.config["log_enabled"] = enable_logging
-    s.config["port"] = chosen_port
-    s.config["baud"] = 115200
-    s.config["latch_timeout"] = 50
-
-    table = Table()
-    table.add_column("Column 1")
-    table.add_column("Column 2")
-    table.add_row("Row 1 Data 1", "Row 1 Data 2")
-    table.add_row("Row 2 Data 1", "Row 2 Data 2")
-    # Start the process
-
-    s.start()
-
-    input()
-    s.end()
+    raise SystemExit(main())
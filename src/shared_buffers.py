@@ -0,0 +1,199 @@
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedRingBuffer:
+    """Fixed-size ring of numeric samples in shared memory
+
+    One process (the serial process) writes rows and any number of readers copy
+    them out by index, so samples cross the process boundary without pickling.
+    The shared block is laid out as:
+
+        header      int64[2]                       rows ever written, channels in use
+        timestamps  int64[capacity]                nanoseconds since the epoch
+        values      float64[capacity, max_channels]
+
+    Rows are written before the row counter is bumped, so every row below the
+    counter is complete. A reader that falls more than capacity rows behind loses
+    the oldest rows and is told how many were overwritten.
+    """
+
+    HEADER_SIZE = 2
+
+    def __init__(self, capacity=65536, max_channels=16, name=None) -> None:
+        self.capacity = capacity
+        self.max_channels = max_channels
+        self.warned_channels = False
+
+        size = 8 * (self.HEADER_SIZE + capacity + capacity * max_channels)
+        if name == None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._map_arrays()
+
+        if name == None:
+            self.reset()
+
+    def _map_arrays(self):
+        buffer = self.shm.buf
+        self.header = np.ndarray((self.HEADER_SIZE,), dtype=np.int64, buffer=buffer)
+        self.timestamps = np.ndarray(
+            (self.capacity,),
+            dtype=np.int64,
+            buffer=buffer,
+            offset=8 * self.HEADER_SIZE,
+        )
+        self.values = np.ndarray(
+            (self.capacity, self.max_channels),
+            dtype=np.float64,
+            buffer=buffer,
+            offset=8 * (self.HEADER_SIZE + self.capacity),
+        )
+
+    def __getstate__(self):
+        # Only the name travels to a spawned process, which re-attaches to the block
+        return {
+            "capacity": self.capacity,
+            "max_channels": self.max_channels,
+            "name": self.shm.name,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["capacity"], state["max_channels"], name=state["name"])
+
+    def reset(self):
+        """Forget every row written so far. Only call while no process is writing"""
+        self.header[:] = 0
+
+    def n_written(self) -> int:
+        """Total number of rows written since the last reset"""
+        return int(self.header[0])
+
+    def n_channels(self) -> int:
+        """Number of value columns in use by the writer"""
+        return int(self.header[1])
+
+    def write(self, timestamps: np.ndarray, values: np.ndarray):
+        """Append rows to the ring, overwriting the oldest rows once it is full
+
+        Args:
+            timestamps (np.ndarray): int64 nanosecond timestamps, shape (n,)
+            values (np.ndarray): float64 channel values, shape (n, n_channels)
+        """
+        n_rows = len(timestamps)
+        if n_rows == 0:
+            return
+
+        n_channels = values.shape[1]
+        if n_channels > self.max_channels:
+            if not self.warned_channels:
+                logging.warning(
+                    "Ring buffer holds %d channels, dropping the last %d",
+                    self.max_channels,
+                    n_channels - self.max_channels,
+                )
+                self.warned_channels = True
+            values = values[:, : self.max_channels]
+            n_channels = self.max_channels
+
+        head = int(self.header[0])
+        if n_rows > self.capacity:
+            # Only the newest rows fit, but they still count as written
+            timestamps = timestamps[-self.capacity :]
+            values = values[-self.capacity :]
+            head += n_rows - self.capacity
+            n_rows = self.capacity
+
+        start = head % self.capacity
+        first = min(n_rows, self.capacity - start)
+        self.timestamps[start : start + first] = timestamps[:first]
+        self.values[start : start + first, :n_channels] = values[:first]
+        self.values[start : start + first, n_channels:] = np.nan
+        if first < n_rows:
+            rest = n_rows - first
+            self.timestamps[:rest] = timestamps[first:]
+            self.values[:rest, :n_channels] = values[first:]
+            self.values[:rest, n_channels:] = np.nan
+
+        self.header[1] = max(n_channels, int(self.header[1]))
+        # Publish the rows only once they are fully written
+        self.header[0] = head + n_rows
+
+    def read(self, cursor: int):
+        """Copy out every row written since cursor
+
+        Args:
+            cursor (int): Row count returned by the previous read, 0 to start
+
+        Returns:
+            tuple: (timestamps, values, new cursor, number of rows overwritten
+                before they could be read)
+        """
+        head = int(self.header[0])
+        n_overwritten = 0
+        if head < cursor:
+            # The ring was reset under us, start over
+            cursor = 0
+        if head - cursor > self.capacity:
+            n_overwritten = head - cursor - self.capacity
+            cursor = head - self.capacity
+
+        n_channels = int(self.header[1])
+        indices = np.arange(cursor, head) % self.capacity
+        timestamps = self.timestamps[indices]
+        values = self.values[indices, :n_channels]
+
+        # The writer may have lapped the oldest rows while they were being copied
+        n_lapped = int(self.header[0]) - self.capacity - cursor
+        if n_lapped > 0:
+            n_lapped = min(n_lapped, len(timestamps))
+            timestamps = timestamps[n_lapped:]
+            values = values[n_lapped:]
+            n_overwritten += n_lapped
+
+        return timestamps, values, head, n_overwritten
+
+    def close(self):
+        """Detach this process from the shared block"""
+        # The numpy views hold exported buffers that must go before the block closes
+        del self.header, self.timestamps, self.values
+        self.shm.close()
+
+    def unlink(self):
+        """Detach and free the shared block. Call once, from the creating process"""
+        self.close()
+        self.shm.unlink()
+
+
+class SharedCounters:
+    """Named float64 counters in shared memory
+
+    Meant for one writing process and any number of readers. Reads and writes
+    are single aligned 8-byte accesses, so no lock is taken on either side.
+    """
+
+    def __init__(self, names) -> None:
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.array = multiprocessing.RawArray("d", len(self.names))
+
+    def __getitem__(self, name: str) -> float:
+        return self.array[self.index[name]]
+
+    def __setitem__(self, name: str, value: float):
+        self.array[self.index[name]] = value
+
+    def add(self, name: str, amount: float = 1):
+        """Increment a counter. Only safe from the single writing process"""
+        self.array[self.index[name]] += amount
+
+    def reset(self):
+        for i in range(len(self.names)):
+            self.array[i] = 0
+
+    def as_dict(self) -> dict:
+        return {name: self.array[i] for i, name in enumerate(self.names)}
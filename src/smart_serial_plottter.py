@@ -20,6 +20,7 @@ from PyQt5.QtWidgets import (
     QLineEdit,
     QComboBox,
     QPushButton,
+    QFileDialog,
 )
 from PyQt5.QtGui import QFont
 import os
@@ -37,11 +38,23 @@ if __name__ == "__main__":
     from custom_analysis import *
     from serial_class import *
     from plotting_subclass import *
+    from log_replay import LogReplay, REPLAY_SPEEDS
+    from multi_port import MultiPortCapture
+    from metrics import MetricsRegistry, StageTimes, timed_stage
+    from bounded_queue import BoundedQueue
+    from tx_scheduler import TXScript
+    from diagnostics_panel import DiagnosticsPanel
 
 else:
     from src.custom_analysis import *
     from src.serial_class import *
     from src.plotting_subclass import *
+    from src.log_replay import LogReplay, REPLAY_SPEEDS
+    from src.multi_port import MultiPortCapture
+    from src.metrics import MetricsRegistry, StageTimes, timed_stage
+    from src.bounded_queue import BoundedQueue
+    from src.tx_scheduler import TXScript
+    from src.diagnostics_panel import DiagnosticsPanel
 
 
 class CustomLineEdit(QLineEdit):
@@ -164,10 +177,30 @@ class SmartSerialPloter(QMainWindow):
         q1_layout.addWidget(self.log_to_file_checkbox)
         # q1_layout.addWidget(self.q1_plot_ss_button)
 
+        q1_replay_layout = QHBoxLayout()
+        self.replay_button = QPushButton("Replay Log")
+        self.replay_button.released.connect(self.replay_handler)
+        self.replay_speed = QComboBox()
+        self.replay_speed.addItems(list(REPLAY_SPEEDS.keys()))
+        self.replay_speed.currentTextChanged.connect(self.replay_speed_changed)
+        # Seconds into the capture to continue the replay from
+        self.replay_seek = CustomLineEdit(regex_pattern="[0-9]*\\.?[0-9]*", parent=self)
+        self.replay_seek.setPlaceholderText("Seek (s)")
+        self.replay_seek.returnPressed.connect(self.replay_seek_handler)
+        self.replay_seek.setEnabled(False)
+        q1_replay_layout.addWidget(self.replay_button)
+        q1_replay_layout.addWidget(self.replay_speed)
+        q1_replay_layout.addWidget(self.replay_seek)
+        q1_layout.addLayout(q1_replay_layout)
+
+        self.diagnostics_button = QPushButton("Diagnostics")
+        self.diagnostics_button.released.connect(self.show_diagnostics)
+        q1_layout.addWidget(self.diagnostics_button)
+
         self.clickable_items.append(self.serial_ports)
 
         q1.setMinimumWidth(150)
-        q1.setFixedHeight(180)
+        q1.setFixedHeight(250)
 
         left_v_layout.addWidget(q1, 1)
 
@@ -217,7 +250,7 @@ class SmartSerialPloter(QMainWindow):
             parent=self, regex_pattern=r"^[ -~]+$"
         )  # Changed to QLineEdit for a single line text box
         self.serial_line_ending = QComboBox()
-        self.serial_line_ending.addItems(["None", "LR", "CF", "LRCF"])
+        self.serial_line_ending.addItems(["None", "LF", "CR", "CRLF"])
         try:
             self.serial_line_ending.setCurrentIndex(
                 int(self.user_settings["line_ending"])
@@ -226,11 +259,19 @@ class SmartSerialPloter(QMainWindow):
             logging.debug("Error setting line-ending to previous")
         self.serial_line_ending.setFixedWidth(80)  # Adjust the width as needed
 
+        # Plays a TX script, see TXScript, and stops it when pressed again
+        self.script_button = QPushButton("Script")
+        self.script_button.clicked.connect(self.script_handler)
+        self.script_timer = QTimer(self)
+        self.script_timer.setSingleShot(True)
+        self.script_timer.timeout.connect(self.script_finished)
+
         self.clickable_items.append(self.q5_text_input)
 
         q5_h_layout.addWidget(self.q5_text_input)
         q5_h_layout.addWidget(self.serial_line_ending)
         q5_h_layout.addWidget(serial_send_button)
+        q5_h_layout.addWidget(self.script_button)
 
         q5_layout.addLayout(q5_h_layout)
         q5.setMinimumSize(300, 60)
@@ -250,16 +291,33 @@ class SmartSerialPloter(QMainWindow):
             []
         )  # List of items that will be unfocused after being clicked off
         self.user_settings = self._get_user_settings()
-        self.serial = SerialClass(5000, verbose=True)
+        self.serial = SerialClass(65536, verbose=True)
+        self.replay = None  # LogReplay while a capture is being replayed
+        self.replay_start = None  # Device time of the replayed capture's first sample
+        self.multi = None  # MultiPortCapture when the "ports" setting lists ports
+        self.source = self.serial  # Whichever of the two is feeding the plotter
         self.cur_ports = []  # List of current ports
         self.read_messages = None  # Messages read from serial monitor
         self.serial_process = None  # PRocess for serial handler
-        self.plot_queue = queue.Queue()
+        self.plot_queue = BoundedQueue.from_settings(
+            "plot_queue", self.user_settings.get("queues")
+        )
         self.local_list = []
         self.custom_analyses = []
         self.item_count = 0
-
-        self.plotter = LivePlotter(self.plot_queue, parent=self)
+        # Time spent in the GUI's timer callbacks, kept across plotters
+        self.stage_times = StageTimes()
+        self.metrics = MetricsRegistry()
+        self.diagnostics = None
+
+        self.plotter = LivePlotter(
+            self.plot_queue,
+            parent=self,
+            stage_times=self.stage_times,
+            max_points=self.user_settings.get("history_points", HISTORY_POINTS),
+            history_dir=self.user_settings.get("history_dir"),
+            frame_rate=self.user_settings.get("frame_rate", FRAME_RATE),
+        )
         self.statuses = {}
         self.init_layout()
 
@@ -274,6 +332,18 @@ class SmartSerialPloter(QMainWindow):
         self.data_callback_lock = False
         self.serial_timer.start(1)  # Update every second
 
+        self._register_metrics()
+        # Optional Prometheus exports, a localhost endpoint and a textfile
+        if self.user_settings.get("metrics_port") != None:
+            try:
+                self.metrics.serve(int(self.user_settings["metrics_port"]))
+            except OSError as e:
+                logging.error(f"Error serving metrics: {e}")
+        if self.user_settings.get("metrics_file") != None:
+            self.metrics_timer = QTimer(self)
+            self.metrics_timer.timeout.connect(self.write_metrics_file)
+            self.metrics_timer.start(1000)
+
         # Debug printing:
         if debug:
             self.debug_timer = QTimer(self)
@@ -289,52 +359,188 @@ class SmartSerialPloter(QMainWindow):
 
     def c_dc_handler(self):
         if self.is_on == False:  # Stopped
-            self.im_too_tired_to_correctly_name_this = True
             # Start
             self.begin_serial()
-            self.is_on = True
-
-            # Get index and size of the current plotter
-            plotter_index = self.right_v_layout.indexOf(self.plotter)
-            plotter_size = self.plotter.size()
-
-            # Remove and delete the current plotter
-            self.right_v_layout.removeWidget(self.plotter)
-            self.plotter.deleteLater()
-
-            # Create and configure the new plotter
-            self.plotter = LivePlotter(
-                self.plot_queue,
-                curve_keys=self.serial.rx_messages.get().as_curve_keys(),
-                parent=self,
-            )  # Adjust parameters as needed
-            self.plotter.resize(plotter_size)  # Set the size to match the old plotter
-            self.plotter.setSizePolicy(
-                self.plotter.sizePolicy()
-            )  # Maintain size policy if needed
-
-            # Insert the new plotter
-            self.right_v_layout.insertWidget(plotter_index, self.plotter)
-            # while self.serial.rx_messages.empty:
-            #     pass
-            # self.plotter.toggle_start_stop()
+            if self.multi != None:
+                try:
+                    first_batch = self.multi.rx_messages.get_nowait()
+                except queue.Empty:
+                    logging.error("None of the ports sent a message")
+                    self.end_serial()
+                    return
+                self.source = self.multi
+                self.start_source(first_batch, self.multi.curve_keys)
+            else:
+                self.source = self.serial
+                self.start_source(self.serial.rx_messages.get())
             self.q1_c_dc_button.setText("Disconnect")
+            self.replay_button.setEnabled(False)
 
         else:  # Started
-            self.is_on = False
-            self.statuses = {}
-            self.update_statuses_analyses()
+            self.stop_source()
             self.end_serial()
             self.q1_c_dc_button.setText("Connect")
-            self.friendly_name.setText("")
-            self.item_count = 0
-            if self.plotter.is_live:
-                self.plotter.toggle_start_stop()
-
-            self.analysis_text_edit.setText("")  # Append new text here
+            self.replay_button.setEnabled(True)
 
         # Stop
 
+    def replay_handler(self):
+        if self.is_on:  # Replaying
+            self.stop_source()
+            self.replay.end()
+            self.replay = None
+            self.source = self.serial
+            self.replay_button.setText("Replay Log")
+            self.replay_seek.setEnabled(False)
+            self.q1_c_dc_button.setEnabled(True)
+            return
+
+        path, _ = QFileDialog.getOpenFileName(
+            self,
+            "Open capture",
+            "logging",
+            "Captures (*.jsonl *.spcap *.manifest.json)",
+        )
+        if path == "":
+            return
+        self.start_replay(path)
+
+    def start_replay(self, path: str, t_start: float = None):
+        """Replay a capture on a fresh plotter
+
+        Args:
+            path (str): Capture file
+            t_start (float, optional): Device time to start from, in seconds
+                since the epoch. Defaults to the start of the capture.
+        """
+        try:
+            self.replay = LogReplay(
+                path, speed=REPLAY_SPEEDS[self.replay_speed.currentText()]
+            )
+        except (OSError, ValueError) as e:
+            logging.error(f"Error opening capture: {e}")
+            return
+
+        if t_start != None:
+            # Taken up before the first sample is read
+            self.replay.seek(t_start)
+        self.replay.start()
+        try:
+            first_batch = self.replay.rx_messages.get(timeout=5)
+        except queue.Empty:
+            logging.error("Capture has no samples to replay")
+            self.replay.end()
+            self.replay = None
+            self.source = self.serial
+            self.replay_button.setText("Replay Log")
+            self.replay_seek.setEnabled(False)
+            self.q1_c_dc_button.setEnabled(True)
+            return
+
+        if t_start == None:
+            self.replay_start = first_batch[0].timestamp_ns / 1e9
+        self.source = self.replay
+        self.start_source(first_batch)
+        self.replay_button.setText("Stop Replay")
+        self.replay_seek.setEnabled(True)
+        self.q1_c_dc_button.setEnabled(False)
+
+    def replay_seek_handler(self):
+        """Continue the replay from the seconds typed into the seek field
+
+        The plot and its history only take samples in time order, so a seek
+        replays from there on a fresh plotter instead of calling
+        LogReplay.seek on the running replay.
+        """
+        if self.replay == None:
+            return
+        try:
+            seconds = float(self.replay_seek.text())
+        except ValueError:
+            return
+        path = self.replay.path
+        self.stop_source()
+        self.replay.end()
+        self.start_replay(path, self.replay_start + seconds)
+
+    def replay_speed_changed(self, text):
+        if self.replay != None:
+            self.replay.set_speed(REPLAY_SPEEDS[text])
+
+    def start_source(self, first_batch: List[RXMessage], curve_keys=None):
+        """Swap in a fresh plotter for the data source that just started
+
+        Args:
+            first_batch (list(RXMessage)): First messages from the source
+            curve_keys (list(str), optional): Curves to plot. Defaults to the
+                curve keys of the first message.
+        """
+        if curve_keys == None:
+            curve_keys = first_batch[0].as_curve_keys()
+        self.is_on = True
+
+        # Get index and size of the current plotter
+        plotter_index = self.right_v_layout.indexOf(self.plotter)
+        plotter_size = self.plotter.size()
+
+        # Remove and delete the current plotter
+        self.right_v_layout.removeWidget(self.plotter)
+        self.plotter.close_history()
+        self.plotter.deleteLater()
+        # Nothing queued for the old source belongs on the new plot
+        self.plot_queue = BoundedQueue.from_settings(
+            "plot_queue", self.user_settings.get("queues")
+        )
+
+        # Create and configure the new plotter. The ports of a multi-port
+        # capture take turns in the live window
+        n_sources = len(self.multi.labels) if self.source is self.multi else 1
+        self.plotter = LivePlotter(
+            self.plot_queue,
+            curve_keys=curve_keys,
+            parent=self,
+            ring=self.source.ring,
+            stage_times=self.stage_times,
+            max_points=self.user_settings.get("history_points", HISTORY_POINTS),
+            history_dir=self.user_settings.get("history_dir"),
+            frame_rate=self.user_settings.get("frame_rate", FRAME_RATE),
+            live_points=LIVE_POINTS * n_sources,
+        )  # Adjust parameters as needed
+        self.plotter.resize(plotter_size)  # Set the size to match the old plotter
+        self.plotter.setSizePolicy(
+            self.plotter.sizePolicy()
+        )  # Maintain size policy if needed
+
+        # Insert the new plotter
+        self.right_v_layout.insertWidget(plotter_index, self.plotter)
+        # Live right away, with a ring buffer rx_messages may not get another
+        # batch until the statuses change
+        self.plotter.toggle_start_stop()
+
+        for message in first_batch:
+            if not self.plotted_from_ring(message):
+                self.plot_queue.put_nowait(message)
+            self.statuses.update(message.get_statuses())
+
+    def plotted_from_ring(self, message: RXMessage) -> bool:
+        """True if the message's samples reach the plotter through the ring buffer
+
+        Rows wider than the ring come through rx_messages whole instead.
+        """
+        ring = self.source.ring
+        return ring != None and len(message.datas) <= ring.max_channels
+
+    def stop_source(self):
+        self.is_on = False
+        self.statuses = {}
+        self.update_statuses_analyses()
+        self.friendly_name.setText("")
+        self.item_count = 0
+        if self.plotter.is_live:
+            self.plotter.toggle_start_stop()
+
+        self.analysis_text_edit.setText("")  # Append new text here
+
     def add_customAnalysis(self, obj: CustomAnalysis):
         self.custom_analyses.append(obj)
 
@@ -348,21 +554,38 @@ class SmartSerialPloter(QMainWindow):
         #         "Q size from serial class " + str(self.serial.rx_messages.qsize())
         #     )
 
+    @timed_stage("serial_callback")
     def serial_callback(self):
         """ """
         if self.is_on:
             start_time = time.perf_counter_ns()
             recieved_messages = 0
-            while not self.serial.rx_messages.empty():
-                if self.im_too_tired_to_correctly_name_this:
-                    self.plotter.toggle_start_stop()
-                self.im_too_tired_to_correctly_name_this = False
-                message: RXMessage
-                message = self.serial.rx_messages.get()
-                # message.apply_offset(self.serial.config["t_first_message"])
-                self.plot_queue.put_nowait(message)
-                self.statuses.update(message.get_statuses())
-                recieved_messages += 1
+            # With the block policy a full plot queue leaves the messages in
+            # rx_messages, whose own policy then applies to the producer
+            while not (
+                self.source.rx_messages.empty() or self.plot_queue.would_block()
+            ):
+                batch: List[RXMessage]
+                batch = self.source.rx_messages.get()
+                # With a ring buffer the samples reach the plotter through shared
+                # memory and the queue only carries messages whose statuses
+                # changed, unless they are too wide for the ring
+                for message in batch:
+                    # message.apply_offset(self.serial.config["t_first_message"])
+                    if not self.plotted_from_ring(message):
+                        self.plot_queue.put_nowait(message)
+                    self.statuses.update(message.get_statuses())
+                recieved_messages += len(batch)
+
+            if self.source.tx_sent != None:
+                sent = []
+                while not self.source.tx_sent.empty():
+                    try:
+                        sent.append(self.source.tx_sent.get_nowait())
+                    except queue.Empty:
+                        break
+                if len(sent) > 0:
+                    self.plotter.add_tx_markers(sent)
 
             # logging.debug(
             #     "Read %d messages in %f uS",
@@ -370,6 +593,13 @@ class SmartSerialPloter(QMainWindow):
             #     (time.perf_counter_ns() - start_time) / 1000,
             # )
 
+    def write_metrics_file(self):
+        try:
+            self.metrics.write_prometheus_file(self.user_settings["metrics_file"])
+        except OSError as e:
+            logging.error(f"Error writing metrics: {e}")
+            self.metrics_timer.stop()
+
     def ui_callback(self):
         self.update_statuses_analyses()
         self.update_plot_info()
@@ -411,23 +641,58 @@ class SmartSerialPloter(QMainWindow):
 
             self.q3_label.setText(
                 "total samples: "
-                + self._safe_num_as_str(self.serial.get_n_total_messages_read(), 6)
+                + self._safe_num_as_str(self.source.get_n_total_messages_read(), 6)
                 + " @ "
-                + self._safe_num_as_str(self.serial.get_hz_rx_messages(), 6)
+                + self._safe_num_as_str(self.source.get_hz_rx_messages(), 6)
                 + " hz   n displayed: "
                 + self._safe_num_as_str(self.plotter.get_total_points(), 6)  # TODO:
+                + " overwritten: "
+                + self._safe_num_as_str(self.plotter.n_overwritten, 6)
+                + " dropped: "
+                + self._safe_num_as_str(self._n_queue_drops(), 6)
             )
             # self.plotter.refresh_plot()
 
     # ---------------------- Serial Handling ----------------------
     def serial_send(self):
-        self.serial.tx_messages.put(
+        # A multi-port capture sends to every port
+        capture = self.serial if self.multi == None else self.multi
+        capture.tx_messages.put(
             TXMessage(
                 message=self.q5_text_input.text(),
                 line_ending=str(self.serial_line_ending.currentText()),
             )
         )
 
+    def script_handler(self):
+        capture = self.serial if self.multi == None else self.multi
+        if self.script_timer.isActive():
+            # An empty script stops the one playing
+            capture.tx_messages.put(TXScript([]))
+            self.script_timer.stop()
+            self.script_finished()
+            return
+        if not self.is_on or self.replay != None:
+            logging.error("Connect to a port before playing a TX script")
+            return
+
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Open TX script", "", "TX scripts (*.txt *.tx);;All files (*)"
+        )
+        if path == "":
+            return
+        try:
+            script = TXScript.from_file(path, self.serial_line_ending.currentText())
+        except (OSError, ValueError) as e:
+            logging.error(f"Error opening TX script: {e}")
+            return
+        capture.tx_messages.put(script)
+        self.script_button.setText("Stop Script")
+        self.script_timer.start(int(script.duration() * 1000) + 100)
+
+    def script_finished(self):
+        self.script_button.setText("Script")
+
     def get_serial_ports(self):
         self.cur_ports = self.serial.get_ports()
         logging.debug("Current serial ports: " + str(self.cur_ports))
@@ -450,6 +715,28 @@ class SmartSerialPloter(QMainWindow):
         self.serial.config["log_name"] = current_time.strftime("%Y-%m-%d_%H-%M-%S")
         self.serial.config["on"] = True
         self.serial.config["log_enabled"] = enable_logging
+        self.serial.config["log_format"] = self.user_settings.get("log_format", "jsonl")
+        # Rotation and compression of long captures, off unless set in the settings
+        self.serial.config["log_segment_bytes"] = self.user_settings.get(
+            "log_segment_bytes"
+        )
+        self.serial.config["log_segment_seconds"] = self.user_settings.get(
+            "log_segment_seconds"
+        )
+        self.serial.config["log_compression"] = self.user_settings.get(
+            "log_compression"
+        )
+        # float32 values make columnar captures half the size
+        self.serial.config["log_value_dtype"] = self.user_settings.get(
+            "log_value_dtype", "f8"
+        )
+        # Binary framed devices describe their frames with a WireSchema dict
+        self.serial.config["wire_format"] = self.user_settings.get(
+            "wire_format", "text"
+        )
+        self.serial.config["wire_schema"] = self.user_settings.get("wire_schema")
+        # Bounds and drop policies of the inter-stage queues, see BoundedQueue
+        self.serial.config["queues"] = self.user_settings.get("queues")
         self.serial.config["port"] = chosen_port
         self.serial.config["baud"] = int(self.baud.text())
         self.serial.config["latch_timeout"] = 50
@@ -461,6 +748,19 @@ class SmartSerialPloter(QMainWindow):
         table.add_row("Row 2 Data 1", "Row 2 Data 2")
         # Start the process
 
+        multi_ports = self.user_settings.get("ports", [])
+        if len(multi_ports) > 0:
+            if self.multi != None:
+                # The old plotter stops reading before the previous rings are freed
+                self.plotter.ring = None
+                self.multi.close()
+            self.multi = MultiPortCapture(65536, verbose=True)
+            self.multi.config = dict(self.serial.config)
+            del self.multi.config["port"]
+            self.multi.config["ports"] = [p for p in ports if p.port in multi_ports]
+            self.multi.start()
+            return
+
         self.serial.start()
 
         # message: RXMessage
@@ -470,9 +770,150 @@ class SmartSerialPloter(QMainWindow):
         # self.plotter.ui_init()
 
     def end_serial(self):
-        self.serial.end()
+        if self.multi != None:
+            self.multi.end()
+        else:
+            self.serial.end()
         logging.debug("Serial thread ended")
 
+    # ---------------------- Metrics ----------------------
+    def _register_metrics(self):
+        """Register what every stage of the pipeline exposes, see MetricsRegistry"""
+        m = self.metrics
+
+        def source_counter(name):
+            return lambda: self.source.get_counters().get(name)
+
+        def stage_seconds(stage):
+            return lambda: self.stage_times.seconds.get(stage, 0)
+
+        def queue_depth(q):
+            # Not implemented for multiprocessing queues on macOS
+            return lambda: q().qsize()
+
+        m.counter(
+            "rx_bytes_total", "Bytes read from the port", source_counter("rx_bytes")
+        )
+        m.counter("rx_lines_total", "Text lines read", source_counter("rx_lines"))
+        m.counter("rx_messages_total", "Samples parsed", source_counter("rx_messages"))
+        m.counter(
+            "rx_corrupt_frames_total",
+            "Frames or lines dropped after the first message",
+            source_counter("rx_corrupt_frames"),
+        )
+        m.counter(
+            "rx_latch_failures_total",
+            "Lines that failed before the first message",
+            source_counter("rx_latch_failures"),
+        )
+        m.gauge("rx_rate_hz", "Samples per second", source_counter("rx_hz"))
+        m.counter("tx_messages_total", "Messages sent", source_counter("tx_messages"))
+        m.counter(
+            "tx_late_seconds_total",
+            "How late scripted messages were sent, added up",
+            source_counter("tx_late_seconds"),
+        )
+        m.gauge(
+            "tx_late_max_seconds",
+            "Latest a scripted message was sent",
+            source_counter("tx_late_max_seconds"),
+        )
+        m.counter(
+            "rx_parse_seconds_total",
+            "Serial process time spent parsing",
+            source_counter("rx_parse_seconds"),
+        )
+        m.counter(
+            "log_write_seconds_total",
+            "Serial process time spent formatting the capture log",
+            source_counter("log_write_seconds"),
+        )
+        m.counter(
+            "rx_publish_seconds_total",
+            "Serial process time spent writing the ring buffer and queue",
+            source_counter("rx_publish_seconds"),
+        )
+        m.gauge(
+            "log_lag_rows",
+            "Samples written to the log but not flushed to disk yet",
+            lambda: self._log_lag()[0],
+        )
+        m.gauge(
+            "log_lag_seconds",
+            "Age of the oldest sample not flushed to disk yet",
+            lambda: self._log_lag()[1],
+        )
+        m.gauge(
+            "rx_queue_depth",
+            "Message lists waiting for the GUI",
+            queue_depth(lambda: self.source.rx_messages),
+        )
+        m.gauge(
+            "plot_queue_depth",
+            "Messages waiting for the plotter",
+            queue_depth(lambda: self.plot_queue),
+        )
+        m.gauge(
+            "tx_queue_depth",
+            "Messages waiting to be sent",
+            queue_depth(lambda: self.source.tx_messages),
+        )
+        for stage in [
+            "serial_callback",
+            "process_queue",
+            "process_ring",
+            "update_plot",
+        ]:
+            m.counter(
+                stage + "_seconds_total",
+                "GUI time spent in " + stage,
+                stage_seconds(stage),
+            )
+        m.counter(
+            "rx_queue_dropped_total",
+            "Status and curve key messages the rx_messages policy dropped",
+            lambda: self.source.rx_messages.n_dropped(),
+        )
+        m.counter(
+            "plot_queue_dropped_total",
+            "Messages the plot_queue policy dropped",
+            lambda: self.plot_queue.n_dropped(),
+        )
+        m.counter(
+            "tx_queue_dropped_total",
+            "Messages to send the tx_messages policy dropped",
+            lambda: self.source.tx_messages.n_dropped(),
+        )
+        m.counter(
+            "ring_overwritten_total",
+            "Samples overwritten in the ring before the plotter read them",
+            lambda: self.plotter.n_overwritten,
+        )
+        m.gauge("plot_fps", "Plot updates per second", lambda: self.plotter.last_fps)
+
+    def _n_queue_drops(self) -> int:
+        """Messages the bounded queues dropped on their way to the plot"""
+        n_dropped = self.plot_queue.n_dropped()
+        if isinstance(self.source.rx_messages, BoundedQueue):
+            n_dropped += self.source.rx_messages.n_dropped()
+        return n_dropped
+
+    def _log_lag(self):
+        """(rows, seconds) the capture log's flushes are behind"""
+        counters = self.source.get_counters()
+        if "log_rows" not in counters:
+            return None, None
+        n_rows = counters["log_rows"] - counters["log_flushed_rows"]
+        if n_rows <= 0 or counters["log_flush_time"] == 0:
+            return n_rows, 0
+        return n_rows, time.time() - counters["log_flush_time"]
+
+    def show_diagnostics(self):
+        if self.diagnostics == None:
+            self.diagnostics = DiagnosticsPanel(self.metrics)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
+
     # ---------------------- Global UI Event Handling ----------------------
     def mousePressEvent(self, event):
         # Check if the click is outside q3_text_input
@@ -486,10 +927,21 @@ class SmartSerialPloter(QMainWindow):
             self.end_serial()
         except:
             pass
+        if self.replay != None:
+            self.replay.end()
+        # The plotter's timer may still fire once the rings below are freed
+        self.plotter.ring = None
+        if self.multi != None:
+            self.multi.close()
         time.sleep(0.1)
         self._dump_user_settings()
+        self.metrics.stop_serving()
+        self.plotter.close_history()
+        if self.diagnostics != None:
+            self.diagnostics.close()
         if self.serial_process != None:
             self.serial_process.terminate()
+        self.serial.close()
         super().closeEvent(event)
         # self.plotter.data_generator.terminate()
 
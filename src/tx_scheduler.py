@@ -0,0 +1,141 @@
+import re
+import threading
+import time
+from typing import List, Tuple
+
+from src.message_classes import TXMessage
+
+# Sleeping ends this long before a command is due, the rest is spun away, since
+# a sleep can overshoot by a scheduler tick
+SPIN_SECONDS = 0.002
+# Thread switch interval of the serial process while a script plays. Python's
+# default of 5 ms would let the RX thread hold up a due command that long
+SCRIPT_SWITCH_INTERVAL = 0.0002
+
+TIME_UNITS = {"s": 1_000_000_000, "ms": 1_000_000, "us": 1_000}
+TIME_PATTERN = re.compile(r"(\d+(?:\.\d*)?|\.\d+)(s|ms|us)?")
+
+
+def parse_duration_ns(text: str) -> int:
+    """Nanoseconds of a duration like 1.5, 1.5s, 10ms or 250us"""
+    match = TIME_PATTERN.fullmatch(text)
+    if match == None:
+        raise ValueError("Not a duration: " + text)
+    number, unit = match.groups()
+    return round(float(number) * TIME_UNITS[unit or "s"])
+
+
+class TXScript:
+    """Commands to send at set times after the script starts
+
+    A script is text with one entry per line, times in seconds unless they
+    carry an s, ms or us suffix:
+
+        # Comments and blank lines are skipped
+        0 reset                 at the start
+        +10ms arm               10 ms after the previous command
+        1.5 fire                1.5 s after the start
+        every 5ms x100 ping     100 times, 5 ms apart, the first 5 ms after
+                                the previous command
+
+    Everything after the time (and count) is the command, sent with the
+    script's line ending. Commands are kept in time order. An empty script
+    stops the one that is playing.
+    """
+
+    def __init__(self, entries: List[Tuple[int, str]], line_ending: str = "LF") -> None:
+        """
+        Args:
+            entries (list): (nanoseconds after the start, command) pairs
+            line_ending (str, optional): Appended to every command, see
+                LINE_ENDINGS. Defaults to "LF".
+        """
+        self.entries = sorted(entries, key=lambda entry: entry[0])
+        self.line_ending = line_ending
+
+    @classmethod
+    def parse(cls, text: str, line_ending: str = "LF") -> "TXScript":
+        entries = []
+        previous_ns = 0
+        for number, line in enumerate(text.splitlines(), start=1):
+            stripped = line.strip()
+            if stripped == "" or stripped.startswith("#"):
+                continue
+            words = stripped.split(None, 3)
+            try:
+                if words[0] == "every":
+                    period_ns = parse_duration_ns(words[1])
+                    if not words[2].startswith("x"):
+                        raise ValueError("Expected a count like x100: " + words[2])
+                    count = int(words[2][1:])
+                    command = words[3]
+                    for i in range(1, count + 1):
+                        entries.append((previous_ns + i * period_ns, command))
+                    previous_ns += count * period_ns
+                    continue
+                time_word, command = stripped.split(None, 1)
+                if time_word.startswith("+"):
+                    previous_ns += parse_duration_ns(time_word[1:])
+                else:
+                    previous_ns = parse_duration_ns(time_word)
+                entries.append((previous_ns, command))
+            except IndexError:
+                raise ValueError(
+                    "Line " + str(number) + " of the TX script has no command"
+                )
+            except ValueError as e:
+                raise ValueError("Line " + str(number) + " of the TX script: " + str(e))
+        return cls(entries, line_ending)
+
+    @classmethod
+    def from_file(cls, path: str, line_ending: str = "LF") -> "TXScript":
+        with open(path) as file:
+            return cls.parse(file.read(), line_ending)
+
+    def duration(self) -> float:
+        """Seconds from the start to the last command"""
+        return self.entries[-1][0] / 1e9 if len(self.entries) > 0 else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def wait_until(deadline_ns: int, stop_event: threading.Event) -> bool:
+    """Wait until time.perf_counter_ns() reaches deadline_ns
+
+    Returns:
+        bool: False if stop_event was set first
+    """
+    while True:
+        remaining = (deadline_ns - time.perf_counter_ns()) / 1e9
+        if remaining <= 0:
+            return True
+        if remaining > SPIN_SECONDS:
+            if stop_event.wait(remaining - SPIN_SECONDS):
+                return False
+        else:
+            # Lets the other threads run without giving up the CPU
+            time.sleep(0)
+
+
+def play_script(script: TXScript, send, stop_event: threading.Event) -> int:
+    """Send every command of a script at its time
+
+    Args:
+        script (TXScript): What to send
+        send (callable): Writes one TXMessage, setting its sent_ns
+        stop_event (threading.Event): Ends the script early once set
+
+    Returns:
+        int: Number of commands sent
+    """
+    # Waiting runs on the monotonic clock, the wall clock only dates the sends
+    start_perf = time.perf_counter_ns() + 1_000_000
+    start_wall = time.time_ns() + 1_000_000
+    n_sent = 0
+    for offset_ns, command in script.entries:
+        if not wait_until(start_perf + offset_ns, stop_event):
+            break
+        send(TXMessage(command, script.line_ending, start_wall + offset_ns))
+        n_sent += 1
+    return n_sent
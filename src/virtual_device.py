@@ -0,0 +1,351 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from src.binary_protocol import SLIP_END, WireSchema
+from src.shared_buffers import SharedCounters
+
+# Running simulators announce their port here, so SerialClass.get_ports lists
+# them in every process, not just the one that started them
+REGISTRY_DIR = os.path.join(tempfile.gettempdir(), "serial_plotter_virtual")
+VIRTUAL_DESC = "Virtual device"
+VIRTUAL_HWID = "VIRTUAL"
+
+# Seconds between writes to the pty, samples due in between are sent together
+WRITE_INTERVAL = 0.001
+
+
+def list_virtual_ports() -> List[dict]:
+    """Registry entries of the simulators that are still running
+
+    Returns:
+        list(dict): {"port", "pid", "wire_format", "wire_schema"} per simulator,
+            sorted by port
+    """
+    try:
+        names = os.listdir(REGISTRY_DIR)
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for name in names:
+        path = os.path.join(REGISTRY_DIR, name)
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            continue
+        try:
+            os.kill(entry["pid"], 0)
+        except ProcessLookupError:
+            # A simulator that was killed can't remove its own entry
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        except PermissionError:
+            # Running as another user
+            pass
+        if os.path.exists(entry["port"]):
+            entries.append(entry)
+    return sorted(entries, key=lambda entry: entry["port"])
+
+
+class VirtualDevice:
+    """Simulated device behind a pseudo-terminal, for load and soak testing
+
+    A separate process opens a pty pair and writes samples to its master side,
+    the slave side is a port SerialClass opens like any UART. Samples are sine
+    waves on channels ch0, ch1, ... and booleans on statuses !s0, !s1, ...,
+    timestamped by the device clock at exactly 1 / rate apart, and sent as text
+    lines or as SLIP framed binary samples (see WireSchema).
+
+    Faults a real link shows can be injected:
+        jitter          up to this many seconds of random delay per write
+        malformed_rate  fraction of samples sent with a corrupted field or byte
+        partial_rate    fraction of samples cut short, merging into the next
+        burst_rate      times per second the device holds its output for
+                        burst_duration seconds and then sends it all at once
+
+    Like a UART, the device never waits for the reader. Bytes the pty can't
+    take are dropped and counted as overrun.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1000,
+        n_channels: int = 4,
+        n_statuses: int = 1,
+        unit: str = "u",
+        wire_format: str = "text",
+        jitter: float = 0,
+        malformed_rate: float = 0,
+        partial_rate: float = 0,
+        burst_rate: float = 0,
+        burst_duration: float = 0.05,
+        seed: int = None,
+    ) -> None:
+        if unit not in ("m", "u"):
+            raise ValueError("Unknown timestamp unit: " + str(unit))
+        if wire_format not in ("text", "binary"):
+            raise ValueError("Unknown wire format: " + str(wire_format))
+        self.rate = rate
+        self.n_channels = n_channels
+        self.n_statuses = n_statuses
+        self.unit = unit
+        self.wire_format = wire_format
+        self.jitter = jitter
+        self.malformed_rate = malformed_rate
+        self.partial_rate = partial_rate
+        self.burst_rate = burst_rate
+        self.burst_duration = burst_duration
+        self.seed = seed
+
+        self.curve_keys = ["ch" + str(i) for i in range(n_channels)]
+        self.status_keys = ["!s" + str(i) for i in range(n_statuses)]
+        # Schema to set as "wire_schema" when reading a binary device
+        self.schema = WireSchema(
+            [(key, "f") for key in self.curve_keys],
+            [(key, "?") for key in self.status_keys],
+            unit,
+            "Q",
+        )
+        self.port = None
+        self.process = None
+        self.stop_event = multiprocessing.Event()
+        self.port_queue = multiprocessing.Queue()
+        self.counters = SharedCounters(
+            [
+                "samples",
+                "bytes",
+                "malformed",
+                "partial",
+                "bursts",
+                "overrun_bytes",
+                "received_bytes",
+                "start_time",
+            ]
+        )
+
+    def start(self, timeout=5) -> str:
+        """Start the device process
+
+        Returns:
+            str: Path of the port to open, e.g. /dev/pts/3
+        """
+        self.counters.reset()
+        self.stop_event.clear()
+        self.process = multiprocessing.Process(target=self.handler, daemon=True)
+        self.process.start()
+        try:
+            self.port = self.port_queue.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise RuntimeError("Virtual device did not start")
+        return self.port
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.process != None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+
+    def _values(self, sample_times: np.ndarray) -> np.ndarray:
+        """Channel values at sample_times seconds, one column per channel"""
+        frequencies = 0.5 * np.arange(1, self.n_channels + 1)
+        return np.sin(2 * np.pi * sample_times[:, None] * frequencies) * 100
+
+    def _statuses(self, sample_times: np.ndarray) -> np.ndarray:
+        """Status values at sample_times seconds, status i toggles every i + 1 s"""
+        periods = np.arange(1, self.n_statuses + 1)
+        return (sample_times[:, None] // periods) % 2 == 1
+
+    def _encode_text(self, ticks, values, statuses) -> List[bytes]:
+        pairs = [key + ":%.4f" for key in self.curve_keys]
+        pairs += [key + ":%s" for key in self.status_keys]
+        line_format = self.unit + "%d::" + ",".join(pairs) + "\n"
+        words = np.where(statuses, "true", "false").tolist()
+        return [
+            (line_format % (tick, *row, *status)).encode()
+            for tick, row, status in zip(ticks.tolist(), values.tolist(), words)
+        ]
+
+    def _encode_binary(self, ticks, values, statuses) -> List[bytes]:
+        return [
+            self.schema.encode(tick, row, status)
+            for tick, row, status in zip(
+                ticks.tolist(), values.tolist(), statuses.tolist()
+            )
+        ]
+
+    def _corrupt(self, sample: bytes) -> bytes:
+        """A sample the plotter has to reject"""
+        if self.wire_format == "binary":
+            # Any change inside the frame fails its CRC
+            index = random.randrange(1, len(sample) - 1)
+            corrupted = bytearray(sample)
+            corrupted[index] = (corrupted[index] + 1) % 256
+            if corrupted[index] == SLIP_END[0]:
+                corrupted[index] = 0
+            return bytes(corrupted)
+        timestamp, separator, pairs = sample.partition(b"::")
+        fault = random.randrange(3)
+        if fault == 0:
+            # A value that isn't a number
+            return timestamp + separator + pairs.replace(b":", b":x", 1)
+        if fault == 1:
+            # A missing separator
+            return timestamp + separator + pairs.replace(b":", b"", 1)
+        return bytes(random.randrange(32, 127) for i in range(len(sample) - 1)) + b"\n"
+
+    def _samples(self, first: int, last: int) -> bytes:
+        """Encoded samples first to last - 1, faults included"""
+        index = np.arange(first, last)
+        sample_times = index / self.rate
+        unit_seconds = 1e-3 if self.unit == "m" else 1e-6
+        ticks = np.round(sample_times / unit_seconds).astype(np.int64)
+        values = self._values(sample_times)
+        statuses = self._statuses(sample_times)
+        if self.wire_format == "binary":
+            samples = self._encode_binary(ticks, values, statuses)
+        else:
+            samples = self._encode_text(ticks, values, statuses)
+
+        n = len(samples)
+        for i in np.flatnonzero(np.random.random(n) < self.malformed_rate):
+            samples[i] = self._corrupt(samples[i])
+            self.counters.add("malformed")
+        for i in np.flatnonzero(np.random.random(n) < self.partial_rate):
+            # Without its end the sample runs into the next one
+            samples[i] = samples[i][: random.randrange(1, len(samples[i]) - 1)]
+            self.counters.add("partial")
+        self.counters.add("samples", n)
+        return b"".join(samples)
+
+    def _register(self):
+        os.makedirs(REGISTRY_DIR, exist_ok=True)
+        entry = {
+            "port": self.port,
+            "pid": os.getpid(),
+            "wire_format": self.wire_format,
+            "wire_schema": self.schema.as_dict(),
+        }
+        self.registry_path = os.path.join(REGISTRY_DIR, str(os.getpid()) + ".json")
+        with open(self.registry_path, "w") as file:
+            json.dump(entry, file)
+
+    def handler(self):
+        import pty
+        import tty
+
+        if self.seed != None:
+            random.seed(self.seed)
+            np.random.seed(self.seed)
+        master, slave = pty.openpty()
+        # No echo or newline translation, the port passes bytes through as is
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        self.port = os.ttyname(slave)
+        self._register()
+        self.port_queue.put(self.port)
+
+        start = time.perf_counter()
+        # Host time of device time zero, to measure latency against
+        self.counters["start_time"] = time.time()
+        n_sent = 0
+        pending = b""
+        hold_until = 0
+        try:
+            while not self.stop_event.is_set():
+                now = time.perf_counter()
+                n_due = int((now - start) * self.rate) + 1
+                if n_due > n_sent:
+                    pending += self._samples(n_sent, n_due)
+                    n_sent = n_due
+
+                if now >= hold_until and random.random() < (
+                    self.burst_rate * WRITE_INTERVAL
+                ):
+                    hold_until = now + self.burst_duration
+                    self.counters.add("bursts")
+                if now >= hold_until and len(pending) > 0:
+                    try:
+                        n_written = os.write(master, pending)
+                    except BlockingIOError:
+                        n_written = 0
+                    self.counters.add("bytes", n_written)
+                    self.counters.add("overrun_bytes", len(pending) - n_written)
+                    pending = b""
+
+                # Commands sent to the device are taken in and ignored, so
+                # a long TX script can't fill the pty and block the sender
+                try:
+                    self.counters.add("received_bytes", len(os.read(master, 65536)))
+                except BlockingIOError:
+                    pass
+
+                time.sleep(WRITE_INTERVAL + random.random() * self.jitter)
+        finally:
+            os.remove(self.registry_path)
+            os.close(master)
+            os.close(slave)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate a serial device on a pseudo-terminal"
+    )
+    parser.add_argument("--rate", type=float, default=1000, help="samples per second")
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--statuses", type=int, default=1)
+    parser.add_argument("--unit", choices=["m", "u"], default="u")
+    parser.add_argument("--wire-format", choices=["text", "binary"], default="text")
+    parser.add_argument("--jitter", type=float, default=0, help="seconds per write")
+    parser.add_argument("--malformed", type=float, default=0, help="fraction")
+    parser.add_argument("--partial", type=float, default=0, help="fraction")
+    parser.add_argument("--bursts", type=float, default=0, help="per second")
+    parser.add_argument("--burst-duration", type=float, default=0.05)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format="Virtual device: %(message)s", level=logging.INFO)
+    device = VirtualDevice(
+        args.rate,
+        args.channels,
+        args.statuses,
+        args.unit,
+        args.wire_format,
+        args.jitter,
+        args.malformed,
+        args.partial,
+        args.bursts,
+        args.burst_duration,
+        args.seed,
+    )
+    port = device.start()
+    logging.info("Sending on " + port + ", press enter to stop")
+    if args.wire_format == "binary":
+        logging.info("wire_schema: " + json.dumps(device.schema.as_dict()))
+    try:
+        input()
+    except (EOFError, KeyboardInterrupt):
+        pass
+    device.stop()
+    logging.info("Sent %s", device.counters.as_dict())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
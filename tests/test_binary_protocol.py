@@ -0,0 +1,110 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from src.binary_protocol import (
+    SLIP_END,
+    SLIP_ESC,
+    FrameDecoder,
+    WireSchema,
+    crc16,
+    slip_decode,
+    slip_encode,
+)
+
+SCHEMA = {
+    "unit": "u",
+    "timestamp": "I",
+    "channels": [["a", "f"], ["b", "h"]],
+    "statuses": [["!fault", "?"], ["!mode", "B"]],
+}
+
+
+def samples(n):
+    return [(1000 * i, [i / 4, -i], [i % 2 == 1, i]) for i in range(n)]
+
+
+def encode_all(schema, rows):
+    return b"".join(schema.encode(*row) for row in rows)
+
+
+def test_slip_round_trip():
+    payload = b"a" + SLIP_END + b"b" + SLIP_ESC + b"c" + SLIP_ESC + SLIP_END
+    frame = slip_encode(payload)
+    assert frame.startswith(SLIP_END) and frame.endswith(SLIP_END)
+    assert SLIP_END not in frame[1:-1]
+    assert slip_decode(frame[1:-1]) == payload
+
+
+def test_crc16_check_value():
+    # CRC-16/CCITT-FALSE of "123456789"
+    assert crc16(b"123456789") == 0x29B1
+
+
+def test_frames_decode_to_the_encoded_samples():
+    schema = WireSchema.from_dict(SCHEMA)
+    records, n_corrupt = FrameDecoder(schema).feed(encode_all(schema, samples(5)))
+    assert n_corrupt == 0
+
+    batch = schema.to_batch(records)
+    assert batch.unit_str == "u"
+    assert batch.ticks.tolist() == [0, 1000, 2000, 3000, 4000]
+    assert batch.curve_keys == ["a", "b"]
+    assert np.array_equal(batch.values, [[i / 4, -i] for i in range(5)])
+    assert batch.status_keys == ["!fault", "!mode"]
+    assert batch.statuses[:, 0].tolist() == ["false", "true"] * 2 + ["false"]
+    assert batch.statuses[:, 1].tolist() == ["0", "1", "2", "3", "4"]
+
+
+def test_chunks_of_any_size():
+    schema = WireSchema.from_dict(SCHEMA)
+    stream = encode_all(schema, samples(20))
+    decoder = FrameDecoder(schema)
+    timestamps = []
+    for start in range(0, len(stream), 7):
+        records, n_corrupt = decoder.feed(stream[start : start + 7])
+        assert n_corrupt == 0
+        timestamps.extend(records["timestamp"].tolist())
+    assert timestamps == [1000 * i for i in range(20)]
+
+
+def test_corrupt_frames_are_dropped_and_counted():
+    schema = WireSchema.from_dict(SCHEMA)
+    frames = [schema.encode(*row) for row in samples(3)]
+    damaged = bytearray(frames[1])
+    damaged[3] ^= 0xFF
+    short = SLIP_END + b"\x01\x02\x03" + SLIP_END
+    records, n_corrupt = FrameDecoder(schema).feed(
+        frames[0] + bytes(damaged) + short + frames[2]
+    )
+    assert records["timestamp"].tolist() == [0, 2000]
+    assert n_corrupt == 2
+
+
+def test_bytes_before_the_first_end_are_skipped():
+    schema = WireSchema.from_dict(SCHEMA)
+    frame = schema.encode(*samples(1)[0])
+    records, n_corrupt = FrameDecoder(schema).feed(frame[5:] + frame)
+    assert len(records) == 1
+    assert n_corrupt == 0
+
+
+def test_schema_survives_pickling():
+    schema = WireSchema.from_dict(SCHEMA)
+    copy = pickle.loads(pickle.dumps(schema))
+    assert copy.as_dict() == schema.as_dict()
+    assert copy.encode(*samples(2)[1]) == schema.encode(*samples(2)[1])
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        dict(SCHEMA, unit="s"),
+        dict(SCHEMA, timestamp="x"),
+        dict(SCHEMA, statuses=[["fault", "?"]]),
+    ],
+)
+def test_invalid_schemas(schema):
+    with pytest.raises(ValueError):
+        WireSchema.from_dict(schema)
@@ -0,0 +1,62 @@
+import pytest
+
+from src.bounded_queue import BoundedQueue
+
+
+def drain(bounded):
+    items = []
+    while not bounded.empty():
+        items.append(bounded.get_nowait())
+    return items
+
+
+def test_drop_oldest():
+    bounded = BoundedQueue(3, "drop_oldest")
+    results = [bounded.put(i) for i in range(5)]
+    assert results == [True] * 5
+    assert drain(bounded) == [2, 3, 4]
+    assert bounded.n_dropped() == 2
+
+
+def test_drop_newest():
+    bounded = BoundedQueue(3, "drop_newest")
+    results = [bounded.put(i) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert drain(bounded) == [0, 1, 2]
+    assert bounded.n_dropped() == 2
+
+
+def test_block_gives_up_after_the_timeout():
+    bounded = BoundedQueue(2, "block", block_timeout=0.01)
+    assert bounded.put(0) and bounded.put(1)
+    assert bounded.would_block()
+    assert not bounded.put(2)
+    assert drain(bounded) == [0, 1]
+    assert bounded.n_dropped() == 1
+
+
+def test_decimate_keeps_every_nth_item_until_drained():
+    bounded = BoundedQueue(2, "decimate", decimate_factor=3)
+    for i in range(2 + 1 + 6):
+        bounded.put(i)
+    # 2 replaced 0, then only every third of 3..8 got in, 5 and 8
+    assert drain(bounded) == [5, 8]
+    # Drained, everything is kept again
+    bounded.put(9)
+    bounded.put(10)
+    assert drain(bounded) == [9, 10]
+
+
+def test_from_settings_overrides_the_defaults():
+    bounded = BoundedQueue.from_settings(
+        "plot_queue", {"plot_queue": {"maxsize": 5, "policy": "drop_newest"}}
+    )
+    assert bounded.maxsize == 5
+    assert bounded.policy == "drop_newest"
+    assert bounded.block_timeout == 0
+
+
+@pytest.mark.parametrize("arguments", [(0, "block"), (10, "drop_everything")])
+def test_invalid_arguments(arguments):
+    with pytest.raises(ValueError):
+        BoundedQueue(*arguments)
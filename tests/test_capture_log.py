@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src.capture_log import JSONLinesLogReader, JSONLinesLogWriter
+from src.message_classes import RXBatch, RXMessage, TXMessage
+from src.serial_class import SerialClass
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+START_S = START.timestamp()
+
+
+def read_lines(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def make_batch(ticks):
+    ticks = np.array(ticks, dtype=np.int64)
+    batch = RXBatch(
+        "m",
+        ticks,
+        ["a", "b"],
+        np.column_stack([ticks * 1.0, -ticks * 1.0]),
+        [],
+        np.empty((len(ticks), 0), dtype=str),
+    )
+    batch.apply_offset(START)
+    return batch
+
+
+def write_log(path, n_rows):
+    """Log of n_rows RX rows 1 ms apart, with a TX record every 100 rows"""
+    writer = JSONLinesLogWriter(path)
+    writer.write_header({"port": "test"})
+    for start in range(0, n_rows, 100):
+        writer.write_batch(make_batch(range(start, min(start + 100, n_rows))))
+        message = TXMessage("go", "LF")
+        message.sent_ns = 0
+        writer.write(message)
+    writer.close()
+
+
+def test_header_is_the_first_line(tmp_path):
+    path = str(tmp_path / "capture.jsonl")
+    write_log(path, 10)
+    lines = read_lines(path)
+    assert lines[0] == ["HEADER", {"port": "test"}]
+
+    reader = JSONLinesLogReader(path)
+    assert reader.header == {"port": "test"}
+    assert next(reader.records())[0] == "RX"
+    reader.close()
+
+
+def test_rx_lines_hold_the_offset_and_raw_line(tmp_path):
+    path = str(tmp_path / "capture.jsonl")
+    writer = JSONLinesLogWriter(path)
+    writer.write_batch(make_batch([5]))
+    message = RXMessage("m6::a:6.0,b:-6.0,!s:on")
+    message.process()
+    message.apply_offset(START)
+    writer.write_many([message])
+    writer.close()
+
+    lines = read_lines(path)
+    assert [line[0] for line in lines] == ["RX", "RX"]
+    assert [sorted(line[1]) for line in lines] == [["dut_offset", "message"]] * 2
+    assert lines[0][1]["message"] == "m5::a:5.0,b:-5.0"
+    assert lines[1][1]["message"] == "m6::a:6.0,b:-6.0,!s:on"
+    assert lines[0][1]["dut_offset"] == pytest.approx(START_S + 0.005, abs=1e-6)
+    assert lines[1][1]["dut_offset"] == pytest.approx(START_S + 0.006, abs=1e-6)
+
+
+def test_records_wait_in_the_buffer_until_flushed(tmp_path):
+    path = str(tmp_path / "capture.jsonl")
+    writer = JSONLinesLogWriter(path)
+    writer.write_batch(make_batch(range(10)))
+    assert read_lines(path) == []
+    writer.flush()
+    assert len(read_lines(path)) == 10
+    writer.close()
+
+
+def test_log_thread_flushes_every_interval(tmp_path):
+    path = str(tmp_path / "capture.jsonl")
+    capture = SerialClass(cachesize=8)
+    capture.log_writer = JSONLinesLogWriter(path)
+    capture.log_flush_interval = 0.05
+    capture.logging_thread_enabled = True
+    thread = threading.Thread(target=capture._log_helper, daemon=True)
+    thread.start()
+    try:
+        capture.log_writer.write_batch(make_batch(range(10)))
+        capture.counters["log_rows"] = 10
+        time.sleep(0.2)
+        assert len(read_lines(path)) == 10
+        assert capture.counters["log_flushed_rows"] == 10
+        assert time.time() - capture.counters["log_flush_time"] < 0.2
+    finally:
+        capture.logging_thread_enabled = False
+        thread.join()
+        capture.log_writer.close()
+        capture.close()
+
+
+@pytest.fixture(scope="module")
+def long_log(tmp_path_factory):
+    # Big enough for offset_for_time to bisect before it scans
+    path = str(tmp_path_factory.mktemp("log") / "capture.jsonl")
+    write_log(path, 3000)
+    reader = JSONLinesLogReader(path)
+    yield reader
+    reader.close()
+
+
+def first_record_at(reader, timestamp):
+    return next(reader.records(reader.offset_for_time(timestamp)), None)
+
+
+@pytest.mark.parametrize("row", [0, 1, 1234, 2999])
+def test_offset_for_time_finds_an_exact_hit(long_log, row):
+    rx_records = [record for record in long_log.records() if record[0] == "RX"]
+    record = first_record_at(long_log, rx_records[row][1]["dut_offset"])
+    assert record == rx_records[row]
+
+
+def test_offset_for_time_between_rows_finds_the_next(long_log):
+    record = first_record_at(long_log, START_S + 1.2345)
+    assert record[1]["message"].startswith("m1235::")
+
+
+def test_offset_for_time_before_the_first_row(long_log):
+    assert long_log.offset_for_time(START_S - 10) == long_log.data_start
+
+
+def test_offset_for_time_after_the_last_row(long_log):
+    offset = long_log.offset_for_time(START_S + 10)
+    assert offset == long_log.file.seek(0, 2)
+    assert first_record_at(long_log, START_S + 10) == None
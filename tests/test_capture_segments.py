@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from src.capture_segments import (
+    MANIFEST_SUFFIX,
+    RotatingLogWriter,
+    SegmentedCaptureReader,
+)
+from src.log_replay import iter_capture_messages
+from src.message_classes import RXMessage
+
+
+def write_segments(base_path, log_format, compression=None, n_segments=3):
+    writer = RotatingLogWriter(
+        base_path, log_format, max_bytes=1, compression=compression
+    )
+    writer.write_header({"port": "test"})
+    timestamps = []
+    for segment in range(n_segments):
+        for i in range(5):
+            timestamp_ns = (10 * segment + i) * 10**9
+            writer.write(RXMessage.from_values(["a", "b"], [i, -i], [], timestamp_ns))
+            timestamps.append(timestamp_ns)
+        # Any flushed data is over max_bytes
+        writer.flush()
+    writer.close()
+    return timestamps
+
+
+@pytest.mark.parametrize("log_format", ["jsonl", "columnar"])
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_round_trip(tmp_path, log_format, compression):
+    base_path = str(tmp_path / "capture")
+    timestamps = write_segments(base_path, log_format, compression)
+
+    reader = SegmentedCaptureReader(base_path + MANIFEST_SUFFIX)
+    assert reader.header["port"] == "test"
+    assert reader.n_samples() == len(timestamps)
+    messages = list(iter_capture_messages(reader))
+    reader.close()
+    assert [m.timestamp_ns for m in messages] == timestamps
+    assert [m.as_values() for m in messages[:2]] == [[0, 0], [1, -1]]
+
+
+def test_manifest_lists_every_segment(tmp_path):
+    base_path = str(tmp_path / "capture")
+    write_segments(base_path, "jsonl", "gzip")
+
+    with open(base_path + MANIFEST_SUFFIX) as file:
+        manifest = json.load(file)
+    assert manifest["format"] == "jsonl"
+    # Closing after the last rotation leaves one empty segment
+    segments = manifest["segments"]
+    assert [s["n_samples"] for s in segments] == [5, 5, 5, 0]
+    assert all(s["closed"] for s in segments)
+    assert all(s["compression"] == "gzip" for s in segments)
+    assert [(s["t_first"], s["t_last"]) for s in segments[:3]] == [
+        (0, 4),
+        (10, 14),
+        (20, 24),
+    ]
+    for segment in segments:
+        assert os.path.exists(str(tmp_path / segment["file"]))
+
+
+def test_start_time_skips_earlier_segments(tmp_path):
+    base_path = str(tmp_path / "capture")
+    write_segments(base_path, "columnar")
+
+    reader = SegmentedCaptureReader(base_path + MANIFEST_SUFFIX)
+    messages = list(iter_capture_messages(reader, t_start=12))
+    reader.close()
+    assert [m.timestamp_ns // 10**9 for m in messages] == [
+        12,
+        13,
+        14,
+        20,
+        21,
+        22,
+        23,
+        24,
+    ]
+
+
+def test_rejects_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        RotatingLogWriter(str(tmp_path / "capture"), compression="zip")
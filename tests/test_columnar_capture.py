@@ -0,0 +1,145 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.capture_log import open_log_writer
+from src.columnar_capture import ColumnarCaptureReader, ColumnarCaptureWriter
+from src.message_classes import RXMessage
+
+
+def write_capture(path, value_dtype="f8", block_rows=4):
+    writer = ColumnarCaptureWriter(path, value_dtype, block_rows=block_rows)
+    writer.write_header({"port": "test"})
+    timestamps = np.arange(10, dtype=np.int64) * 1000
+    values = np.column_stack([np.arange(10) * 1.5, -np.arange(10)])
+    writer.write_samples(["a", "b"], timestamps, values)
+    writer.write_samples(
+        ["a", "c"], np.array([10000], dtype=np.int64), np.array([[7.0, 8.0]])
+    )
+    writer.close()
+    return timestamps, values
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    timestamps, values = write_capture(path)
+
+    reader = ColumnarCaptureReader(path)
+    assert reader.header["port"] == "test"
+    assert reader.n_samples() == 11
+    assert reader.time_span() == (0, 10000)
+    read_timestamps, read_values, channels = reader.slice(channels=["a", "b"])
+    assert channels == ["a", "b"]
+    assert read_timestamps[:10].tolist() == timestamps.tolist()
+    assert np.array_equal(read_values[:10], values)
+    # The last sample has no "b"
+    assert read_values[10, 0] == 7.0
+    assert np.isnan(read_values[10, 1])
+    reader.close()
+
+
+def test_blocks_carry_their_span_and_bounds(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    write_capture(path)
+
+    reader = ColumnarCaptureReader(path)
+    first = reader.blocks[0]
+    assert first.n_rows == 4
+    assert (first.t_first, first.t_last) == (0, 3000)
+    assert list(first.channels) == ["a", "b"]
+    assert np.array_equal(first.mins, [0, -3])
+    assert np.array_equal(first.maxs, [4.5, 0])
+    assert len(reader.blocks_in_range(4000, 5000)) == 1
+    reader.close()
+
+
+def test_slice_by_time(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    write_capture(path)
+
+    reader = ColumnarCaptureReader(path)
+    timestamps, values, channels = reader.slice(2500, 6000)
+    assert timestamps.tolist() == [3000, 4000, 5000, 6000]
+    assert values[:, 0].tolist() == [4.5, 6.0, 7.5, 9.0]
+    assert channels == ["a", "b"]
+    reader.close()
+
+
+def test_chunks_of_any_size_fill_whole_blocks(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    writer = ColumnarCaptureWriter(path, block_rows=4)
+    writer.write_header({"port": "test"})
+    timestamps = np.arange(23, dtype=np.int64)
+    values = np.column_stack([np.arange(23.0), -np.arange(23.0)])
+    for start, end in [(0, 1), (1, 3), (3, 14), (14, 15), (15, 23)]:
+        chunk = values[start:end].copy()
+        writer.write_samples(["a", "b"], timestamps[start:end], chunk)
+        # The writer keeps its own copy
+        chunk[:] = np.nan
+    writer.close()
+
+    reader = ColumnarCaptureReader(path)
+    assert [block.n_rows for block in reader.blocks] == [4, 4, 4, 4, 4, 3]
+    read_timestamps, read_values, _ = reader.slice()
+    assert read_timestamps.tolist() == timestamps.tolist()
+    assert np.array_equal(read_values, values)
+    reader.close()
+
+
+def test_float32_values(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    timestamps, values = write_capture(path, "f4")
+    f8_path = str(tmp_path / "capture_f8.spcap")
+    write_capture(f8_path, "f8")
+
+    reader = ColumnarCaptureReader(path)
+    assert reader.value_dtype == np.float32
+    _, read_values, _ = reader.slice(channels=["a", "b"])
+    assert np.allclose(read_values[:10], values)
+    reader.close()
+    assert os.path.getsize(path) < os.path.getsize(f8_path)
+
+
+def test_status_changes_are_events(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    writer = ColumnarCaptureWriter(path)
+    writer.write_header({})
+    for i, status in enumerate(["ok", "ok", "fault"]):
+        writer.write(RXMessage.from_values(["a"], [i], [("!s", status)], i * 10**9))
+    writer.close()
+
+    reader = ColumnarCaptureReader(path)
+    statuses = [event[1]["statuses"] for event in reader.events if event[0] == "STATUS"]
+    assert statuses == [{"!s": "ok"}, {"!s": "fault"}]
+    assert reader.n_samples() == 3
+    reader.close()
+
+
+def test_truncated_file_ends_the_index(tmp_path):
+    path = str(tmp_path / "capture.spcap")
+    write_capture(path)
+    with open(path, "r+b") as file:
+        file.truncate(os.path.getsize(path) - 10)
+
+    reader = ColumnarCaptureReader(path)
+    assert reader.n_samples() == 10
+    reader.close()
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "capture.jsonl"
+    path.write_text("{}\n")
+    with pytest.raises(ValueError):
+        ColumnarCaptureReader(str(path))
+
+
+def test_open_log_writer_passes_the_value_dtype(tmp_path):
+    base_path = str(tmp_path / "capture")
+    writer = open_log_writer(base_path, "columnar", value_dtype="f4")
+    writer.write_header({})
+    writer.close()
+
+    reader = ColumnarCaptureReader(base_path + ".spcap")
+    assert reader.value_dtype == np.float32
+    reader.close()
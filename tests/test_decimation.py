@@ -0,0 +1,69 @@
+import numpy as np
+
+from src.decimation import minmax_columns, minmax_decimate, visible_slice
+
+
+def test_visible_slice_adds_one_sample_on_each_side():
+    x = np.arange(10.0)
+    assert visible_slice(x, 3.5, 6.5) == slice(3, 8)
+    assert visible_slice(x, 3, 6) == slice(2, 8)
+    assert visible_slice(x, -5, 100) == slice(0, 10)
+    assert visible_slice(x, 20, 30) == slice(9, 10)
+
+
+def test_few_samples_are_returned_as_they_are():
+    x = np.arange(10.0)
+    y = x**2
+    x_out, y_out = minmax_decimate(x, y, 0, 9, 100)
+    assert np.array_equal(x_out, x)
+    assert np.array_equal(y_out, y)
+
+
+def test_every_pixel_keeps_its_extremes():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 100, 100000))
+    y = rng.normal(size=len(x))
+    y[12345] = 50
+    y[54321] = -50
+    n_pixels = 200
+    x_out, y_out = minmax_decimate(x, y, 0, 100, n_pixels)
+
+    assert len(x_out) <= 2 * (n_pixels + 2)
+    assert y_out.max() == 50
+    assert y_out.min() == -50
+    # Strokes pair up a minimum and a maximum at the same x
+    assert np.array_equal(x_out[0::2], x_out[1::2])
+    assert (y_out[0::2] <= y_out[1::2]).all()
+    columns = np.floor(x * n_pixels / 100)
+    for column in [0, 77, 199]:
+        in_column = columns == column
+        stroke = np.flatnonzero(x_out[0::2] == x[in_column][0])[0]
+        assert y_out[2 * stroke] == y[in_column].min()
+        assert y_out[2 * stroke + 1] == y[in_column].max()
+
+
+def test_only_the_view_is_decimated():
+    x = np.arange(10000.0)
+    x_out, _ = minmax_decimate(x, np.sin(x), 1000, 2000, 50)
+    assert x_out[0] == 999
+    # 2000 and the sample after the view share the last column
+    assert x_out[-1] == 2000
+    assert len(x_out) <= 2 * (50 + 2)
+
+
+def test_columns_of_buckets():
+    x = np.arange(0.0, 1000.0, 2)
+    y_min = -np.arange(len(x), dtype=float)
+    y_max = np.arange(len(x), dtype=float)
+    x_out, y_out = minmax_columns(x, y_min, y_max, 0, 1000, 10)
+    assert len(x_out) == 20
+    assert x_out[0::2].tolist() == list(range(0, 1000, 100))
+    assert y_out[0::2].tolist() == [-(50 * i + 49) for i in range(10)]
+    assert y_out[1::2].tolist() == [50 * i + 49 for i in range(10)]
+
+
+def test_few_buckets_become_one_stroke_each():
+    x = np.array([0.0, 1.0, 2.0])
+    x_out, y_out = minmax_columns(x, np.zeros(3), np.ones(3), 0, 2, 100)
+    assert x_out.tolist() == [0, 0, 1, 1, 2, 2]
+    assert y_out.tolist() == [0, 1] * 3
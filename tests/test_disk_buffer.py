@@ -0,0 +1,34 @@
+import os
+
+import numpy as np
+
+from src import disk_buffer
+from src.disk_buffer import DiskBuffer
+
+
+def test_round_trip_across_growth(tmp_path, monkeypatch):
+    monkeypatch.setattr(disk_buffer, "INITIAL_DISK_ROWS", 4)
+    buffer = DiskBuffer(str(tmp_path / "history"), 2)
+    first = None
+    for start in range(0, 30, 3):
+        buffer.append(np.column_stack([np.arange(start, start + 3), np.ones(3)]))
+        if first is None:
+            first = buffer.column(0)
+    assert len(buffer) == 30
+    assert buffer.column(0).tolist() == list(range(30))
+    assert buffer.view(2).tolist() == [[28, 1], [29, 1]]
+    # Arrays from before the files grew stay valid
+    assert first.tolist() == [0, 1, 2]
+    buffer.close()
+
+
+def test_clear_and_close(tmp_path):
+    buffer = DiskBuffer(str(tmp_path / "history"), 3)
+    buffer.append(np.zeros((5, 3)))
+    buffer.clear()
+    assert len(buffer) == 0
+    assert len(buffer.view()) == 0
+    paths = list(buffer.paths)
+    assert all(os.path.exists(path) for path in paths)
+    buffer.close()
+    assert not any(os.path.exists(path) for path in paths)
@@ -0,0 +1,121 @@
+import csv
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src import export
+from src.capture_log import open_log_writer
+from src.export import EXPORT_FORMATS, ExportJob, export_capture, iter_live_chunks
+from src.message_classes import RXBatch
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_table(n_rows):
+    table = np.empty((n_rows, 3))
+    table[:, 0] = 1704067200 + np.arange(n_rows) / 1000
+    table[:, 1] = np.arange(n_rows) * 0.25
+    table[:, 2] = -np.arange(n_rows) / 3
+    # A curve without a sample at that time
+    table[::7, 2] = np.nan
+    return table
+
+
+def read_export(path, export_format):
+    """(column names, float64 table) of an exported file"""
+    if export_format == "csv":
+        with open(path, newline="") as file:
+            rows = list(csv.reader(file))
+        return rows[0], np.array(rows[1:], dtype=np.float64).reshape(-1, len(rows[0]))
+    if export_format == "npy":
+        records = np.load(path)
+        names = list(records.dtype.names)
+        return names, np.column_stack([records[name] for name in names])
+    with np.load(path) as archive:
+        names = list(archive.files)
+        return names, np.column_stack([archive[name] for name in names])
+
+
+def run(job):
+    job.start()
+    job.thread.join()
+    assert job.error == None
+    assert job.done
+
+
+@pytest.mark.parametrize("export_format", list(EXPORT_FORMATS))
+@pytest.mark.parametrize("n_rows", [0, 1, 1000])
+def test_round_trip(tmp_path, export_format, n_rows):
+    table = make_table(n_rows)
+    path = str(tmp_path / ("export" + EXPORT_FORMATS[export_format]))
+    job = ExportJob(path, ["a", "b"], iter_live_chunks(table, chunk_rows=128), n_rows)
+    run(job)
+    assert job.rows_written == n_rows
+
+    names, read_table = read_export(path, export_format)
+    assert names == ["timestamp", "a", "b"]
+    assert read_table.shape == (n_rows, 3)
+    if export_format == "csv":
+        # Timestamps to the microsecond, values to 10 significant digits
+        np.testing.assert_allclose(read_table[:, 0], table[:, 0], rtol=0, atol=1e-6)
+        np.testing.assert_allclose(read_table[:, 1:], table[:, 1:], rtol=1e-9)
+    else:
+        np.testing.assert_array_equal(read_table, table)
+
+
+def test_unknown_extension_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        ExportJob(str(tmp_path / "export.txt"), ["a"], [])
+
+
+def test_cancel_stops_the_export(tmp_path):
+    job = ExportJob(str(tmp_path / "export.csv"), ["a", "b"], [make_table(10)] * 3)
+    job.cancel()
+    job.start()
+    job.thread.join()
+    assert isinstance(job.error, InterruptedError)
+
+
+@pytest.mark.parametrize("log_format", ["jsonl", "columnar"])
+def test_export_capture_closes_the_reader(tmp_path, monkeypatch, log_format):
+    writer = open_log_writer(str(tmp_path / "capture"), log_format)
+    writer.write_header({"port": "test"})
+    ticks = np.arange(100, dtype=np.int64)
+    batch = RXBatch(
+        "m", ticks, ["a"], ticks[:, None] * 1.0, [], np.empty((100, 0), dtype=str)
+    )
+    batch.apply_offset(START)
+    writer.write_batch(batch)
+    writer.close()
+
+    readers = []
+    open_capture = export.open_capture
+
+    def tracked_open_capture(path):
+        reader = open_capture(path)
+        reader.n_closed = 0
+        close = reader.close
+
+        def counted_close():
+            reader.n_closed += 1
+            close()
+
+        reader.close = counted_close
+        readers.append(reader)
+        return reader
+
+    monkeypatch.setattr(export, "open_capture", tracked_open_capture)
+    out_path = str(tmp_path / "export.npz")
+    job = export_capture(writer.path, out_path)
+    job.thread.join()
+    assert job.error == None
+    assert readers[0].n_closed == 1
+    names, table = read_export(out_path, "npz")
+    assert names == ["timestamp", "a"]
+    assert table[:, 1].tolist() == list(range(100))
+
+    # Closed as well when the job can't be made
+    with pytest.raises(ValueError):
+        export_capture(writer.path, str(tmp_path / "export.txt"))
+    assert readers[1].n_closed == 1
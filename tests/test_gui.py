@@ -0,0 +1,87 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+
+from src.smart_serial_plottter import SmartSerialPloter
+from src.virtual_device import VirtualDevice
+
+
+@pytest.fixture
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def window(app, tmp_path, monkeypatch):
+    # The window rewrites src/user_settings.json of the working directory,
+    # give it a copy of the repository's
+    (tmp_path / "src").mkdir()
+    shutil.copy(
+        os.path.join(os.path.dirname(__file__), "..", "src", "user_settings.json"),
+        tmp_path / "src",
+    )
+    monkeypatch.chdir(tmp_path)
+    window = SmartSerialPloter()
+    window.user_settings["ports"] = []
+    window.log_to_file_checkbox.setChecked(False)
+    yield window
+    if window.is_on:
+        window.c_dc_handler()
+    window.plotter.close_history()
+    window.serial.close()
+
+
+def connect(window, device):
+    port = device.start()
+    window.get_serial_ports()
+    ports = [str(p.port) for p in window.cur_ports]
+    window.serial_ports.setCurrentIndex(ports.index(port))
+    window.c_dc_handler()
+
+
+def run_events(app, seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        app.processEvents()
+        time.sleep(0.005)
+
+
+@pytest.mark.parametrize("n_statuses", [0, 1])
+def test_connect_goes_live_without_status_changes(app, window, n_statuses):
+    # Statuses toggle after a second, so none change during the test
+    device = VirtualDevice(rate=500, n_channels=2, n_statuses=n_statuses)
+    try:
+        connect(window, device)
+        run_events(app, 0.5)
+        assert window.plotter.is_live
+        assert window.plotter.start_stop_button.text() == "Stop"
+        assert len(window.plotter.plot_curves[0].getData()[0]) > 0
+    finally:
+        window.c_dc_handler()
+        device.stop()
+
+
+def test_channels_beyond_the_ring_are_plotted(app, window):
+    n_channels = 20
+    device = VirtualDevice(rate=500, n_channels=n_channels, n_statuses=0)
+    try:
+        connect(window, device)
+        assert n_channels > window.source.ring.max_channels
+        run_events(app, 0.5)
+        assert window.plotter.num_curves == n_channels
+        n_points = [
+            np.isfinite(curve.getData()[1]).sum()
+            for curve in window.plotter.plot_curves
+        ]
+        # Every curve keeps up with the first, not just the first batch
+        assert n_points[0] > 50
+        assert n_points[-1] == n_points[0]
+    finally:
+        window.c_dc_handler()
+        device.stop()
@@ -0,0 +1,170 @@
+import random
+
+import numpy as np
+import pytest
+
+from src.line_parser import TICK_PATTERN, BatchLineParser
+from src.message_classes import MessageProcessException, RXMessage
+
+
+def process_lines(lines):
+    """(rows, failed lines) the way RXMessage.process reads lines one by one"""
+    rows = []
+    failed = []
+    for line in lines:
+        message = RXMessage(line)
+        try:
+            message.process()
+            message.device_elapsed()
+        except MessageProcessException:
+            failed.append(line)
+            continue
+        if TICK_PATTERN.fullmatch(message.device_timestamp) == None:
+            failed.append(line)
+            continue
+        rows.append(
+            (
+                message.unit_str,
+                int(message.device_timestamp),
+                message.as_curve_keys(),
+                message.as_values(),
+                message.get_statuses(),
+            )
+        )
+    return rows, failed
+
+
+def parse_lines(lines, parser=None):
+    """Same as process_lines, through BatchLineParser"""
+    parser = BatchLineParser() if parser == None else parser
+    batches, failed = parser.parse(lines)
+    rows = []
+    for batch in batches:
+        for row in range(len(batch)):
+            rows.append(
+                (
+                    batch.unit_str,
+                    int(batch.ticks[row]),
+                    batch.curve_keys,
+                    batch.values[row].tolist(),
+                    batch.row_statuses(row),
+                )
+            )
+    return rows, failed
+
+
+def assert_same(lines):
+    expected_rows, expected_failed = process_lines(lines)
+    rows, failed = parse_lines(lines)
+    assert failed == expected_failed
+    assert len(rows) == len(expected_rows)
+    for row, expected in zip(rows, expected_rows):
+        assert row[:3] == expected[:3]
+        assert np.array_equal(row[3], expected[3], equal_nan=True)
+        assert row[4] == expected[4]
+
+
+def random_value(rng):
+    return rng.choice(
+        [
+            str(rng.randint(-1000, 1000)),
+            repr(rng.uniform(-1e6, 1e6)),
+            "%.3e" % rng.uniform(-1, 1),
+            "-0.5",
+            ".25",
+            "nan",
+            "inf",
+        ]
+    )
+
+
+def test_fast_path_matches_process():
+    rng = random.Random(1)
+    lines = [
+        "u"
+        + str(i * 100)
+        + "::a:"
+        + random_value(rng)
+        + ",!fault:"
+        + rng.choice(["true", "false", "", "overtemp"])
+        + ",b:"
+        + random_value(rng)
+        for i in range(500)
+    ]
+    assert_same(lines)
+
+
+def test_fast_path_is_taken_for_one_layout():
+    parser = BatchLineParser()
+    lines = ["m" + str(i) + "::a:" + str(i) + ",b:" + str(-i) for i in range(100)]
+    batches, failed = parser.parse(lines)
+    # The first line teaches the layout, the rest is one batch
+    assert [len(batch) for batch in batches] == [1, 99]
+    assert failed == []
+    assert batches[1].values[:, 1].tolist() == [-i for i in range(1, 100)]
+
+
+@pytest.mark.parametrize(
+    "bad_line",
+    [
+        "m5::a:x,b:1",
+        "m5::a:1",
+        "m5::a:1,c:2",
+        "m5::a:1,b:2,c:3",
+        "m5:a:1,b:2",
+        "x5::a:1,b:2",
+        "m5.5::a:1,b:2",
+        "m::a:1,b:2",
+        "m5::a:1,b:",
+        "m5::a:1:2,b:3",
+        "m5::a:\u00b5,b:1",
+        "",
+    ],
+)
+def test_lines_off_the_layout_match_process(bad_line):
+    lines = ["m" + str(i) + "::a:" + str(i) + ",b:1" for i in range(10)]
+    assert_same(lines[:5] + [bad_line] + lines[5:])
+
+
+def slow_parse_lines(lines):
+    """Same as parse_lines, with a new parser per line so each takes the slow path"""
+    rows = []
+    failed = []
+    for line in lines:
+        line_rows, line_failed = parse_lines([line])
+        rows += line_rows
+        failed += line_failed
+    return rows, failed
+
+
+@pytest.mark.parametrize(
+    "tick",
+    ["1e3", "1.0", "+5", " 5", "5 ", "-", "--5", "0x10", "1_000", "\u0665", "-0"]
+    + [str(2**53 + 1), str(-(2**53) - 1), str(10**18 - 1), str(10**18)],
+)
+def test_fast_and_slow_paths_take_the_same_ticks(tick):
+    lines = ["u" + str(i) + "::a:1,b:2" for i in range(10)]
+    lines = lines[:5] + ["u" + tick + "::a:3,b:4"] + lines[5:]
+    rows, failed = parse_lines(lines)
+    assert (rows, failed) == slow_parse_lines(lines)
+    if TICK_PATTERN.fullmatch(tick) == None:
+        assert failed == ["u" + tick + "::a:3,b:4"]
+    else:
+        assert rows[5][1] == int(tick)
+
+
+def test_layout_changes():
+    lines = (
+        ["m" + str(i) + "::a:1,b:2" for i in range(5)]
+        + ["u" + str(i) + "::c:3,!s:on" for i in range(5)]
+        + ["m" + str(i) + "::a:4,b:5" for i in range(5)]
+    )
+    assert_same(lines)
+
+
+def test_layout_is_kept_across_calls():
+    parser = BatchLineParser()
+    parse_lines(["m0::a:1,b:2"], parser)
+    rows, failed = parse_lines(["m1::a:3,b:4", "m2::a:5,b:6"], parser)
+    assert [row[3] for row in rows] == [[3, 4], [5, 6]]
+    assert failed == []
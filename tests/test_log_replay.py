@@ -0,0 +1,123 @@
+import queue
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from src.capture_log import open_log_writer
+from src.log_replay import LogReplay
+from src.message_classes import RXBatch
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+START_S = START.timestamp()
+
+
+def write_capture(base_path, log_format, n_rows, interval_ms=10):
+    """Capture of n_rows samples interval_ms apart, returns its path"""
+    writer = open_log_writer(base_path, log_format)
+    writer.write_header({"port": "test"})
+    ticks = np.arange(n_rows, dtype=np.int64) * interval_ms
+    batch = RXBatch(
+        "m",
+        ticks,
+        ["a"],
+        np.arange(n_rows, dtype=np.float64)[:, None],
+        [],
+        np.empty((n_rows, 0), dtype=str),
+    )
+    batch.apply_offset(START)
+    writer.write_batch(batch)
+    writer.close()
+    return writer.path
+
+
+def collect(replay, timeout=5):
+    """(arrival time, message) of everything replayed until it finishes"""
+    received = []
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            batch = replay.rx_messages.get(timeout=0.05)
+        except queue.Empty:
+            if replay.finished and replay.rx_messages.empty():
+                break
+            continue
+        now = time.perf_counter()
+        received += [(now, message) for message in batch]
+    return received
+
+
+@pytest.fixture(params=["jsonl", "columnar"])
+def log_format(request):
+    return request.param
+
+
+def test_replays_every_sample_in_order(tmp_path, log_format):
+    path = write_capture(str(tmp_path / "capture"), log_format, 500)
+    replay = LogReplay(path, speed=None, max_batch=64, max_queued_batches=2)
+    replay.start()
+    received = collect(replay)
+    replay.end()
+
+    values = [message.as_values()[0] for _, message in received]
+    assert values == list(range(500))
+    timestamps = [message.timestamp_ns for _, message in received]
+    assert timestamps[0] == round(START_S * 1e9)
+    assert np.all(np.diff(timestamps) == 10_000_000)
+    assert replay.get_n_total_messages_read() == 500
+
+
+def test_paces_samples_by_their_timestamps(tmp_path, log_format):
+    # 1 s of samples, replayed in about 0.2 s
+    path = write_capture(str(tmp_path / "capture"), log_format, 100)
+    replay = LogReplay(path, speed=5)
+    started = time.perf_counter()
+    replay.start()
+    received = collect(replay)
+    replay.end()
+
+    assert len(received) == 100
+    for arrival, message in received:
+        due = (message.timestamp_ns / 1e9 - START_S) / 5
+        # Never early by more than a batch, and not long after either
+        assert arrival - started >= due - replay.batch_interval
+        assert arrival - started < due + 0.1
+
+
+def test_seek_continues_from_a_device_time(tmp_path, log_format):
+    # 10 s of samples at 1x, the seek must cut that short
+    path = write_capture(str(tmp_path / "capture"), log_format, 1000)
+    replay = LogReplay(path, speed=1)
+    replay.start()
+    first_batch = replay.rx_messages.get(timeout=5)
+    assert first_batch[0].as_values() == [0]
+    replay.seek(START_S + 9.5)
+    received = collect(replay)
+    replay.end()
+
+    values = [message.as_values()[0] for _, message in received]
+    # What was queued before the seek, then the samples from 9.5 s on
+    assert values[-50:] == list(range(950, 1000))
+    assert values[:-50] == sorted(values[:-50])
+    assert max(values[:-50], default=0) < 950
+
+
+def test_seek_before_start_skips_the_earlier_samples(tmp_path, log_format):
+    path = write_capture(str(tmp_path / "capture"), log_format, 100)
+    replay = LogReplay(path, speed=None)
+    replay.seek(START_S + 0.5)
+    replay.start()
+    received = collect(replay)
+    replay.end()
+
+    assert [message.as_values()[0] for _, message in received] == list(range(50, 100))
+
+
+def test_has_the_queues_the_metrics_read(tmp_path):
+    path = write_capture(str(tmp_path / "capture"), "jsonl", 10)
+    replay = LogReplay(path)
+    assert replay.rx_messages.n_dropped() == 0
+    assert replay.tx_messages.qsize() == 0
+    assert replay.tx_messages.n_dropped() == 0
+    replay.reader.close()
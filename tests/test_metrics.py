@@ -0,0 +1,68 @@
+import logging
+
+from src.metrics import MetricsRegistry, StageTimes, timed_stage
+
+
+def test_prometheus_text():
+    registry = MetricsRegistry("test")
+    registry.counter("rows_total", "Rows read", lambda: 3)
+    registry.gauge("lag_seconds", "Lag", lambda: 0.25)
+    registry.gauge("idle", "Not running", lambda: None)
+    assert registry.prometheus_text() == (
+        "# HELP test_rows_total Rows read\n"
+        "# TYPE test_rows_total counter\n"
+        "test_rows_total 3.0\n"
+        "# HELP test_lag_seconds Lag\n"
+        "# TYPE test_lag_seconds gauge\n"
+        "test_lag_seconds 0.25\n"
+    )
+
+
+def test_non_finite_values():
+    registry = MetricsRegistry("test")
+    for name, value in [("a", "nan"), ("b", "inf"), ("c", "-inf")]:
+        registry.gauge(name, name, lambda value=value: float(value))
+    samples = [
+        line for line in registry.prometheus_text().splitlines() if line[0] != "#"
+    ]
+    assert samples == ["test_a NaN", "test_b +Inf", "test_c -Inf"]
+
+
+def test_failing_metric_is_logged_once(caplog):
+    registry = MetricsRegistry()
+    healthy = [False]
+
+    def read():
+        if not healthy[0]:
+            raise RuntimeError("stage stopped")
+        return 1
+
+    registry.gauge("flaky", "Flaky", read)
+    with caplog.at_level(logging.WARNING):
+        assert registry.collect() == {}
+        assert registry.collect() == {}
+        assert len(caplog.records) == 1
+        assert "flaky" in caplog.records[0].getMessage()
+
+        healthy[0] = True
+        assert registry.collect() == {"flaky": 1}
+        # A failure after the metric recovered is logged again
+        healthy[0] = False
+        registry.collect()
+        assert len(caplog.records) == 2
+
+
+def test_timed_stage():
+    class Stage:
+        def __init__(self):
+            self.stage_times = StageTimes()
+
+        @timed_stage("work")
+        def work(self):
+            return 5
+
+    stage = Stage()
+    assert stage.work() == 5
+    stage.work()
+    assert stage.stage_times.calls["work"] == 2
+    assert stage.stage_times.seconds["work"] > 0
@@ -0,0 +1,115 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.multi_port import MergedRing, MultiPortCapture
+from src.shared_buffers import SharedRingBuffer
+
+
+@pytest.fixture
+def rings():
+    rings = [SharedRingBuffer(capacity=64, max_channels=3) for _ in range(2)]
+    yield rings
+    for ring in rings:
+        ring.unlink()
+
+
+def write(ring, timestamps, value):
+    timestamps = np.array(timestamps, dtype=np.int64)
+    ring.write(timestamps, np.full((len(timestamps), 2), value, dtype=np.float64))
+
+
+def test_read_merges_ports_by_timestamp(rings):
+    merged = MergedRing(rings, [2, 2], quiet_seconds=60)
+    write(rings[0], [0, 2, 4], 1)
+    write(rings[1], [1, 3, 5], 2)
+    timestamps, values, cursor, n_overwritten = merged.read(0)
+    # Port 0 is behind at 4, 5 waits for it
+    assert timestamps.tolist() == [0, 1, 2, 3, 4]
+    assert cursor == (3, 3)
+    assert n_overwritten == 0
+
+    write(rings[0], [6], 1)
+    timestamps, _, cursor, _ = merged.read(cursor)
+    assert timestamps.tolist() == [5]
+
+
+def test_lagging_port_never_sends_time_backwards(rings):
+    merged = MergedRing(rings, [2, 2], quiet_seconds=60)
+    write(rings[0], [10, 20, 30], 1)
+    write(rings[1], [5], 2)
+    read = []
+    timestamps, _, cursor, _ = merged.read(0)
+    read += timestamps.tolist()
+    # The lagging port catches up in a later read
+    write(rings[1], [15, 25, 35], 2)
+    timestamps, _, cursor, _ = merged.read(cursor)
+    read += timestamps.tolist()
+    assert read == [5, 10, 15, 20, 25, 30]
+    assert np.all(np.diff(read) >= 0)
+
+
+def test_quiet_port_stops_holding_rows_back(rings):
+    merged = MergedRing(rings, [2, 2], quiet_seconds=0.05)
+    write(rings[0], [0, 1], 1)
+    write(rings[1], [0], 2)
+    timestamps, _, cursor, _ = merged.read(0)
+    assert timestamps.tolist() == [0, 0]
+
+    time.sleep(0.1)
+    write(rings[0], [2, 3], 1)
+    timestamps, _, cursor, _ = merged.read(cursor)
+    assert timestamps.tolist() == [1, 2, 3]
+
+    # Rows the quiet port writes afterwards that are too old are dropped
+    write(rings[1], [2, 4], 2)
+    timestamps, _, cursor, n_overwritten = merged.read(cursor)
+    assert n_overwritten == 1
+    # And it holds the others back again
+    assert timestamps.tolist() == []
+    write(rings[0], [5], 1)
+    timestamps, _, cursor, _ = merged.read(cursor)
+    assert timestamps.tolist() == [4]
+
+
+def test_ports_get_their_own_columns(rings):
+    merged = MergedRing(rings, [1, 2], quiet_seconds=60)
+    rings[0].write(np.array([0], dtype=np.int64), np.array([[1.0, 9.0]]))
+    rings[1].write(np.array([0], dtype=np.int64), np.array([[2.0, 3.0]]))
+    timestamps, values, _, _ = merged.read(0)
+    assert merged.offsets == [0, 1]
+    # Port 0's second channel has no column and is dropped
+    assert values.shape == (2, 3)
+    np.testing.assert_array_equal(values[0], [1.0, np.nan, np.nan])
+    np.testing.assert_array_equal(values[1], [np.nan, 2.0, 3.0])
+
+
+def test_port_without_columns_is_left_out(rings):
+    merged = MergedRing(rings, [2, 0], quiet_seconds=60)
+    write(rings[0], [0, 1], 1)
+    timestamps, values, _, _ = merged.read(0)
+    assert timestamps.tolist() == [0, 1]
+    assert values.shape == (2, 2)
+
+
+class FakeCapture:
+    def __init__(self, counters) -> None:
+        self.counters = counters
+
+    def get_counters(self) -> dict:
+        return self.counters
+
+
+def test_counters_add_up_except_the_extremes():
+    capture = MultiPortCapture(cachesize=8)
+    capture.captures = [
+        FakeCapture(
+            {"rx_count": 10, "log_flush_time": 5.0, "tx_late_max_seconds": 0.2}
+        ),
+        FakeCapture({"rx_count": 4, "log_flush_time": 3.0, "tx_late_max_seconds": 0.5}),
+    ]
+    counters = capture.get_counters()
+    assert counters["rx_count"] == 14
+    assert counters["log_flush_time"] == 3.0
+    assert counters["tx_late_max_seconds"] == 0.5
@@ -0,0 +1,125 @@
+import glob
+import warnings
+
+import numpy as np
+import pytest
+
+from src import plot_history
+from src.decimation import minmax_decimate
+from src.plot_history import PlotHistory
+
+
+def make_rows(n, n_curves=2, seed=0):
+    """Rows of a time and n_curves random values, some of them missing"""
+    rng = np.random.default_rng(seed)
+    rows = np.empty((n, 1 + n_curves))
+    rows[:, 0] = np.arange(n) / 100
+    rows[:, 1:] = rng.normal(size=(n, n_curves))
+    missing = rng.random((n, n_curves)) < 0.3
+    rows[:, 1:][missing] = np.nan
+    return rows
+
+
+def append_in_chunks(history, rows, chunk=100):
+    for start in range(0, len(rows), chunk):
+        history.append(rows[start : start + chunk])
+
+
+@pytest.fixture(params=["memory", "disk"])
+def history_and_rows(request, tmp_path):
+    rows = make_rows(4096)
+    path = None if request.param == "memory" else str(tmp_path / "history")
+    history = PlotHistory(2, 4096, path)
+    append_in_chunks(history, rows)
+    yield history, rows
+    history.close()
+
+
+def test_levels_hold_bucket_extremes(history_and_rows):
+    history, rows = history_and_rows
+    for k in [1, 3, 6]:
+        level = history.level(k)
+        buckets = rows.reshape(-1, 2**k, 3)
+        assert len(level) == len(buckets)
+        assert np.array_equal(level[:, 0], buckets[:, 0, 0])
+        with warnings.catch_warnings():
+            # Buckets in which a curve has no value at all
+            warnings.simplefilter("ignore", RuntimeWarning)
+            assert np.allclose(
+                level[:, 1:3], np.nanmin(buckets[:, :, 1:], axis=1), equal_nan=True
+            )
+            assert np.allclose(
+                level[:, 3:5], np.nanmax(buckets[:, :, 1:], axis=1), equal_nan=True
+            )
+
+
+def test_level_means_of_complete_buckets(history_and_rows):
+    history, rows = history_and_rows
+    level = history.level(1)
+    pairs = rows.reshape(-1, 2, 3)[:, :, 1:]
+    complete = ~np.isnan(pairs).any(axis=1)
+    assert np.allclose(level[:, 5:7][complete], pairs.mean(axis=1)[complete])
+
+
+def test_render_keeps_the_extremes_of_the_view(history_and_rows):
+    history, rows = history_and_rows
+    x_min, x_max = 5.0, 35.0
+    x, y = history.render(0, x_min, x_max, 50)
+    # The level drawn has one or two buckets per pixel
+    assert len(x) <= 4 * (50 + 2)
+    in_view = (rows[:, 0] >= x_min) & (rows[:, 0] <= x_max)
+    values = rows[in_view, 1]
+    assert y.max() >= np.nanmax(values)
+    assert y.min() <= np.nanmin(values)
+    assert not np.isnan(y).any()
+
+
+def test_render_of_a_narrow_view_draws_the_samples(history_and_rows):
+    history, rows = history_and_rows
+    x, y = history.render(1, 10.0, 10.5, 1000)
+    present = ~np.isnan(rows[:, 2])
+    expected = minmax_decimate(rows[present, 0], rows[present, 2], 10.0, 10.5, 1000)
+    assert np.array_equal(x, expected[0])
+    assert np.array_equal(y, expected[1])
+
+
+def test_memory_history_keeps_the_newest_rows():
+    rows = make_rows(3000)
+    history = PlotHistory(2, 1000)
+    append_in_chunks(history, rows, 300)
+    assert len(history) == 1000
+    assert np.array_equal(history.view(), rows[-1000:], equal_nan=True)
+    assert np.array_equal(history.column(0), rows[-1000:, 0])
+
+
+def test_disk_history_keeps_every_row(tmp_path):
+    rows = make_rows(3000)
+    path = str(tmp_path / "history")
+    history = PlotHistory(2, 1000, path)
+    append_in_chunks(history, rows, 300)
+    assert len(history) == 3000
+    assert np.array_equal(history.column(0), rows[:, 0])
+    # Export still takes the rows kept in memory
+    assert np.array_equal(history.view(), rows[-1000:], equal_nan=True)
+    assert len(history.level(10)) == 2
+    history.close()
+    assert glob.glob(path + "*") == []
+
+
+def test_rows_dropped_before_a_merge_still_reach_the_pyramid(monkeypatch):
+    monkeypatch.setattr(plot_history, "PYRAMID_BLOCK", 10**9)
+    rows = make_rows(256)
+    history = PlotHistory(2, 64)
+    append_in_chunks(history, rows, 48)
+    # The newest 64 rows, in buckets of 4
+    assert np.array_equal(history.level(2)[:, 0], rows[-64::4, 0])
+
+
+def test_clear():
+    history = PlotHistory(2, 256)
+    history.append(make_rows(100))
+    history.clear()
+    assert len(history) == 0
+    assert len(history.level(1)) == 0
+    history.append(make_rows(4))
+    assert len(history.level(1)) == 2
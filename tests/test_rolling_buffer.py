@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.rolling_buffer import RollingBuffer
+
+
+def rows(start, n):
+    return np.column_stack([np.arange(start, start + n), -np.arange(start, start + n)])
+
+
+def test_keeps_the_newest_rows_in_order():
+    buffer = RollingBuffer(5)
+    for start in range(0, 23, 3):
+        buffer.append(rows(start, 3))
+        end = start + 3
+        assert len(buffer) == min(end, 5)
+        assert buffer.column(0).tolist() == list(range(max(end - 5, 0), end))
+        assert buffer.column(1).tolist() == [-i for i in buffer.column(0)]
+
+
+def test_single_row_and_oversized_appends():
+    buffer = RollingBuffer(4)
+    buffer.append([1, 2])
+    assert buffer.view().tolist() == [[1, 2]]
+    buffer.append(rows(0, 10))
+    assert buffer.column(0).tolist() == [6, 7, 8, 9]
+
+
+def test_view_of_the_newest_n_rows():
+    buffer = RollingBuffer(8)
+    buffer.append(rows(0, 6))
+    assert buffer.view(2).tolist() == [[4, -4], [5, -5]]
+    assert len(buffer.view(100)) == 6
+
+
+def test_columns_are_contiguous():
+    buffer = RollingBuffer(8, 3)
+    buffer.append(np.ones((5, 3)))
+    assert buffer.column(2).flags["C_CONTIGUOUS"]
+
+
+def test_views_stay_valid_after_later_appends():
+    buffer = RollingBuffer(4)
+    buffer.append(rows(0, 4))
+    view = buffer.view()
+    for start in range(4, 40, 3):
+        buffer.append(rows(start, 3))
+    assert view[:, 0].tolist() == [0, 1, 2, 3]
+
+
+def test_clear():
+    buffer = RollingBuffer(4)
+    buffer.append(rows(0, 3))
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.append(rows(10, 1))
+    assert buffer.view().tolist() == [[10, -10]]
+
+
+def test_rejects_an_empty_capacity():
+    with pytest.raises(ValueError):
+        RollingBuffer(0)
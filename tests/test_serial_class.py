@@ -0,0 +1,40 @@
+import pytest
+
+from src.serial_class import SerialClass
+
+
+@pytest.fixture
+def capture():
+    capture = SerialClass(cachesize=8)
+    capture.rx_partial = b""
+    yield capture
+    capture.close()
+
+
+def read_all(capture, chunks):
+    """Lines _read_lines returns for each chunk, read one after the other"""
+    chunks = list(chunks)
+    capture._read_chunk = lambda: chunks.pop(0)
+    return [capture._read_lines() for _ in range(len(chunks))]
+
+
+def test_line_split_across_reads_is_carried_over(capture):
+    reads = read_all(capture, [b"m1::a:1\nm2::a", b":2\nm3::", b"a:3\n"])
+    assert reads == [["m1::a:1"], ["m2::a:2"], ["m3::a:3"]]
+    assert capture.rx_partial == b""
+
+
+def test_line_endings_are_stripped(capture):
+    reads = read_all(capture, [b"m1::a:1\r\nm2::a:2\r", b"\nm3::a:3\r\n"])
+    assert reads == [["m1::a:1"], ["m2::a:2", "m3::a:3"]]
+
+
+def test_empty_chunk_keeps_the_partial_line(capture):
+    reads = read_all(capture, [b"m1::a:1\nm2::", b"", b"a:2\n", b""])
+    assert reads == [["m1::a:1"], [], ["m2::a:2"], []]
+    assert capture.rx_partial == b""
+
+
+def test_undecodable_bytes_are_replaced(capture):
+    reads = read_all(capture, [b"m1::a:\xff\n"])
+    assert reads == [["m1::a:\ufffd"]]
@@ -0,0 +1,93 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from src.shared_buffers import SharedCounters, SharedRingBuffer
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(capacity=8, max_channels=3)
+    yield ring
+    ring.unlink()
+
+
+def rows(start, n, n_channels=2):
+    timestamps = np.arange(start, start + n, dtype=np.int64)
+    values = np.arange(start, start + n, dtype=np.float64)[:, None] * np.ones(
+        n_channels
+    )
+    return timestamps, values
+
+
+def test_read_returns_rows_written_since_cursor(ring):
+    ring.write(*rows(0, 5))
+    timestamps, values, cursor, n_overwritten = ring.read(0)
+    assert timestamps.tolist() == [0, 1, 2, 3, 4]
+    assert values.shape == (5, 2)
+    assert cursor == 5
+    assert n_overwritten == 0
+
+    ring.write(*rows(5, 2))
+    timestamps, values, cursor, n_overwritten = ring.read(cursor)
+    assert timestamps.tolist() == [5, 6]
+    assert values[:, 0].tolist() == [5, 6]
+    assert cursor == 7
+
+
+def test_wraps_around_and_counts_overwritten_rows(ring):
+    ring.write(*rows(0, 6))
+    ring.write(*rows(6, 6))
+    timestamps, values, cursor, n_overwritten = ring.read(0)
+    assert timestamps.tolist() == list(range(4, 12))
+    assert values[:, 1].tolist() == list(range(4, 12))
+    assert cursor == 12
+    assert n_overwritten == 4
+
+
+def test_write_larger_than_capacity_keeps_newest(ring):
+    ring.write(*rows(0, 20))
+    timestamps, _, cursor, n_overwritten = ring.read(0)
+    assert timestamps.tolist() == list(range(12, 20))
+    assert cursor == 20
+    assert n_overwritten == 12
+
+
+def test_extra_channels_are_dropped_and_missing_ones_are_nan(ring):
+    ring.write(*rows(0, 2, n_channels=5))
+    assert ring.n_channels() == 3
+    ring.write(*rows(2, 1, n_channels=1))
+    _, values, _, _ = ring.read(0)
+    assert values.shape == (3, 3)
+    assert np.isnan(values[2, 1:]).all()
+
+
+def test_reset_restarts_readers(ring):
+    ring.write(*rows(0, 4))
+    _, _, cursor, _ = ring.read(0)
+    ring.reset()
+    ring.write(*rows(100, 2))
+    timestamps, _, cursor, _ = ring.read(cursor)
+    assert timestamps.tolist() == [100, 101]
+    assert cursor == 2
+
+
+def test_pickled_ring_attaches_to_the_same_block(ring):
+    ring.write(*rows(0, 3))
+    copy = pickle.loads(pickle.dumps(ring))
+    try:
+        timestamps, _, _, _ = copy.read(0)
+        assert timestamps.tolist() == [0, 1, 2]
+    finally:
+        copy.close()
+
+
+def test_counters():
+    counters = SharedCounters(["a", "b"])
+    counters.add("a")
+    counters.add("a", 2.5)
+    counters["b"] = 7
+    assert counters.as_dict() == {"a": 3.5, "b": 7}
+    counters.reset()
+    assert counters["a"] == 0
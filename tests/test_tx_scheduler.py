@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+from src.tx_scheduler import TXScript, parse_duration_ns, play_script
+
+MS = 1_000_000
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("1.5", 1_500 * MS),
+        ("2s", 2_000 * MS),
+        ("10ms", 10 * MS),
+        ("250us", 250_000),
+        (".5ms", MS // 2),
+    ],
+)
+def test_parse_duration(text, expected):
+    assert parse_duration_ns(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "ms", "-1", "1min", "1.5.2"])
+def test_parse_invalid_duration(text):
+    with pytest.raises(ValueError):
+        parse_duration_ns(text)
+
+
+def test_parse_script():
+    script = TXScript.parse(
+        """
+        # Comment
+        0 reset
+        +10ms arm now
+        every 5ms x3 ping
+        1.5 fire
+        """,
+        "CRLF",
+    )
+    assert script.entries == [
+        (0, "reset"),
+        (10 * MS, "arm now"),
+        (15 * MS, "ping"),
+        (20 * MS, "ping"),
+        (25 * MS, "ping"),
+        (1_500 * MS, "fire"),
+    ]
+    assert script.line_ending == "CRLF"
+    assert script.duration() == 1.5
+    assert len(script) == 6
+
+
+def test_entries_are_sorted():
+    script = TXScript.parse("1 b\n0.5 a\n")
+    assert [command for _, command in script.entries] == ["a", "b"]
+
+
+@pytest.mark.parametrize("text", ["5", "every 5ms 3 ping", "every 5ms x3", "soon go"])
+def test_parse_errors_name_the_line(text):
+    with pytest.raises(ValueError, match="Line 2"):
+        TXScript.parse("0 ok\n" + text)
+
+
+def test_empty_script():
+    script = TXScript.parse("# nothing\n\n")
+    assert len(script) == 0
+    assert script.duration() == 0
+
+
+def test_play_sends_every_command_on_time():
+    script = TXScript.parse("0 a\n+20ms b\n+20ms c\n")
+    sent = []
+    start = time.perf_counter()
+
+    def send(message):
+        sent.append((time.perf_counter() - start, message))
+
+    assert play_script(script, send, threading.Event()) == 3
+    assert [message.message for _, message in sent] == ["a", "b", "c"]
+    assert [message.line_ending for _, message in sent] == ["LF"] * 3
+    # Never early, the loose upper bound only keeps a busy machine from failing
+    for (elapsed, _), due in zip(sent, [0, 0.02, 0.04]):
+        assert due <= elapsed < due + 0.05
+    scheduled = [message.scheduled_ns for _, message in sent]
+    assert [b - a for a, b in zip(scheduled, scheduled[1:])] == [20 * MS, 20 * MS]
+
+
+def test_stop_event_ends_the_script():
+    script = TXScript.parse("0 a\n+10s b\n")
+    stop_event = threading.Event()
+    sent = []
+
+    def send(message):
+        sent.append(message)
+        stop_event.set()
+
+    start = time.perf_counter()
+    assert play_script(script, send, stop_event) == 1
+    assert time.perf_counter() - start < 1
+    assert [message.message for message in sent] == ["a"]